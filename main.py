@@ -35,12 +35,22 @@ from __future__ import print_function
 import sys
 import time
 import argparse
+import tempfile
+
+import numpy as np
 
 from resyst import metadata
 from resyst.machine import *
 from resyst.dataset import *
 from resyst.log import *
 from resyst.features import *
+from resyst.stats import BYTE_ORDERS
+from resyst.cache import FeatureCache
+from resyst.cache import DEFAULT_CACHE_SIZE
+from resyst.journal import FeatureJournal
+from resyst.manifest import CorpusManifest
+from resyst.store import memory_map_matrix
+from resyst.search import SuccessiveHalvingSearch
 from sklearn.preprocessing import normalize
 from sklearn.datasets import dump_svmlight_file
 import sklearn
@@ -57,6 +67,9 @@ ACTION_TEST = 'test'
 ACTION_PREDICT = 'predict'
 ACTION_CLEAN = 'clean'
 ACTION_ANALYZE = 'analyze'
+JOURNAL_SUFFIX = '.journal'
+SEARCH_GRID = 'grid'
+SEARCH_HALVING = 'halving'
 
 ACTIONS = [
     ACTION_TRAIN,
@@ -162,7 +175,8 @@ train_options.add_argument("-sd", "--source-dir",
                            help="Directory containing files to use for training purposes.")
 train_options.add_argument("-of", "--output-file",
                            dest="training_results",
-                           help="File into which the training results will be written for testing and prediction.")
+                           help="Feature store directory into which the training results will be written for "
+                                "testing and prediction. Results are written as JSON if the name ends with '.json'.")
 train_options.add_argument("-f", "--features",
                            dest="selected_features",
                            choices=available_features.keys(),
@@ -174,10 +188,68 @@ train_options.add_argument("-ss", "--segment-size",
                            type=int,
                            default=0,
                            help="Specifies a segment size when dividing file objects.")
+train_options.add_argument("-sq", "--segment-quota",
+                           dest="segment_quota",
+                           type=int,
+                           default=0,
+                           help="Keeps a random sample of at most this number of segments per label, "
+                                "chosen in a single pass over the sample files.")
+train_options.add_argument("-se", "--seed",
+                           dest="seed",
+                           type=int,
+                           help="Seed of the random sample of segments.")
+train_options.add_argument("-wo", "--word-order",
+                           dest="word_order",
+                           choices=BYTE_ORDERS,
+                           type=str.lower,
+                           help="Byte order of the 16-bit words used by the word features. "
+                                "Defaults to the native byte order.")
+train_options.add_argument("-mm", "--memory-map",
+                           dest="memory_map",
+                           action="store_true",
+                           help="Memory-map sample files when needed instead of reading them all in memory.")
+train_options.add_argument("-st", "--stream",
+                           dest="stream",
+                           action="store_true",
+                           help="Extract features by reading sample files in blocks, for files larger than memory.")
+train_options.add_argument("-j", "--jobs",
+                           dest="jobs",
+                           type=int,
+                           default=os.cpu_count(),
+                           help="Number of worker processes used to extract features, or to search parameters "
+                                "and cross-validate classifiers when testing. Defaults to the number of processors.")
+train_options.add_argument("-bs", "--batch-size",
+                           dest="batch_size",
+                           type=int,
+                           default=DEFAULT_BATCH_SIZE,
+                           help="Number of code objects sent to a worker process at once.")
+train_options.add_argument("-io", "--io-threads",
+                           dest="io_threads",
+                           type=int,
+                           default=DEFAULT_IO_WORKERS,
+                           help="Number of threads reading sample files while loading them.")
+train_options.add_argument("-ar", "--archives",
+                           dest="archives",
+                           action="store_true",
+                           help="Load the members of the zip, tar, gz, bz2 and xz archives found in the source "
+                                "directory instead of the archives themselves, without extracting them to disk.")
+train_options.add_argument("-mf", "--manifest",
+                           dest="manifest",
+                           help="File recording the sample files loaded, so unchanged files are not read "
+                                "again on the next training.")
+train_options.add_argument("-fc", "--feature-cache",
+                           dest="feature_cache",
+                           help="Database file caching the features extracted from each sample, so unchanged "
+                                "samples are not processed again on the next training.")
+train_options.add_argument("-cz", "--cache-size",
+                           dest="cache_size",
+                           type=int,
+                           default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                           help="Maximum size of the feature cache, in MiB.")
 test_options = arg_parser.add_argument_group("Testing Options", "Available options for testing the program.")
 test_options.add_argument("-tf", "--training-file",
                           dest="training_file",
-                          help="File created as the result of the training file.")
+                          help="Feature store directory or JSON file created as the result of the training.")
 test_options.add_argument("-tr", "--testing-ratio",
                           dest="testing_ratio",
                           type=ratio,
@@ -185,6 +257,38 @@ test_options.add_argument("-tr", "--testing-ratio",
 test_options.add_argument("-cf", "--classifier",
                           dest="classifier_file",
                           help="The classifier with the highest accuracy will be saved to this file.")
+test_options.add_argument("-sm", "--search-mode",
+                          dest="search_mode",
+                          choices=[SEARCH_GRID, SEARCH_HALVING],
+                          default=SEARCH_GRID,
+                          help="Search the parameters of the SVM classifier exhaustively ('grid') or by "
+                               "evaluating them on growing subsamples and dropping the weakest ('halving').")
+test_options.add_argument("-sb", "--search-budget",
+                          dest="search_budget",
+                          type=int,
+                          help="Maximum number of samples used by the last round of the 'halving' search. "
+                               "Defaults to all the samples.")
+test_options.add_argument("-ka", "--kernel-approximation",
+                          dest="kernel_approximation",
+                          choices=APPROX_METHODS,
+                          help="Also validate an SVM approximating the RBF kernel with Nystroem ('nystroem') or "
+                               "random Fourier ('fourier') features followed by a linear SVM, which scales to "
+                               "many more samples than the exact SVM.")
+test_options.add_argument("-kc", "--kernel-components",
+                          dest="kernel_components",
+                          type=int,
+                          default=DEFAULT_APPROX_COMPONENTS,
+                          help="Number of dimensions of the approximated kernel feature map.")
+test_options.add_argument("-ic", "--incremental",
+                          dest="incremental",
+                          action="store_true",
+                          help="Train incremental classifiers on batches of features read from the training "
+                               "file, without loading all of them in memory.")
+test_options.add_argument("-tb", "--training-batch-size",
+                          dest="training_batch_size",
+                          type=int,
+                          default=DEFAULT_TRAIN_BATCH_SIZE,
+                          help="Number of samples given at once to the incremental classifiers.")
 predict_options = arg_parser.add_argument_group("Predicting Options", "Available options for predicting unknown files.")
 predict_options.add_argument("-uf", "--unknown-file",
                           dest="unknown_file",
@@ -196,12 +300,29 @@ predict_options.add_argument("-uf", "--unknown-file",
 # Main
 #
 
-def action_train_general_file_classification(_source_directory, _output_file, _features, _chunk_size=-1):
+def action_train_general_file_classification(_source_directory, _output_file, _features, _chunk_size=-1,
+                                             _byteorder=None, _mmap=False, _stream=False, _workers=None,
+                                             _batch_size=DEFAULT_BATCH_SIZE, _cache_file=None,
+                                             _cache_size=DEFAULT_CACHE_SIZE, _io_workers=None,
+                                             _manifest_file=None, _archives=False, _segment_quota=0,
+                                             _seed=None):
     """
     TODO: PyDoc
     :param _source_directory:
     :param _output_file:
     :param _features:
+    :param _byteorder: Byte order of the 16-bit words used by the word features.
+    :param _mmap: Memory-map the sample files lazily instead of reading them.
+    :param _stream: Read the sample files in blocks instead of reading them.
+    :param _workers: Number of worker processes used to extract features.
+    :param _batch_size: Number of code objects sent to a worker process at once.
+    :param _cache_file: Database file of the feature cache. If 'None', all features are extracted.
+    :param _cache_size: Maximum size of the feature cache, in bytes.
+    :param _io_workers: Number of threads reading the sample files.
+    :param _manifest_file: Manifest of the sample files. If 'None', all files are read.
+    :param _archives: Load the members of archives rather than the archives.
+    :param _segment_quota: Maximum number of segments kept per label. If not positive, all segments are kept.
+    :param _seed: Seed of the random sample of segments.
     :return:
     """
     assert _source_directory is not None
@@ -210,59 +331,167 @@ def action_train_general_file_classification(_source_directory, _output_file, _f
     assert _features is not None
     assert len(_features) > 0
 
+    fileset = _load_labelled_files(_source_directory, _byteorder, _mmap, _stream, _io_workers,
+                                   _manifest_file, _archives)
+    codeset = _segment_files(fileset, _chunk_size, _segment_quota, _seed)
+
+    info("Extracting features from file set...")
+    start = time.perf_counter()
+    cache = None
+    if _cache_file is not None:
+        cache = FeatureCache(_cache_file, _cache_size)
+    try:
+        if _output_file.lower().endswith(".json"):
+            features = FeatureSet.extract_features_from_fileset(_features, codeset, _workers, _batch_size,
+                                                                _cache=cache)
+        else:
+            # Features are streamed to a journal next to the output, so an
+            # interrupted training resumes where it stopped.
+            journal = _extract_features_to_journal(_output_file + JOURNAL_SUFFIX, _features, codeset,
+                                                   _byteorder, _workers, _batch_size, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+    end = time.perf_counter()
+    info("{ftc:d} feature(s) extracted from {fc:d} file(s) in {ts:f} second(s).".format(
+        ftc=len(codeset)*len(_features), fc=len(codeset), ts=(end-start)
+    ))
+
+    info("Saving extracted features...")
+    start = time.perf_counter()
+    if _output_file.lower().endswith(".json"):
+        features.save_features_to_json(features, _output_file)
+    else:
+        journal.to_store(_output_file)
+        journal.remove()
+    end = time.perf_counter()
+    info("Saved {ftc:d} feature(s) to '{fs:s}' in {ts:f} second(s).".format(
+        ftc=len(codeset)*len(_features), fs=_output_file, ts=(end-start)
+    ))
+
+def _load_labelled_files(_source_directory, _byteorder=None, _mmap=False, _stream=False, _io_workers=None,
+                         _manifest_file=None, _archives=False):
+    """
+    Loads the sample files of the given directory and labels them with their
+    extension. See action_train_general_file_classification.
+
+    :return: A FileSet object.
+    """
     info("Loading files from '{sd:s}'.".format(
         sd=_source_directory
     ))
     fileset = FileSet()
+    manifest = None
+    if _manifest_file is not None:
+        manifest = CorpusManifest(_manifest_file)
     start = time.perf_counter()
-    fileset.load_from_directory(_source_directory)
+    fileset.load_from_directory(_source_directory, _mmap=_mmap, _stream=_stream, _workers=_io_workers,
+                                _manifest=manifest, _archives=_archives)
     end = time.perf_counter()
     info("{fc:d} file(s) added to current data set in {ts:f} second(s).".format(
         fc=len(fileset), ts = (end-start)
     ))
 
     info("Labeling file objects...")
-    files = fileset.data
     start = time.perf_counter()
-    for fileobj in files.values():
+    for fileobj in fileset:
         fileobj.set_extension_as_label()
+        fileobj.byteorder = _byteorder
     end = time.perf_counter()
     info("{fc:d} file(s) labelled in {ts:f} second(s).".format(
         fc=len(fileset), ts = (end-start)
     ))
+    for label, count in sorted(fileset.label_counts().items()):
+        debug("Label '{l:s}': {fc:d} file(s).".format(l=label, fc=count))
+    if manifest is not None:
+        manifest.save()
+    return fileset
+
+
+def _segment_files(_fileset, _chunk_size=-1, _segment_quota=0, _seed=None):
+    """
+    Divides the files of a file set into the code segments features are
+    extracted from. See action_train_general_file_classification.
+
+    :return: A CodeSet object, or the file set itself if the files are not
+    divided.
+    """
+    if _segment_quota > 0:
+        info("Sampling at most {sq:d} segment(s) per label.".format(sq=_segment_quota))
+        reservoir = SegmentReservoir(_segment_quota, _seed=_seed)
+        for fileobj in _fileset:
+            reservoir.add_file(fileobj, _chunk_size)
+        codeset = reservoir.to_codeset()
+        kept = codeset.label_counts()
+        for label, count in sorted(reservoir.seen.items()):
+            info("Label '{l:s}': {kc:d} of {sc:d} segment(s) kept.".format(
+                l=label, kc=kept.get(label, 0), sc=count))
+        return codeset
 
-    codeset = CodeSet()
     if _chunk_size > 0:
         info("Dividing file objects into chunks of {csz:d} byte(s).".format(csz=_chunk_size))
-        for fileobj in files.values():
+        codeset = CodeSet()
+        for fileobj in _fileset:
             codeset.add_code_from_file(fileobj, _chunk_size)
-    else:
-        codeset = fileset
+        return codeset
+    return _fileset
 
-    info("Extracting features from file set...")
-    start = time.perf_counter()
-    features = FeatureSet.extract_features_from_fileset(_features, codeset)
-    end = time.perf_counter()
-    info("{ftc:d} feature(s) extracted from {fc:d} file(s) in {ts:f} second(s).".format(
-        ftc=len(codeset)*len(_features), fc=len(codeset), ts=(end-start)
-    ))
 
-    info("Saving extracted features...")
-    start = time.perf_counter()
-    features.save_features_to_json(features, _output_file)
-    end = time.perf_counter()
-    info("Saved {ftc:d} feature(s) to '{fs:s}' in {ts:f} second(s).".format(
-        ftc=len(codeset)*len(_features), fs=_output_file, ts=(end-start)
-    ))
+def _extract_features_to_journal(_journal_file, _features, _codeset, _byteorder=None, _workers=None,
+                                 _batch_size=DEFAULT_BATCH_SIZE, _cache=None):
+    """
+    Extracts the features of the objects of a code set into a feature journal,
+    skipping the objects already found in the journal.
 
-def action_test_general_file_classification(_training_file, _training_to_test_ratio, _classifier_file_output):
+    :return: The FeatureJournal object, closed.
+    """
+    journal = FeatureJournal(_journal_file, FeatureSet.feature_schema(_features), _byteorder=_byteorder)
+    remaining = _codeset
+    if len(journal) > 0:
+        info("Resuming from {rc:d} row(s) found in '{jf:s}'.".format(rc=len(journal), jf=journal.file))
+        remaining = CodeSet({h: c for h, c in _codeset.data.items() if h not in journal})
+    if len(remaining) > 0:
+        for code_hash, code_features in FeatureSet.iter_features_from_fileset(
+                _features, remaining, _workers, _batch_size, _cache=_cache):
+            journal.append(code_hash, (code_features[Feature.LABEL] or [""])[0], code_features)
+    journal.close()
+    return journal
+
+
+def action_test_general_file_classification(_training_file, _training_to_test_ratio, _classifier_file_output,
+                                            _jobs=1, _search_mode=SEARCH_GRID, _search_budget=None,
+                                            _approximation=None, _components=DEFAULT_APPROX_COMPONENTS):
+    """
+    Loads the features of a training file, searches the parameters of the SVM
+    classifier, cross-validates the k-NN, SVM and decision tree classifiers
+    and saves the most accurate one.
+
+    With more than one job, the feature matrix is memory-mapped in a
+    temporary directory shared by the worker processes.
+
+    :param _training_file: The feature store or JSON file of the features, see
+    action_train_general_file_classification.
+    :param _training_to_test_ratio: Ratio of the samples used for training,
+    between 0 and 1 exclusively.
+    :param _classifier_file_output: The file in which to save the best classifier.
+    :param _jobs: Number of worker processes searching parameters and cross-validating classifiers.
+    :param _search_mode: Search the parameters of the SVM with SEARCH_GRID or SEARCH_HALVING.
+    :param _search_budget: Maximum number of samples of the last round of the SEARCH_HALVING search.
+    :param _approximation: Method approximating the kernel of an additional SVM, one of APPROX_METHODS.
+    If 'None', only the exact SVM is validated.
+    :param _components: Number of dimensions of the approximated kernel feature map.
+    :return:
+    """
     assert _training_file is not None
-    assert os.path.isfile(_training_file)
+    assert os.path.exists(_training_file)
     assert _training_to_test_ratio > 0 and _training_to_test_ratio < 1
 
     info("Loading features from file...")
     start = time.perf_counter()
-    features = FeatureData.load_features_from_json(_training_file)
+    if FeatureStore.is_store(_training_file):
+        features = FeatureData.load_features_from_store(_training_file)
+    else:
+        features = FeatureData.load_features_from_json(_training_file)
     features_vectors, features_labels = features.to_feature_matrix()
 
     end = time.perf_counter()
@@ -270,6 +499,33 @@ def action_test_general_file_classification(_training_file, _training_to_test_ra
         ftc=len(features), fs=_training_file, ts=(end-start)
     ))
 
+    # The worker processes share a memory-mapped copy of the feature matrix
+    # instead of each receiving a pickled copy.
+    with tempfile.TemporaryDirectory(prefix="resyst-") as matrix_directory:
+        if _jobs != 1:
+            features_vectors = memory_map_matrix(features_vectors, matrix_directory)
+        _cross_validate_classifiers(features_vectors, features_labels, _classifier_file_output, _jobs,
+                                    _search_mode, _search_budget, _approximation, _components)
+
+
+def _cross_validate_classifiers(_vectors, _labels, _classifier_file_output, _jobs, _search_mode=SEARCH_GRID,
+                                _search_budget=None, _approximation=None, _components=DEFAULT_APPROX_COMPONENTS):
+    """
+    Searches the parameters of the SVM classifier, cross-validates the
+    classifiers and saves the most accurate one.
+
+    :param _vectors: The normalized feature matrix.
+    :param _labels: The label of each row of the matrix.
+    :param _classifier_file_output: The file in which to save the best classifier.
+    :param _jobs: Number of worker processes searching parameters and cross-validating classifiers.
+    :param _search_mode: Search the parameters of the SVM with SEARCH_GRID or SEARCH_HALVING.
+    :param _search_budget: Maximum number of samples of the last round of the SEARCH_HALVING search.
+    :param _approximation: Method approximating the kernel of an additional SVM, one of APPROX_METHODS.
+    :param _components: Number of dimensions of the approximated kernel feature map.
+    :return:
+    """
+    features_vectors, features_labels = _vectors, _labels
+
     info("Generating classifiers...")
     classifiers = []
     for k in [1, 3]:
@@ -287,8 +543,12 @@ def action_test_general_file_classification(_training_file, _training_to_test_ra
         'C': [128, 256, 512, 1024, 2048, 4096, 8192],
         }
     ]
-    svc_grid_search = GridSearchCV(SVC(C=1), grid_search_space, cv=5,
-                       scoring='precision_macro')
+    if _search_mode == SEARCH_HALVING:
+        svc_grid_search = SuccessiveHalvingSearch(SVC(C=1), grid_search_space, _budget=_search_budget, _cv=5,
+                                                  _scoring='precision_macro', _n_jobs=_jobs)
+    else:
+        svc_grid_search = GridSearchCV(SVC(C=1), grid_search_space, cv=5,
+                           scoring='precision_macro', n_jobs=_jobs)
     svc_grid_search.fit(features_vectors, features_labels)
     info("Optimal parameters for SVM: ")
     for param in svc_grid_search.best_params_:
@@ -296,18 +556,32 @@ def action_test_general_file_classification(_training_file, _training_to_test_ra
             p=param,
             val=str(svc_grid_search.best_params_[param])))
 
-    classifiers.append(SVC(C=svc_grid_search.best_params_['C'],
-                           kernel=svc_grid_search.best_params_['kernel'],
-                           gamma=svc_grid_search.best_params_['gamma']))
+    exact_svm = SVC(C=svc_grid_search.best_params_['C'],
+                    kernel=svc_grid_search.best_params_['kernel'],
+                    gamma=svc_grid_search.best_params_.get('gamma', 'auto'))
+    classifiers.append(exact_svm)
+    approx_svm = None
+    if _approximation is not None:
+        # The approximation always uses the RBF kernel, with the gamma found
+        # for the exact SVM, or the default gamma of SVC if it is linear.
+        gamma = svc_grid_search.best_params_.get('gamma', 'auto')
+        if gamma == 'auto':
+            gamma = 1.0 / features_vectors.shape[1]
+        approx_svm = ApproxSVMClassifier(_C=svc_grid_search.best_params_['C'], _gamma=gamma,
+                                         _method=_approximation, _components=_components).model
+        classifiers.append(approx_svm)
     classifiers.append(DecisionTreeClassifier())
 
     info("Conducting K-Fold Cross Validation...")
     start = time.perf_counter()
     max_accuracy = 0.0
     best_classifier = None
+    accuracies = {}
     for classifier in classifiers:
         info('-'*76)
-        scores = cross_val_score(classifier,features_vectors, features_labels, cv=5)
+        classifier_start = time.perf_counter()
+        scores = cross_val_score(classifier,features_vectors, features_labels, cv=5, n_jobs=_jobs)
+        accuracies[id(classifier)] = (scores.mean(), scores.std() * 2, time.perf_counter() - classifier_start)
         info("\tAccuracy: {acc:0.2f} (+/- {err:0.2f}):\n\t    Classifier: {cls:s}".format(
             cls=repr(classifier), acc=scores.mean(), err=(scores.std() * 2)))
         if scores.mean() > max_accuracy:
@@ -319,6 +593,13 @@ def action_test_general_file_classification(_training_file, _training_to_test_ra
         ts=(end-start)
     ))
 
+    if approx_svm is not None:
+        info('-'*76)
+        info("\t{n:<12s}{a:>10s}{e:>10s}{t:>14s}".format(n="SVM", a="Accuracy", e="+/-", t="Time (s)"))
+        for name, classifier in [("Exact", exact_svm), (_approximation.capitalize(), approx_svm)]:
+            accuracy, error, duration = accuracies[id(classifier)]
+            info("\t{n:<12s}{a:>10.4f}{e:>10.4f}{t:>14.2f}".format(n=name, a=accuracy, e=error, t=duration))
+
     best_classifier.fit(features_vectors, features_labels)
 
     info("="*76)
@@ -327,6 +608,65 @@ def action_test_general_file_classification(_training_file, _training_to_test_ra
     info("Classifier saved to '{cf:s}'.".format(cf=_classifier_file_output))
     joblib.dump(best_classifier, _classifier_file_output)
 
+def action_test_incremental_classification(_training_file, _classifier_file_output,
+                                           _batch_size=DEFAULT_TRAIN_BATCH_SIZE):
+    """
+    Trains incremental classifiers on the features of the training file, one
+    batch of samples at a time, and saves the classifier with the highest
+    progressive validation accuracy.
+
+    Features are read from feature stores in batches, so the number of
+    samples is not limited by the memory available. JSON files are loaded
+    in memory, then given to the classifiers in batches as well.
+
+    :param _training_file: Feature store directory or JSON file created by the training.
+    :param _classifier_file_output: The file in which to save the best classifier.
+    :param _batch_size: Number of samples given at once to the classifiers.
+    :return:
+    """
+    assert _training_file is not None
+    assert os.path.exists(_training_file)
+    assert _batch_size > 0
+
+    if FeatureStore.is_store(_training_file):
+        store = FeatureData.load_features_from_store(_training_file)
+        classes = store.label_names
+        batches = lambda: store.iter_batches(_batch_size, _seed=0)
+    else:
+        features = FeatureData.load_features_from_json(_training_file)
+        features_vectors, features_labels = features.to_feature_matrix()
+        features_labels = as_label_array(features_labels)
+        classes = np.unique(features_labels).tolist()
+        batches = lambda: ((features_vectors[i:i + _batch_size], features_labels[i:i + _batch_size])
+                           for i in range(0, len(features_labels), _batch_size))
+    info("Training incremental classifiers on {lc:d} label(s), {bs:d} sample(s) at a time...".format(
+        lc=len(classes), bs=_batch_size))
+
+    classifiers = [SGDSVMClassifier(), NBClassifier(), PrototypeClassifier()]
+    start = time.perf_counter()
+    max_accuracy = 0.0
+    best_classifier = None
+    for classifier in classifiers:
+        info('-'*76)
+        history = train_incrementally(classifier, batches(), classes)
+        accuracy = history[-1][1] if len(history) > 0 and history[-1][1] is not None else 0.0
+        info("\tProgressive Accuracy: {acc:0.2f} ({sc:d} sample(s)):\n\t    Classifier: {cls:s}".format(
+            cls=str(classifier), acc=accuracy, sc=history[-1][0] if len(history) > 0 else 0))
+        if best_classifier is None or accuracy > max_accuracy:
+            max_accuracy = accuracy
+            best_classifier = classifier
+
+    end = time.perf_counter()
+    info("Concluded training of incremental classifiers in {ts:f} second(s).".format(
+        ts=(end-start)
+    ))
+
+    info("="*76)
+    info("Maximum Accuracy: {ma:.4f}".format(ma=max_accuracy))
+    info("Best Classifier : {bc:s}".format(bc=str(best_classifier)))
+    info("Classifier saved to '{cf:s}'.".format(cf=_classifier_file_output))
+    joblib.dump(best_classifier, _classifier_file_output)
+
 def action_train_filesystem_classification(_source_directory, _output_file, _features,
                                            _general_classifier, _general_features, _chunk_size=-1):
     """
@@ -362,9 +702,8 @@ def action_train_filesystem_classification(_source_directory, _output_file, _fea
     ))
 
     info("Labeling file objects...")
-    files = fileset.data
     start = time.perf_counter()
-    for fileobj in files.values():
+    for fileobj in fileset:
         fileobj.set_extension_as_label()
     end = time.perf_counter()
     info("{fc:d} file(s) labelled in {ts:f} second(s).".format(
@@ -374,7 +713,7 @@ def action_train_filesystem_classification(_source_directory, _output_file, _fea
     codeset = CodeSet()
     if _chunk_size > 0:
         info("Dividing file objects into chunks of {csz:d} byte(s).".format(csz=_chunk_size))
-        for fileobj in files.values():
+        for fileobj in fileset:
             codeset.add_code_from_file(fileobj, _chunk_size)
     else:
         codeset = fileset
@@ -388,12 +727,10 @@ def action_train_filesystem_classification(_source_directory, _output_file, _fea
     predictions = classifier.predict(features_vectors)
     #results = list(zip(file_hashes, predictions))
 
-    labels_counts = {}
-    for prediction in predictions:
-        if prediction in labels_counts.keys():
-            labels_counts[prediction] += 1
-        else:
-            labels_counts[prediction] = 1
+    predicted_labels, counts = np.unique(predictions, return_counts=True)
+    labels_counts = dict(zip(predicted_labels.tolist(), counts.tolist()))
+    for label, count in sorted(labels_counts.items()):
+        info("Label '{l:s}': {pc:d} object(s) predicted.".format(l=str(label), pc=count))
 
 def action_predict_obfuscation(_src_file, _classifier_file, _features):
     assert _src_file is not None
@@ -438,17 +775,41 @@ def main(args):
             _source_directory=source_directory,
             _features=features_to_extract,
             _output_file=training_results_file,
-            _chunk_size=segment_size
+            _chunk_size=segment_size,
+            _byteorder=args.word_order,
+            _mmap=args.memory_map,
+            _stream=args.stream,
+            _workers=args.jobs,
+            _batch_size=args.batch_size,
+            _cache_file=args.feature_cache,
+            _cache_size=args.cache_size * 1024 * 1024,
+            _io_workers=args.io_threads,
+            _manifest_file=args.manifest,
+            _archives=args.archives,
+            _segment_quota=args.segment_quota,
+            _seed=args.seed
         )
     elif program_action == ACTION_TEST:
         training_results_file = args.training_file
         training_to_test_ratio = args.testing_ratio
         classifier_file = args.classifier_file
-        action_test_general_file_classification(
-            _training_file=training_results_file,
-            _training_to_test_ratio=training_to_test_ratio,
-            _classifier_file_output=classifier_file
-        )
+        if args.incremental:
+            action_test_incremental_classification(
+                _training_file=training_results_file,
+                _classifier_file_output=classifier_file,
+                _batch_size=args.training_batch_size
+            )
+        else:
+            action_test_general_file_classification(
+                _training_file=training_results_file,
+                _training_to_test_ratio=training_to_test_ratio,
+                _classifier_file_output=classifier_file,
+                _jobs=args.jobs,
+                _search_mode=args.search_mode,
+                _search_budget=args.search_budget,
+                _approximation=args.kernel_approximation,
+                _components=args.kernel_components
+            )
     elif program_action == ACTION_PREDICT:
         source_file = args.source_directory
         features_to_extract = feature_list(args.selected_features)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.archive
+    ~~~~~~~~~~~~~
+
+    Streaming access to the members of archives.
+
+    Zip archives, tar archives (optionally compressed with gzip, bzip2 or
+    xz) and single files compressed with gzip, bzip2 or xz are supported.
+    Members are decompressed in memory one at a time, in the order they are
+    stored in the archive; nothing is written to disk. Tar archives are read
+    as a stream, without seeking.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import os
+import re
+import bz2
+import gzip
+import lzma
+import tarfile
+import zipfile
+
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+COMPRESSED_EXTENSIONS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+# Exceptions raised when reading a corrupted or truncated archive.
+ARCHIVE_ERRORS = (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError, lzma.LZMAError)
+
+
+def archive_type(_file):
+    """
+    Returns the type of archive of the given file, based on its name.
+
+    :param _file: The name or path of a file.
+    :return: 'zip', 'tar' or 'compressed', or 'None' if the file is not a
+    supported archive.
+    """
+    name = _file.lower()
+    if name.endswith(ZIP_EXTENSIONS):
+        return "zip"
+    if name.endswith(TAR_EXTENSIONS):
+        return "tar"
+    if name.endswith(tuple(COMPRESSED_EXTENSIONS.keys())):
+        return "compressed"
+    return None
+
+
+def is_archive(_file):
+    """
+    Verifies if the given file is a supported archive, based on its name.
+
+    :param _file: The name or path of a file.
+    :return: True if the members of the file can be read by iter_archive().
+    """
+    return archive_type(_file) is not None
+
+
+def iter_archive(_file, _filter=None):
+    """
+    Reads the members of the given archive, one at a time.
+
+    Only regular files are returned. For single compressed files, the only
+    member is named after the archive without its compression extension.
+
+    :param _file: The path of the archive.
+    :param _filter: A regular expression, as a string or compiled pattern,
+    matched against the base name of each member. If 'None', all members are
+    returned.
+    :return: A generator of (name, data) tuples, in which 'name' is the name
+    of the member within the archive and 'data' its decompressed contents.
+    """
+    assert _file is not None
+    assert is_archive(_file), "Unsupported archive: '{f:s}'.".format(f=_file)
+
+    match = None
+    if _filter is not None:
+        match = re.compile(_filter).match
+
+    kind = archive_type(_file)
+    if kind == "zip":
+        members = _iter_zip(_file)
+    elif kind == "tar":
+        members = _iter_tar(_file)
+    else:
+        members = _iter_compressed(_file)
+
+    for name, read in members:
+        if match is None or match(os.path.basename(name)):
+            yield name, read()
+
+
+def _iter_zip(_file):
+    """
+    Lists the regular files of a zip archive.
+    :return: A generator of (name, function reading the member) tuples.
+    """
+    with zipfile.ZipFile(_file) as archive:
+        for info in archive.infolist():
+            if not info.filename.endswith("/"):
+                yield info.filename, lambda: archive.read(info)
+
+
+def _iter_tar(_file):
+    """
+    Lists the regular files of a tar archive, reading it as a stream.
+    :return: A generator of (name, function reading the member) tuples.
+    """
+    with tarfile.open(_file, mode="r|*") as archive:
+        for info in archive:
+            if info.isfile():
+                yield info.name, lambda: archive.extractfile(info).read()
+
+
+def _iter_compressed(_file):
+    """
+    Lists the single file of a compressed file.
+    :return: A generator of one (name, function reading the member) tuple.
+    """
+    name, extension = os.path.splitext(os.path.basename(_file))
+    with COMPRESSED_EXTENSIONS[extension.lower()](_file, "rb") as f:
+        yield name, f.read
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.cache
+    ~~~~~~~~~~~~~
+
+    Persistent cache of extracted feature values.
+
+    Feature values are stored in a SQLite database, keyed by the hash of
+    the content of the code object, the name of the feature and the version
+    of its implementation. Changing the implementation of a feature only
+    requires increasing its version to ignore the values previously cached.
+
+    The cache is bounded in size: once the values stored exceed the maximum
+    size, the least recently used values are evicted. Several processes may
+    read and write the same cache at once; SQLite serializes the writers.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import time
+import pickle
+import sqlite3
+import threading
+
+# Default maximum size of the values stored in a cache, in bytes.
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# When the cache is full, values are evicted until it is filled to this
+# fraction of its maximum size.
+EVICTION_RATIO = 0.9
+
+# Number of seconds to wait for another process to release the database.
+LOCK_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    hash TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (hash, feature, version)
+);
+CREATE INDEX IF NOT EXISTS features_accessed ON features (accessed);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO usage (id, size) VALUES (0, 0);
+"""
+
+
+class FeatureCache(object):
+    def __init__(self, _file, _max_size=DEFAULT_CACHE_SIZE):
+        """
+        Opens the feature cache stored in the given file, creating it if
+        needed.
+
+        :param _file: The SQLite database file of the cache.
+        :param _max_size: The maximum size of the values stored, in bytes.
+        """
+        assert _file is not None
+        assert _max_size > 0
+
+        self.file = _file
+        self.max_size = _max_size
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(_file, timeout=LOCK_TIMEOUT, isolation_level=None,
+                                    check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.executescript(SCHEMA)
+
+    def __len__(self):
+        """
+        Returns the number of values stored in the cache.
+        """
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        self.close()
+
+    @property
+    def size(self):
+        """
+        Returns the size of the values stored in the cache, in bytes.
+        """
+        with self.__lock:
+            return self.__db.execute("SELECT size FROM usage WHERE id = 0").fetchone()[0]
+
+    def get(self, _hash, _keys):
+        """
+        Retrieves the cached values of a code object.
+
+        :param _hash: The hash of the code object.
+        :param _keys: A list of (feature name, version) tuples.
+        :return: A dictionary of the values found, keyed by (feature name,
+        version) tuple. Values missing from the cache are not included.
+        """
+        assert _hash is not None
+
+        return self.get_many([(_hash, _keys)])[0]
+
+    def get_many(self, _items):
+        """
+        Retrieves the cached values of one or more code objects, then updates
+        the access time of the values found in a single write transaction.
+
+        The values are read outside the write transaction, so that readers do
+        not need to upgrade their lock while other processes write.
+
+        :param _items: A list of (hash, keys) tuples, in which 'keys' is a list
+        of (feature name, version) tuples.
+        :return: A list containing, for each item, a dictionary of the values
+        found keyed by (feature name, version) tuple.
+        """
+        assert _items is not None
+
+        now = time.time()
+        results = []
+        accessed = []
+        with self.__lock:
+            for code_hash, keys in _items:
+                rows = self.__db.execute(
+                    "SELECT feature, version, value FROM features WHERE hash = ?", (code_hash,)).fetchall()
+                keys = set(keys)
+                values = {}
+                for feature, version, value in rows:
+                    if (feature, version) in keys:
+                        values[(feature, version)] = pickle.loads(value)
+                if len(values) > 0:
+                    accessed.append((now, code_hash))
+                results.append(values)
+
+            if len(accessed) > 0:
+                self.__db.execute("BEGIN IMMEDIATE")
+                try:
+                    self.__db.executemany("UPDATE features SET accessed = ? WHERE hash = ?", accessed)
+                    self.__db.execute("COMMIT")
+                except:
+                    self.__db.execute("ROLLBACK")
+                    raise
+        return results
+
+    def put(self, _items):
+        """
+        Stores the values of one or more code objects in the cache, in a
+        single transaction, then evicts the least recently used values if the
+        cache is full.
+
+        :param _items: A list of (hash, values) tuples, in which 'values' is a
+        dictionary of feature values keyed by (feature name, version) tuple.
+        """
+        assert _items is not None
+
+        now = time.time()
+        rows = []
+        for code_hash, values in _items:
+            for (feature, version), value in values.items():
+                blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                rows.append((code_hash, feature, version, blob, len(blob), now))
+
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                for row in rows:
+                    self.__delete(row[0], row[1], row[2])
+                    self.__db.execute(
+                        "INSERT INTO features (hash, feature, version, value, size, accessed) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", row)
+                self.__db.execute(
+                    "UPDATE usage SET size = size + ? WHERE id = 0", (sum(row[4] for row in rows),))
+                self.__evict()
+                self.__db.execute("COMMIT")
+            except:
+                self.__db.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        """
+        Removes all the values stored in the cache.
+        """
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            self.__db.execute("DELETE FROM features")
+            self.__db.execute("UPDATE usage SET size = 0 WHERE id = 0")
+            self.__db.execute("COMMIT")
+
+    def close(self):
+        """
+        Closes the database of the cache.
+        """
+        with self.__lock:
+            self.__db.close()
+
+    def __delete(self, _hash, _feature, _version):
+        """
+        Removes a value from the cache, if present, and updates the size of
+        the cache. Must be called within a transaction.
+        """
+        row = self.__db.execute(
+            "SELECT size FROM features WHERE hash = ? AND feature = ? AND version = ?",
+            (_hash, _feature, _version)).fetchone()
+        if row is not None:
+            self.__db.execute(
+                "DELETE FROM features WHERE hash = ? AND feature = ? AND version = ?",
+                (_hash, _feature, _version))
+            self.__db.execute("UPDATE usage SET size = size - ? WHERE id = 0", row)
+
+    def __evict(self):
+        """
+        Evicts the least recently used values until the cache is filled to
+        EVICTION_RATIO of its maximum size. Must be called within a transaction.
+        """
+        size = self.__db.execute("SELECT size FROM usage WHERE id = 0").fetchone()[0]
+        if size <= self.max_size:
+            return
+
+        target = int(self.max_size * EVICTION_RATIO)
+        cursor = self.__db.execute(
+            "SELECT rowid, size FROM features ORDER BY accessed")
+        evicted = []
+        for rowid, value_size in cursor:
+            if size <= target:
+                break
+            evicted.append((rowid,))
+            size -= value_size
+        cursor.close()
+
+        self.__db.executemany("DELETE FROM features WHERE rowid = ?", evicted)
+        self.__db.execute("UPDATE usage SET size = ? WHERE id = 0", (size,))
@@ -11,38 +11,87 @@
 """
 
 import os
-import math
-import struct
+import mmap
 import hashlib
+import threading
 
 from resyst.log import *
+from resyst.labels import LABELS
+from resyst.stats import ByteStatistics
+from resyst.stats import RunLengths
+from resyst.stats import word_histogram
+from resyst.streaming import FeatureAccumulator
+from resyst.streaming import STREAM_BLOCK_SIZE
+
+# Number of bytes digested by CodeObject.prefix_digest().
+PREFIX_SIZE = 4096
 
 
 class LabelledObject(object):
     def __init__(self, _labels=None):
         """
         Initializes the object with the given labels if any.
+
+        Labels are stored as the ids assigned by the label dictionary. See
+        resyst.labels.
+
         :param _labels: A list of label to add to the object.
         """
-        if _labels is None:
-            self.__labels = []
-        else:
-            self.__labels = _labels
+        self.__label_ids = ()
+        if _labels is not None:
+            self.add_labels(_labels)
 
     def __str__(self):
         """
         Returns a comma-separated string of the labels.
         :return: A comma-separated string of the labels.
         """
-        return ','.join(self.__labels)
+        return ','.join(self.labels)
+
+    def __getstate__(self):
+        """
+        Returns the state of the object for pickling.
+
+        Label ids are specific to the process, so the labels are pickled as
+        strings.
+        """
+        state = self.__dict__.copy()
+        state["_LabelledObject__label_ids"] = self.labels
+        return state
+
+    def __setstate__(self, _state):
+        """
+        Restores the state of the object after unpickling.
+        """
+        self.__dict__.update(_state)
+        self.__label_ids = LABELS.ids(self.__label_ids)
 
     @property
     def labels(self):
         """
         Returns the list of labels associated with this object.
-        :return: The list of labels associated with this object.
+        :return: A new list of the labels associated with this object.
+        """
+        return LABELS.names(self.__label_ids)
+
+    @property
+    def label_ids(self):
+        """
+        Returns the ids of the labels associated with this object.
+        :return: A tuple of label ids.
         """
-        return self.__labels
+        return self.__label_ids
+
+    @property
+    def primary_label_id(self):
+        """
+        Returns the id of the first label of this object. Objects without
+        labels are given the id of the empty label, "".
+        :return: A label id.
+        """
+        if len(self.__label_ids) > 0:
+            return self.__label_ids[0]
+        return LABELS.id("")
 
     def add_label(self, _label):
         """
@@ -52,11 +101,21 @@ class LabelledObject(object):
         :return:
         """
         assert _label is not None
-        if _label not in self.__labels:
+        label_id = LABELS.id(_label)
+        if label_id not in self.__label_ids:
             debug("Adding label '{l:s}' to object '{os:s}'.".format(
                 l=_label, os=str(self)
             ))
-            self.__labels.append(_label)
+            self.__label_ids += (label_id,)
+
+    def _copy_labels(self, _other):
+        """
+        Replaces the labels of this object by those of another object. Only
+        used on objects just created, such as segments, which are not in a
+        data set yet.
+        :param _other: A LabelledObject.
+        """
+        self.__label_ids = _other.label_ids
 
     def add_labels(self, _labels):
         assert _labels is not None
@@ -65,21 +124,79 @@ class LabelledObject(object):
             self.add_label(l)
 
 class CodeObject(LabelledObject):
-    def __init__(self, _binarydata):
+    def __init__(self, _binarydata, _byteorder=None, _offset=0, _length=None):
+        """
+        Creates a code object holding the given binary data.
+
+        The object does not copy the data it is given: it keeps a memoryview
+        over it, along with the offset and length of the region of the data
+        it represents. Multiple code objects, such as the segments created by
+        split_by_size(), can therefore share the same underlying buffer.
+
+        :param _binarydata: The binary data of the object. Cannot be 'None'.
+        :param _byteorder: The default byte order, 'little' or 'big', used to read
+        16-bit words from the data. If 'None', the native byte order is used.
+        :param _offset: Offset, in bytes, of the region of the data represented
+        by this object.
+        :param _length: Length, in bytes, of the region of the data represented
+        by this object. If 'None', the region extends to the end of the data.
+        """
         assert _binarydata is not None
         super().__init__()
-        self._hash = None
-        self._data = _binarydata
+        self._digest = None
+        self._cache = {}
+        self.__set_buffer(_binarydata, _offset, _length)
+        self.byteorder = _byteorder
+
+    def __getstate__(self):
+        """
+        Returns the state of the object for pickling.
+
+        Memoryviews cannot be pickled, so only the region of the buffer
+        represented by this object is copied into the state. Cached
+        intermediate results are not included.
+        """
+        state = super().__getstate__()
+        state["_view"] = self._data.tobytes()
+        state["_offset"] = 0
+        state["_cache"] = {}
+        return state
+
+    def __setstate__(self, _state):
+        """
+        Restores the state of the object after unpickling.
+        """
+        super().__setstate__(_state)
+        if self._view is not None:
+            self._view = memoryview(self._view)
+
+    def __set_buffer(self, _binarydata, _offset=0, _length=None):
+        """
+        Sets the buffer shared by this object and the region of this buffer
+        the object represents.
+        """
+        if isinstance(_binarydata, str):
+            _binarydata = _binarydata.encode("utf-8")
+        buffer = memoryview(_binarydata)
+        if buffer.format != "B" or buffer.ndim != 1:
+            buffer = buffer.cast("B")
+        if _length is None:
+            _length = len(buffer) - _offset
+        assert 0 <= _offset and _offset + _length <= len(buffer)
+
+        self._view = buffer
+        self._offset = _offset
+        self._length = _length
 
     def __str__(self):
-        fmt = "<CodeObject Size={s:d} byte(s), MD5={h:s}>"
-        return fmt.format(s=len(self._data), h=self.md5())
+        fmt = "<CodeObject Size={s:d} byte(s), Offset={o:d}>"
+        return fmt.format(s=len(self), o=self._offset)
 
     def __len__(self):
         """
         Returns the length of the binary object.
         """
-        return len(self._data)
+        return self._length
 
     def __eq__(self, _other):
         """
@@ -111,29 +228,162 @@ class CodeObject(LabelledObject):
         """
         return not self.__eq__(_other)
 
+    @property
+    def _buffer(self):
+        """
+        Returns the memoryview over the whole buffer shared by this object.
+        """
+        return self._view
+
+    @property
+    def _data(self):
+        """
+        Returns a memoryview over the binary data held by this object. No
+        copy of the data is made.
+        """
+        return self._buffer[self._offset:self._offset + self._length]
+
+    @_data.setter
+    def _data(self, _binarydata):
+        """
+        Replaces the binary data held by this object and invalidates all
+        the intermediate results computed from the previous data.
+        """
+        self.__set_buffer(_binarydata)
+        self._digest = None
+        self.invalidate_cache()
+
+    @property
+    def offset(self):
+        """
+        Returns the offset of the data of this object within its buffer.
+        :return: The offset, in bytes, of the data within the shared buffer.
+        """
+        return self._offset
+
+    def invalidate_cache(self, _name=None):
+        """
+        Removes intermediate results from the cache of this object.
+
+        Intermediate results, such as the byte histogram or the word frequency
+        distribution, are computed once and shared by all the features derived
+        from them. This function drops either a single intermediate result or
+        all of them, releasing the memory they use. Dropped results will be
+        computed again when needed.
+
+        :param _name: The name of the intermediate result to drop. If 'None',
+        all intermediate results are dropped.
+        :return:
+        """
+        if _name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(_name, None)
+
+    def release(self):
+        """
+        Releases the resources held by this object which can be recovered
+        later on, i.e. its cached intermediate results.
+        :return:
+        """
+        self.invalidate_cache()
+
+    def has_intermediate(self, _name):
+        """
+        Verifies if the given intermediate result can be obtained without
+        computing the intermediate results it is derived from.
+
+        :param _name: The name of the intermediate result.
+        :return: True if the intermediate result is already cached.
+        """
+        return _name in self._cache
+
+    @property
+    def cached_intermediates(self):
+        """
+        Returns the names of the intermediate results currently cached.
+        :return: A list containing the names of the cached intermediate results.
+        """
+        return list(self._cache.keys())
+
+    def _cached(self, _name, _factory):
+        """
+        Returns the cached intermediate result with the given name, computing
+        it with the provided function if it is not in the cache yet.
+
+        :param _name: The name of the intermediate result.
+        :param _factory: A function without arguments computing the result.
+        :return: The intermediate result.
+        """
+        if _name not in self._cache:
+            self._cache[_name] = _factory()
+        return self._cache[_name]
+
     @property
     def get_data(self):
         """
         Returns the data currently held by this object.
 
-        @return Data contained in this object.
+        @return A memoryview over the data contained in this object.
         """
         return self._data
 
+    @property
+    def digest(self):
+        """
+        Returns the binary SHA224 digest of the current code object.
+
+        The digest is calculated the first time it is requested and stored
+        to prevent recalculation of the value later on.
+
+        :return: The 28-byte SHA224 digest of the contents of the object.
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha224(self._data).digest()
+        return self._digest
+
+    @property
+    def has_digest(self):
+        """
+        Verifies if the digest of the current code object is already known,
+        so that requesting it does not read the data of the object.
+        """
+        return self._digest is not None
+
+    @property
+    def loaded(self):
+        """
+        Verifies if the data of the current code object is in memory. Code
+        objects always hold their data; file objects may map theirs lazily.
+        """
+        return True
+
     @property
     def hash(self):
         """
         Returns the hash of the current code object.
 
-        This function will calculate the SHA224 hash of the contents
-        of this code object. The first time the hash of the object is request, the
-        value is store to prevent recalculation of the value later on.
+        This function will return the hexadecimal representation of the SHA224
+        digest of the contents of this code object. See CodeObject.digest.
 
         :return: The SHA224 hash of the contents of the object.
         """
-        if self._hash is None:
-            self._hash = self.sha224()
-        return self._hash
+        return self.digest.hex()
+
+    def prefix_digest(self, _size=PREFIX_SIZE):
+        """
+        Returns a short digest of the first bytes of the current code object.
+
+        This digest is cheaper to compute than the full digest of large objects
+        and is used to tell apart objects of the same size before hashing them
+        completely. Objects of at most '_size' bytes return their full digest.
+
+        :param _size: The number of bytes to digest.
+        :return: A bytes object.
+        """
+        if len(self) <= _size:
+            return self.digest
+        return hashlib.blake2b(self._data[:_size], digest_size=16).digest()
 
     def split_by_size(self, _chunksize):
         """
@@ -142,18 +392,56 @@ class CodeObject(LabelledObject):
         This function will return a generator containing a the current
         code object divided into multiple chunks of the specified size.
 
+        The chunks are created by segment() and do not copy the data of the
+        current object. An object smaller than the chunk size results in a
+        single chunk.
+
         @param _chunksize The size, in bytes of the chunks
         @return A generator containing the chunks of data.
 
         Reference:
             https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks
         """
-        assert _chunksize < len(self._data)
+        assert _chunksize > 0
+
+        for i in range(0, len(self), _chunksize):
+            yield self.segment(i, min(_chunksize, len(self) - i))
 
-        for i in range(0, len(self._data), _chunksize):
-            code_obj = CodeObject(self._data[i:i + _chunksize])
-            code_obj.add_labels(self.labels)
-            yield code_obj
+    def segment(self, _offset, _length):
+        """
+        Returns a code object representing a region of the current object.
+
+        The segment does not copy the data of the current object; it is a view
+        over the same buffer. It inherits the byte order and labels of the
+        current object.
+
+        :param _offset: The offset of the region within the current object.
+        :param _length: The length of the region.
+        :return: A CodeObject.
+        """
+        assert _offset >= 0 and _length >= 0
+        assert _offset + _length <= len(self)
+
+        code_obj = CodeObject(self._buffer, self.byteorder,
+                              _offset=self._offset + _offset,
+                              _length=_length)
+        code_obj._copy_labels(self)
+        return code_obj
+
+    def detach(self):
+        """
+        Returns a copy of the current object holding its own copy of the data.
+
+        Segments share the buffer of the object they were created from, which
+        cannot be released while they exist. A detached copy only keeps the
+        bytes it represents, so the original buffer can be freed.
+
+        :return: A CodeObject with the same data, byte order, labels and hash.
+        """
+        code_obj = CodeObject(self._data.tobytes(), self.byteorder)
+        code_obj._copy_labels(self)
+        code_obj._digest = self._digest
+        return code_obj
 
     def to_file(self, _file, _mode="wb"):
         """
@@ -186,15 +474,29 @@ class CodeObject(LabelledObject):
         @return A dictionary containing the frequency of each byte within the
         current binary object.
         """
-        dist = {}
-        for b in self._data:
-            if b in dist:
-                dist[b] += 1
-            else:
-                dist[b] = 1
-        return dist
+        histogram = self.byte_statistics().histogram
+        return {int(b): int(histogram[b]) for b in histogram.nonzero()[0]}
+
+    def word_histogram(self, _byteorder=None):
+        """
+        Counts the occurrences of each 16-bit word of the current binary object.
+
+        The histogram is computed in a single pass over the data and cached,
+        so any number of word frequency queries can be answered from it.
+        If the object contains an odd number of bytes, the last byte is
+        ignored.
+
+        @param _byteorder The byte order of the words, 'little' or 'big'. If
+        'None', the byte order of the object is used.
+        @return A numpy array of 65536 integers in which the value at index i
+        is the number of occurrences of the word i.
+        """
+        byteorder = self.byteorder if _byteorder is None else _byteorder
+        return self._cached(
+            "word_histogram:{bo!s}".format(bo=byteorder),
+            lambda: word_histogram(self._data, byteorder))
 
-    def wfd(self):
+    def wfd(self, _byteorder=None):
         """
         Calculates the word frequency distribution of the current
         binary object.
@@ -203,48 +505,59 @@ class CodeObject(LabelledObject):
         elements rather than bytes. The results will be stored in a dictionary
         in which the words are the keys, and their frequencies are the values.
 
+        @param _byteorder The byte order of the words, 'little' or 'big'. If
+        'None', the byte order of the object is used.
         @return A dictionary containing the frequency of each wprd within the
         current binary object.
         """
-        dist = {}
-        for i in range(0, len(self._data), 2):
-            # If there is an odd number of bytes, we drop the
-            # last bytes.
-            if i + 2 < len(self._data):
-                w = struct.unpack("H", self._data[i:i + 2])[0]
-                if w in dist:
-                    dist[w] += 1
-                else:
-                    dist[w] = 1
+        histogram = self.word_histogram(_byteorder)
+        return {int(w): int(histogram[w]) for w in histogram.nonzero()[0]}
 
-        return dist
-
-    def word_count(self, _value):
+    def word_count(self, _value, _byteorder=None):
         """
         Counts the number of occurrences of the given word in the current
          code segment.
         :param _value: The 16-bit word value to search for.
+        :param _byteorder: The byte order of the words, 'little' or 'big'. If
+        'None', the byte order of the object is used.
         :return: The number of times the given value appears in the code object.
         """
         value = _value & 0xFFFF
-        count = 0
-        for i in range(0, len(self._data), 2):
-            if i + 2 < len(self._data):
-                w = struct.unpack("H", self._data[i:i + 2])[0]
-                if w == _value: count += 1
-        return float(count)
+        return float(self.word_histogram(_byteorder)[value])
+
+    def word_counts(self, _values, _byteorder=None):
+        """
+        Counts the number of occurrences of each of the given words in the
+        current code segment.
+        :param _values: A list of 16-bit word values to search for.
+        :param _byteorder: The byte order of the words, 'little' or 'big'. If
+        'None', the byte order of the object is used.
+        :return: A list containing the number of occurrences of each value.
+        """
+        histogram = self.word_histogram(_byteorder)
+        return [float(histogram[v & 0xFFFF]) for v in _values]
+
+    def byte_statistics(self):
+        """
+        Computes the byte histogram of the code object and the statistics
+        derived from it.
+
+        All the statistical features of the object are derived from the
+        returned object, which only requires a single pass over the data. The
+        result is cached until the cache of the object is invalidated.
+
+        @return A ByteStatistics object describing the contents of the object.
+        """
+        return self._cached(
+            "byte_statistics", lambda: ByteStatistics.from_data(self._data))
 
     def mean_byte_value(self):
         """
         Calculates the mean byte value of the code object.
 
-        This function will iterate through each byte of the object
-        and calculate the arithmetic mean of all bytes within the
-        contents of the object.
-
         @return The mean value of all bytes within the object.
         """
-        return sum(self._data) / len(self._data)
+        return self.byte_statistics().mean
 
     def byte_std_dev(self):
         """
@@ -254,9 +567,7 @@ class CodeObject(LabelledObject):
         @return The standard deviation of the byte values within the
         contents of the object.
         """
-        x_i = self.mean_byte_value()
-        s_i = math.sqrt(sum([math.pow(x - x_i, 2) for x in self._data]) / (len(self._data) - 1))
-        return s_i
+        return self.byte_statistics().std_dev
 
     def byte_mean_dev(self):
         """
@@ -266,9 +577,7 @@ class CodeObject(LabelledObject):
         @return The mean absolute deviation (MAD) of the byte values within
         the contents of the object.
         """
-        x_i = self.mean_byte_value()
-        mad = sum([abs(x - x_i) for x in self._data]) / (len(self._data))
-        return mad
+        return self.byte_statistics().mean_dev
 
     def byte_std_kurtosis(self):
         """
@@ -279,71 +588,80 @@ class CodeObject(LabelledObject):
         References:
             https://en.wikipedia.org/wiki/Kurtosis
         """
-        x_i = self.mean_byte_value()
-        s_i = self.byte_std_dev()
-        k_i = sum([math.pow(x - x_i, 4) for x in self._data]) / (
-            (len(self._data) - 1) * math.pow(s_i, 4))
-        return k_i
+        return self.byte_statistics().kurtosis
 
     def byte_std_skewness(self):
         """
         Calculates the standard skewness of the bytes value distribution.
 
         @return The standard skewness value of the bytes within the current object.
+        """
+        return self.byte_statistics().skewness
 
-        References:
+    def byte_runs(self):
+        """
+        Run-length encodes the code object.
+
+        The run-length encoding is computed in a single vectorized pass and
+        cached; the streak, run count and continuity features are derived
+        from it.
+
+        @return A RunLengths object describing the runs of identical bytes
+        within the object.
+        """
+        return self._cached("byte_runs", lambda: RunLengths.from_data(self._data))
+
+    def run_count(self):
+        """
+        Counts the runs of identical bytes within the code object.
+
+        @return The number of runs of identical bytes.
+        """
+        return self._cached("run_count", lambda: len(self.byte_runs()))
+
+    def run_length_histogram(self):
+        """
+        Counts the runs of identical bytes of each length within the code object.
 
+        @return A numpy array in which the value at index i is the number of
+        runs of length i.
         """
-        x_i = self.mean_byte_value()
-        s_i = self.byte_std_dev()
-        g_i = sum([math.pow(x - x_i, 3) for x in self._data]) / (
-            (len(self._data) - 1) * math.pow(s_i, 3))
-        return g_i
+        return self.byte_runs().length_histogram()
 
     def byte_avg_continuity(self):
         """
-        Calculates the average distance between consecutive the bytes of this object.
+        Calculates the average continuity of the bytes of this object, i.e.
+        the average number of consecutive identical bytes.
+
+        For example, the content "AABB12CCCC" contains 5 runs of identical
+        bytes over 10 bytes, and has an average continuity of 2.
 
-        @return Average distance between consecutive bytes.
+        @return Average length of the runs of identical bytes, or 0 if the
+        object is empty.
         """
-        x_i = self.mean_byte_value()
-        b_v = map(ord, self._data)
-        d = sum([math.pow(x - x_i, 4) for x in b_v])
-        t = math.pow(sum([math.pow(x - x_i, 2) for x in b_v]), 2)
-        c_i = len(self._data) * (d / t)
-        return c_i
+        count = self.run_count()
+        if count == 0:
+            return 0.0
+        return len(self) / count
 
     def longest_byte_streak(self):
         """
         Locates the longest streak of the same byte within the contents
         of the object.
 
-        This function will iterate over each byte of the object and
-        find the byte with the longest consecutive repetition. For example
-        if the content of the object is the following:
+        This function will run-length encode the object and find the byte
+        with the longest consecutive repetition. If several streaks have the
+        same length, the first one is returned. For example if the content of
+        the object is the following:
 
         "AABB12CCCC"
 
-        This function will return a tuple with the following values: ("C", 4)
+        This function will return a tuple with the following values: (ord("C"), 4)
 
         @return A tuple containing the value of the byte and the size
-        of its longest consecutive streak.
-        """
-        i = 0
-        n = len(self._data)
-        max_byte = self._data[0]
-        max_streak = 1
-
-        while (i + 1) < n:
-            cur_streak = 0
-            while ((i + 1) < n) and (self._data[i] == self._data[i + 1]):
-                cur_streak += 1
-                i += 1
-            if cur_streak > max_streak:
-                max_byte = self._data[i]
-                max_streak = cur_streak
-            i += 1
-        return max_byte, max_streak
+        of its longest consecutive streak, or (0, 0) if the object is empty.
+        """
+        return self._cached("longest_streak", lambda: self.byte_runs().longest)
 
     def low_ascii_freq(self):
         """
@@ -385,14 +703,7 @@ class CodeObject(LabelledObject):
 
         @return The entropy of the current object.
         """
-        entropy = 0
-        l = float(len(self._data))
-        b_count = self.bfd()
-        for i in b_count.keys():
-            p_x = b_count[i] / l
-            if p_x > 0.0:
-                entropy -= p_x * math.log(p_x, 256)
-        return entropy
+        return self.byte_statistics().entropy
 
     def md5(self):
         """
@@ -402,12 +713,7 @@ class CodeObject(LabelledObject):
         @return A string containing the hexadecimal representation of the
         MD5 of the contents of this object.
         """
-        m = hashlib.md5()
-        d = self._data
-        if isinstance(d, bytes):
-            m.update(d)
-        else:
-            m.update(d.encode("utf-8"))
+        m = hashlib.md5(self._data)
         return m.hexdigest()
 
     def sha1(self):
@@ -418,12 +724,7 @@ class CodeObject(LabelledObject):
         @return A string containing the hexadecimal representation of the
         SHA1 of the contents of this object.
         """
-        m = hashlib.sha1()
-        d = self._data
-        if isinstance(d, bytes):
-            m.update(d)
-        else:
-            m.update(d.encode("utf-8"))
+        m = hashlib.sha1(self._data)
         return m.hexdigest()
 
     def sha224(self):
@@ -434,12 +735,7 @@ class CodeObject(LabelledObject):
         @return A string containing the hexadecimal representation of the
         SHA224 of the contents of this object.
         """
-        m = hashlib.sha224()
-        d = self._data
-        if isinstance(d, bytes):
-            m.update(d)
-        else:
-            m.update(d.encode("utf-8"))
+        m = hashlib.sha224(self._data)
         return m.hexdigest()
 
     def sha256(self):
@@ -450,12 +746,7 @@ class CodeObject(LabelledObject):
         @return A string containing the hexadecimal representation of the
         SHA256 of the contents of this object.
         """
-        m = hashlib.sha256()
-        d = self._data
-        if isinstance(d, bytes):
-            m.update(d)
-        else:
-            m.update(d.encode("utf-8"))
+        m = hashlib.sha256(self._data)
         return m.hexdigest()
 
     def sha384(self):
@@ -466,12 +757,7 @@ class CodeObject(LabelledObject):
         @return A string containing the hexadecimal representation of the
         SHA384 of the contents of this object.
         """
-        m = hashlib.sha384()
-        d = self._data
-        if isinstance(d, bytes):
-            m.update(d)
-        else:
-            m.update(d.encode("utf-8"))
+        m = hashlib.sha384(self._data)
         return m.hexdigest()
 
     def sha512(self):
@@ -482,12 +768,7 @@ class CodeObject(LabelledObject):
         @return A string containing the hexadecimal representation of the
         SHA512 of the contents of this object.
         """
-        m = hashlib.sha512()
-        d = self._data
-        if isinstance(d, bytes):
-            m.update(d)
-        else:
-            m.update(d.encode("utf-8"))
+        m = hashlib.sha512(self._data)
         return m.hexdigest()
 
     def __bfd_subrange(self, _min, _max, _exclude=[]):
@@ -508,11 +789,11 @@ class CodeObject(LabelledObject):
         assert _min > 0
         assert _max < 256
 
-        bfd = self.bfd()
+        histogram = self.byte_statistics().histogram
         sub_bfd = {}
-        for i in range(_min, _max):
-            if i not in _exclude and i in bfd:
-                sub_bfd[i] = bfd[i]
+        for i in histogram[_min:_max].nonzero()[0] + _min:
+            if i not in _exclude:
+                sub_bfd[int(i)] = int(histogram[i])
         return sub_bfd
 
     def __wfd_subrange(self, _min, _max, _exclude=[]):
@@ -533,33 +814,265 @@ class CodeObject(LabelledObject):
         assert _min > 0
         assert _max < 65536
 
-        bfd = self.wfd()
-        sub_bfd = {}
-        for i in range(_min, _max):
-            if i not in _exclude and i in bfd:
-                sub_bfd[i] = bfd[i]
-        return sub_bfd
+        histogram = self.word_histogram()
+        sub_wfd = {}
+        for i in histogram[_min:_max].nonzero()[0] + _min:
+            if i not in _exclude:
+                sub_wfd[int(i)] = int(histogram[i])
+        return sub_wfd
 
 
 class FileObject(CodeObject):
-    def __init__(self, _file):
+    __open_lock = threading.Lock()
+
+    def __init__(self, _file, _mmap=False, _stream=False, _digest=None):
         """
         Creates a FileObject by initializing the parent class, CodeObject,
         with the contents of the given file.
+
+        By default, the contents of the file are read in memory immediately.
+        If '_mmap' is True, the file is not opened until its contents are
+        needed, at which point it is memory-mapped. The mapping can be closed
+        using release() and will be opened again if needed.
+
+        If '_stream' is True, the file is not opened until its contents are
+        needed either. The hash of the file and the intermediate results
+        supported by the FeatureAccumulator are then computed by reading the
+        file in blocks, so files larger than the memory can be processed.
+        Other intermediate results fall back to memory-mapping the file.
+
         :param _file: The file to retrieve contents from.
+        :param _mmap: Memory-map the file lazily rather than reading it.
+        :param _stream: Stream the file in blocks rather than reading it.
+        :param _digest: The SHA224 digest of the file, if already known. See
+        CorpusManifest.
         """
         assert _file is not None
         assert os.path.exists(_file)
 
         super().__init__('')
+        self._init_file(_file, _mmap, _stream)
+        if self.mmap_mode:
+            self._length = os.path.getsize(_file)
+        else:
+            with open(_file, "rb") as f:
+                self._data = f.read()
+        self._digest = _digest
+
+    def _init_file(self, _file, _mmap=False, _stream=False):
+        """
+        Initializes the state specific to file objects. Subclasses providing
+        the contents of the object themselves call it instead of __init__().
+
+        In memory-mapped and stream modes, the contents of the object are
+        cleared so they are mapped when needed; the length of the object must
+        then be set by the caller.
+
+        :param _file: The name of the file.
+        :param _mmap: Memory-map the file lazily.
+        :param _stream: Stream the file in blocks.
+        """
         self.filename = _file
-        with open(_file, "rb") as f:
-            self._data = f.read()
+        self.__mmap = None
+        self.mmap_mode = _mmap or _stream
+        self.stream_mode = _stream
+        if self.mmap_mode:
+            self._view = None
+
+    def __getstate__(self):
+        """
+        Returns the state of the object for pickling.
+
+        Memory-mapped file objects only pickle the path of the file, which
+        will be mapped again when its contents are needed.
+        """
+        if not self.mmap_mode:
+            state = super().__getstate__()
+        else:
+            state = LabelledObject.__getstate__(self)
+            state["_view"] = None
+            state["_cache"] = {}
+        state["_FileObject__mmap"] = None
+        return state
+
+    @property
+    def digest(self):
+        """
+        Returns the binary SHA224 digest of the contents of the file.
+
+        In stream mode, the file is hashed by reading it in blocks.
+
+        :return: The 28-byte SHA224 digest of the contents of the file.
+        """
+        if self._digest is None and self.stream_mode:
+            m = hashlib.sha224()
+            buffer = bytearray(STREAM_BLOCK_SIZE)
+            with open(self.filename, "rb") as f:
+                size = f.readinto(buffer)
+                while size > 0:
+                    m.update(memoryview(buffer)[:size])
+                    size = f.readinto(buffer)
+            self._digest = m.digest()
+        return super().digest
+
+    def _cached(self, _name, _factory):
+        """
+        Returns the cached intermediate result with the given name.
+
+        In stream mode, all the intermediate results supported by the
+        FeatureAccumulator are computed together, in a single pass over the
+        file, the first time one of them is needed.
+        """
+        if self.stream_mode and _name not in self._cache and _name in self.__streamed_intermediates():
+            self.stream()
+        return super()._cached(_name, _factory)
+
+    def has_intermediate(self, _name):
+        """
+        Verifies if the given intermediate result can be obtained without
+        computing the intermediate results it is derived from.
+
+        In stream mode, the intermediate results computed by stream() are
+        always available directly.
+
+        :param _name: The name of the intermediate result.
+        :return: True if the intermediate result is cached or streamed.
+        """
+        if self.stream_mode and _name in self.__streamed_intermediates():
+            return True
+        return super().has_intermediate(_name)
+
+    def __streamed_intermediates(self):
+        """
+        Returns the names of the intermediate results computed by stream().
+        """
+        return ["byte_statistics",
+                "word_histogram:{bo!s}".format(bo=self.byteorder),
+                "longest_streak",
+                "run_count"]
+
+    def stream(self, _blocksize=STREAM_BLOCK_SIZE):
+        """
+        Reads the file in blocks of the given size and caches the intermediate
+        results computed by the FeatureAccumulator, as well as the hash of
+        the file.
+
+        :param _blocksize: The size, in bytes, of the blocks to read.
+        :return:
+        """
+        accumulator = FeatureAccumulator.from_file(self.filename, _blocksize, self.byteorder)
+        names = self.__streamed_intermediates()
+        self._cache[names[0]] = accumulator.byte_statistics()
+        self._cache[names[1]] = accumulator.word_histogram()
+        self._cache[names[2]] = accumulator.longest_byte_streak()
+        self._cache[names[3]] = accumulator.run_count()
+        if self._digest is None:
+            self._digest = bytes.fromhex(accumulator.sha224())
+
+    @property
+    def _buffer(self):
+        """
+        Returns the memoryview over the contents of the file, mapping the
+        file first if needed.
+        """
+        if self._view is None:
+            self.__open()
+        return self._view
+
+    def __open(self):
+        """
+        Memory-maps the file in read-only mode.
+        """
+        with FileObject.__open_lock:
+            if self._view is not None:
+                return
+            with open(self.filename, "rb") as f:
+                offset, length = self._region(os.fstat(f.fileno()).st_size)
+                if length > 0:
+                    # Mappings must start at a multiple of the allocation granularity.
+                    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                    self.__mmap = mmap.mmap(f.fileno(), offset + length - start,
+                                            access=mmap.ACCESS_READ, offset=start)
+                    self._view = memoryview(self.__mmap)
+                    self._offset = offset - start
+                else:
+                    self._view = memoryview(b'')
+                    self._offset = 0
+            self._length = length
+
+    def _region(self, _filesize):
+        """
+        Returns the offset and length of the region of the file represented
+        by this object, given the current size of the file.
+        """
+        return 0, _filesize
+
+    @property
+    def loaded(self):
+        """
+        Verifies if the contents of the file are in memory or currently mapped.
+        """
+        return not self.mmap_mode or self._view is not None
+
+    def segment(self, _offset, _length):
+        """
+        Returns a code object representing a region of the file.
+
+        Segments of a memory-mapped file do not share its mapping: each of
+        them is a FileSegment mapping its own region when its contents are
+        needed, so the file can be released while its segments are kept.
+
+        :param _offset: The offset of the region within the file.
+        :param _length: The length of the region.
+        :return: A FileSegment in memory-mapped mode, a CodeObject otherwise.
+        """
+        if not self.mmap_mode:
+            return super().segment(_offset, _length)
+        assert _offset >= 0 and _length >= 0
+        assert _offset + _length <= len(self)
+
+        code_obj = FileSegment(self.filename, self.offset + _offset, _length, self.byteorder)
+        code_obj._copy_labels(self)
+        return code_obj
+
+    def detach(self):
+        """
+        Returns a copy of the current object holding its own copy of the data.
+
+        A memory-mapped file which was not mapped before is released again
+        once copied.
+        """
+        loaded = self.loaded
+        code_obj = super().detach()
+        if not loaded:
+            self.release()
+        return code_obj
+
+    def release(self):
+        """
+        Releases the cached intermediate results of the file object and, if the
+        file is memory-mapped, closes the mapping.
+
+        The mapping cannot be closed while other objects, such as views
+        returned by get_data, still reference it. In that case, it will be
+        closed when the last of them is deleted.
+        :return:
+        """
+        super().release()
+        if self.mmap_mode and self._view is not None:
+            try:
+                self._view.release()
+                if self.__mmap is not None:
+                    self.__mmap.close()
+            except BufferError:
+                debug("Mapping of '{f:s}' still in use; not closed.".format(f=self.filename))
+            self._view = None
+            self.__mmap = None
 
     def __str__(self):
-        fmt = "<FileObject Size={fs:d} byte(s) Hash='{fh:s}'>"
+        fmt = "<FileObject Size={fs:d} byte(s) File='{fn:s}'>"
         return fmt.format(
-            fs=len(self._data), fh=self.hash
+            fs=len(self), fn=self.filename
         )
 
     @property
@@ -593,3 +1106,72 @@ class FileObject(CodeObject):
         :return:
         """
         self.add_label(self.extension)
+
+
+class FileSegment(FileObject):
+    def __init__(self, _file, _offset, _length, _byteorder=None):
+        """
+        Creates a code object representing a region of a file, which is
+        memory-mapped lazily like a FileObject in memory-mapped mode.
+
+        Only the region is mapped, when its contents are needed. The mapping
+        can be closed using release() and will be opened again if needed.
+
+        :param _file: The file the region belongs to.
+        :param _offset: The offset, in bytes, of the region within the file.
+        :param _length: The length, in bytes, of the region.
+        :param _byteorder: The default byte order used to read 16-bit words
+        from the data. If 'None', the native byte order is used.
+        """
+        assert _file is not None
+        assert _offset >= 0 and _length >= 0
+
+        CodeObject.__init__(self, '', _byteorder)
+        self._init_file(_file, _mmap=True)
+        self.__file_offset = _offset
+        self._length = _length
+
+    def _region(self, _filesize):
+        """
+        Returns the offset and length of the region of the file represented
+        by this segment.
+        """
+        assert self.__file_offset + self._length <= _filesize
+        return self.__file_offset, self._length
+
+    @property
+    def offset(self):
+        """
+        Returns the offset of the data of this segment within its file.
+        """
+        return self.__file_offset
+
+    def __str__(self):
+        fmt = "<FileSegment Size={fs:d} byte(s) Offset={fo:d} File='{fn:s}'>"
+        return fmt.format(
+            fs=len(self), fo=self.__file_offset, fn=self.filename
+        )
+
+
+class ArchiveMember(FileObject):
+    def __init__(self, _archive, _name, _data):
+        """
+        Creates a file object holding the contents of a member of an archive,
+        decompressed in memory.
+
+        The file name of the object is the path of the member within the
+        archive, joined to the path of the archive, so its extension is the
+        extension of the member. The member is never written to disk.
+
+        :param _archive: The path of the archive.
+        :param _name: The name of the member within the archive.
+        :param _data: The decompressed contents of the member.
+        """
+        assert _archive is not None
+        assert _name is not None
+        assert _data is not None
+
+        CodeObject.__init__(self, _data)
+        self._init_file(os.path.join(_archive, _name))
+        self.archive = _archive
+        self.member = _name
@@ -11,35 +11,412 @@
 """
 import os
 import re
+import random
+from bisect import insort
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 
 from resyst.log import *
+from resyst.labels import LABELS
 from resyst.codeobject import FileObject
 from resyst.codeobject import CodeObject
+from resyst.codeobject import ArchiveMember
+from resyst.archive import is_archive
+from resyst.archive import iter_archive
+from resyst.archive import ARCHIVE_ERRORS
+from resyst.manifest import file_signature
+
+# Default number of threads reading files.
+DEFAULT_IO_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Number of files submitted to the reading threads at once.
+IO_CHUNK_SIZE = 1024
+
+
+def scan_directory(_dir, _filter=None):
+    """
+    Recursively lists the files within the given directory whose names match
+    the given filter.
+
+    Directories are traversed depth-first, in the same order as os.walk, but
+    the entries of each directory are sorted by name so the files are always
+    listed in the same order. Symbolic links to directories are not followed.
+
+    :param _dir: The directory to traverse.
+    :param _filter: A regular expression, as a string or compiled pattern,
+    matched against the name of each file. If 'None', all files are listed.
+    :return: A generator of file paths.
+    """
+    for entry in _scan_entries(_dir, _filter):
+        yield entry.path
+
+
+def _scan_entries(_dir, _filter=None):
+    """
+    Recursively lists the files within the given directory whose names match
+    the given filter. See scan_directory().
+
+    :return: A generator of os.DirEntry objects.
+    """
+    assert _dir is not None
+
+    match = None
+    if _filter is not None:
+        match = re.compile(_filter).match
+
+    directories = [_dir]
+    while len(directories) > 0:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            warn("Cannot list directory '{d:s}': {e:s}.".format(d=directory, e=str(e)))
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file() and (match is None or match(entry.name)):
+                yield entry
+        directories.extend(reversed(subdirectories))
+
+
+def _load_file(_file, _mmap=False, _stream=False):
+    """
+    Creates a FileObject from the given file.
+
+    This function is executed by the threads of FileSet.load_from_directory.
+    The file is not hashed: see ContentIndex.
+
+    :param _file: The path of the file.
+    :param _mmap: Memory-map the file lazily rather than reading it.
+    :param _stream: Stream the file in blocks rather than reading it.
+    :return: A FileObject.
+    """
+    return FileObject(_file, _mmap, _stream)
+
+
+def _load_entry(_entry, _mmap=False, _stream=False, _manifest=None):
+    """
+    Creates a FileObject from the given directory entry, restoring it from
+    the given manifest if the file did not change.
+
+    Restored files are memory-mapped or streamed lazily, so their contents
+    are not read. Other files are read and, if a manifest is used, hashed so
+    their hash can be recorded.
+
+    :param _entry: The os.DirEntry of the file.
+    :param _mmap: Memory-map the file lazily rather than reading it.
+    :param _stream: Stream the file in blocks rather than reading it.
+    :param _manifest: A CorpusManifest, or 'None'.
+    :return: A tuple (FileObject, signature), in which 'signature' is the
+    signature of the file (see file_signature) or 'None' without a manifest.
+    """
+    if _manifest is None:
+        return _load_file(_entry.path, _mmap, _stream), None
+
+    signature = file_signature(_entry.stat())
+    record = _manifest.lookup(_entry.path, signature)
+    if record is not None:
+        restored = FileObject(_entry.path, _mmap=True, _stream=_stream, _digest=bytes.fromhex(record["hash"]))
+        restored.add_labels(record["labels"])
+        return restored, signature
+
+    new_file = _load_file(_entry.path, _mmap, _stream)
+    new_file.digest
+    return new_file, signature
+
+
+class ContentIndex(object):
+    def __init__(self):
+        """
+        Detects code objects with identical contents without hashing all of
+        them.
+
+        Objects are first grouped by size: an object whose size is unique is
+        never hashed. Objects of the same size are then grouped using a digest
+        of their first bytes (see CodeObject.prefix_digest). Only objects
+        sharing the same size and prefix are compared using their full SHA224
+        digest, which are 28-byte keys.
+
+        Objects whose digest is already known, such as files restored from a
+        CorpusManifest, are not read at all: once such an object shares its
+        size with another one, all the objects of that size are compared
+        using their full digest.
+
+        Lazily mapped file objects read to compute a digest are released
+        afterwards, so the index never keeps files mapped.
+        """
+        # Size -> first object of that size, not yet digested.
+        self.__pending = {}
+        # (Size, prefix digest) -> full digests, or the single object
+        # having that prefix if it was not digested yet.
+        self.__prefixes = {}
+        # Size -> full digests, for the sizes compared by full digest only.
+        self.__digests = {}
+
+    def add(self, _code):
+        """
+        Adds a code object to the index unless an object with the same
+        contents was added before.
+
+        :param _code: The CodeObject to add.
+        :return: True if the object was added, False if it is a duplicate.
+        """
+        size = len(_code)
+        digests = self.__digests.get(size)
+        if digests is not None:
+            return self.__add_digest(digests, _code)
+
+        if size not in self.__pending:
+            self.__pending[size] = _code
+            return True
+
+        first = self.__pending[size]
+        if first is not None:
+            self.__pending[size] = None
+            if first.has_digest or _code.has_digest:
+                digests = {self.__read(first, lambda c: c.digest)}
+                self.__digests[size] = digests
+                return self.__add_digest(digests, _code)
+            self.__prefixes[(size, self.__read(first, lambda c: c.prefix_digest()))] = first
+
+        key = (size, self.__read(_code, lambda c: c.prefix_digest()))
+        entry = self.__prefixes.get(key)
+        if entry is None:
+            self.__prefixes[key] = _code
+            return True
+
+        if not isinstance(entry, set):
+            entry = {self.__read(entry, lambda c: c.digest)}
+            self.__prefixes[key] = entry
+        return self.__add_digest(entry, _code)
+
+    def __add_digest(self, _digests, _code):
+        """
+        Adds the full digest of a code object to the given set of digests.
+
+        :return: True if the digest was not in the set.
+        """
+        digest = self.__read(_code, lambda c: c.digest)
+        if digest in _digests:
+            return False
+        _digests.add(digest)
+        return True
+
+    @staticmethod
+    def __read(_code, _function):
+        """
+        Applies the given function to a code object and, if the object was not
+        in memory before, releases it afterwards.
+        """
+        loaded = _code.loaded
+        value = _function(_code)
+        if not loaded:
+            _code.release()
+        return value
+
 
 class DataSet(object):
     def __init__(self, _dict = None):
-        if _dict == None:
-            self.objects = {}
-        else:
+        """
+        Creates a data set of unique code objects.
+
+        Objects are kept in the order they are added. Objects with the same
+        contents as an object already in the data set are not added. See
+        ContentIndex.
+
+        Objects are also indexed by their first label as they are added, so
+        that counting, splitting and sampling objects per label does not
+        require going over all the objects. Labels are only ever appended to
+        objects, so the first label of an object only changes when it has no
+        labels yet: only these objects are checked again when the index is
+        used.
+
+        :param _dict: A dictionary of code objects keyed by hash, used to fill
+        the data set.
+        """
+        self.__index = ContentIndex()
+        self.__objects = []
+        self.__by_hash = None
+        self.__by_label = {}
+        self.__unlabelled = []
+        if _dict is not None:
             assert isinstance(_dict, dict)
-            self.objects = _dict
+            for obj in _dict.values():
+                self._add(obj)
 
     def __len__(self):
         """
         Returns the number of objects in the dataset.
         :return: The number of objects in the dataset.
         """
-        return len(self.objects)
+        return len(self.__objects)
+
+    def __iter__(self):
+        """
+        Iterates over the objects of the dataset, in the order they were
+        added, without hashing them.
+        """
+        return iter(self.__objects)
+
+    @property
+    def objects(self):
+        """
+        Returns a dictionary of the objects of the dataset keyed by hash.
+
+        All the objects are hashed the first time this dictionary is requested.
+        Iterate over the data set to access the objects without hashing them.
+
+        :return: A dictionary of objects keyed by hash. It must not be modified.
+        """
+        if self.__by_hash is None:
+            self.__by_hash = {obj.hash: obj for obj in self.__objects}
+        return self.__by_hash
 
     @property
     def data(self):
         """
-        Returns a reference to the internal dictionary.
-        :return: Reference to the internal dictionary.
+        Returns a dictionary of the objects of the dataset keyed by hash.
+        See DataSet.objects.
+        :return: A dictionary of objects keyed by hash.
         """
         return self.objects
 
+    def _add(self, _obj):
+        """
+        Adds an object to the data set unless an object with the same contents
+        is already present.
+
+        :param _obj: The code object to add.
+        :return: True if the object was added.
+        """
+        if not self.__index.add(_obj):
+            return False
+        position = len(self.__objects)
+        self.__objects.append(_obj)
+        self.__by_hash = None
+        self.__by_label.setdefault(_obj.primary_label_id, []).append(position)
+        if len(_obj.label_ids) == 0:
+            self.__unlabelled.append(position)
+        return True
+
+    @property
+    def label_names(self):
+        """
+        Returns the labels of the objects of the data set. Objects are counted
+        under their first label; objects without labels under "".
+        :return: A sorted list of labels.
+        """
+        return sorted(LABELS.names(self.__label_index().keys()))
+
+    def label_counts(self):
+        """
+        Returns the number of objects of each label. Objects are counted under
+        their first label; objects without labels under "".
+        :return: A dictionary of counts keyed by label.
+        """
+        return {LABELS.name(label_id): len(positions)
+                for label_id, positions in self.__label_index().items()}
+
+    def objects_with_label(self, _label):
+        """
+        Returns the objects whose first label is the given label.
+
+        :param _label: A label, or "" for the objects without labels.
+        :return: A list of objects, in the order they were added.
+        """
+        if _label not in LABELS:
+            return []
+        positions = self.__label_index().get(LABELS.id(_label), [])
+        return [self.__objects[p] for p in positions]
+
+    def split_stratified(self, _ratio, _seed=None):
+        """
+        Splits the data set into two data sets having the same proportion of
+        each label.
+
+        The objects of each label are shuffled, then the given ratio of them
+        is placed in the first data set and the remaining objects in the
+        second one.
+
+        :param _ratio: The ratio of the objects of each label placed in the
+        first data set, between 0 and 1 exclusively.
+        :param _seed: The seed of the random number generator.
+        :return: A tuple containing both data sets, of the same class as the
+        current one.
+        """
+        assert 0 < _ratio < 1
+
+        rnd = random.Random(_seed)
+        first = []
+        second = []
+        for label_id in sorted(self.__label_index()):
+            positions = list(self.__by_label[label_id])
+            rnd.shuffle(positions)
+            count = int(round(len(positions) * _ratio))
+            first += positions[:count]
+            second += positions[count:]
+        return self.__subset(first), self.__subset(second)
+
+    def sample_balanced(self, _count, _seed=None):
+        """
+        Returns a data set containing at most the given number of objects of
+        each label, chosen at random.
+
+        :param _count: The maximum number of objects of each label.
+        :param _seed: The seed of the random number generator.
+        :return: A data set of the same class as the current one.
+        """
+        assert _count > 0
+
+        rnd = random.Random(_seed)
+        selected = []
+        for label_id in sorted(self.__label_index()):
+            positions = self.__by_label[label_id]
+            if len(positions) <= _count:
+                selected += positions
+            else:
+                selected += rnd.sample(positions, _count)
+        return self.__subset(selected)
+
+    def __subset(self, _positions):
+        """
+        Returns a data set of the same class containing the objects at the
+        given positions, in the order they were added to the current data set.
+        """
+        subset = self.__class__()
+        for position in sorted(_positions):
+            subset._add(self.__objects[position])
+        return subset
+
+    def __label_index(self):
+        """
+        Returns the positions of the objects keyed by the id of their first
+        label, moving the objects labelled since they were added to the index
+        of their new label.
+        """
+        moved = set()
+        unlabelled = []
+        for position in self.__unlabelled:
+            obj = self.__objects[position]
+            if len(obj.label_ids) == 0:
+                unlabelled.append(position)
+            elif obj.primary_label_id != LABELS.id(""):
+                insort(self.__by_label.setdefault(obj.primary_label_id, []), position)
+                moved.add(position)
+        self.__unlabelled = unlabelled
+        if len(moved) > 0:
+            positions = [p for p in self.__by_label[LABELS.id("")] if p not in moved]
+            if len(positions) > 0:
+                self.__by_label[LABELS.id("")] = positions
+            else:
+                del self.__by_label[LABELS.id("")]
+        return self.__by_label
+
 class CodeSet(DataSet):
     def __init__(self, _dict=None):
         super().__init__(_dict)
@@ -63,9 +440,7 @@ class CodeSet(DataSet):
             for code_chunk in _fileobj.split_by_size(_size):
                 self.__add_code(code_chunk)
         else:
-            file_hash = _fileobj.hash
-            if file_hash not in self.objects.keys():
-                self.objects[file_hash] = _fileobj
+            self._add(_fileobj)
 
     def __add_code(self, _code):
         """
@@ -76,20 +451,169 @@ class CodeSet(DataSet):
         """
         assert _code is not None
 
-        code_obj = _code
-        code_hash = code_obj.hash
-        if code_hash not in self.objects.keys():
-            self.objects[code_hash] = code_obj
-            debug("Added code segment: {f:s}.".format(
-                f = str(code_obj)
+        if self._add(_code):
+            debug("Added code segment of {s:d} byte(s) at offset {o:d}.".format(
+                s=len(_code), o=_code.offset
             ))
 
+class SegmentReservoir(object):
+    def __init__(self, _quota, _quotas=None, _seed=None):
+        """
+        Creates a bounded, label-balanced sample of code segments.
+
+        Segments are offered one at a time, in a single pass over the corpus.
+        Each label keeps a reservoir of at most '_quota' segments, so that
+        every segment offered with a label has the same probability of being
+        kept (reservoir sampling, algorithm R). The size of the sample does not
+        depend on the size of the corpus.
+
+        Only the segments kept are created and their data copied, so the file
+        objects they come from can be released as soon as they are sampled.
+        A segment with the same contents as a segment already kept is
+        dismissed, so that the quotas are filled with distinct segments.
+
+        :param _quota: The maximum number of segments kept for each label.
+        :param _quotas: A dictionary of quotas keyed by label, overriding
+        '_quota' for these labels.
+        :param _seed: The seed of the random number generator.
+        """
+        assert _quota > 0
+
+        self.quota = _quota
+        self.quotas = dict(_quotas) if _quotas is not None else {}
+        self.__random = random.Random(_seed)
+        self.__reservoirs = {}
+        self.__digests = set()
+        self.__seen = {}
+
+    def __len__(self):
+        """
+        Returns the number of segments currently kept.
+        """
+        return sum(len(reservoir) for reservoir in self.__reservoirs.values())
+
+    @property
+    def seen(self):
+        """
+        Returns the number of segments offered for each label.
+        :return: A dictionary of counts keyed by label.
+        """
+        return dict(self.__seen)
+
+    def quota_of(self, _label):
+        """
+        Returns the maximum number of segments kept for the given label.
+        """
+        return self.quotas.get(_label, self.quota)
+
+    def add_file(self, _fileobj, _size):
+        """
+        Offers the segments of the given size of a file object to the
+        reservoir of its label, then releases the file.
+
+        Segments are cut as by FileObject.split_by_size(). If '_size' is not
+        positive, the whole file is offered as a single segment.
+
+        :param _fileobj: The FileObject to sample. Cannot be 'None'.
+        :param _size: The size of each code segment.
+        :return: The number of segments of the file kept.
+        """
+        assert _fileobj is not None
+
+        length = len(_fileobj)
+        if length == 0:
+            return 0
+        size = _size if _size > 0 else length
+        label = self.__label(_fileobj)
+        kept = 0
+        for offset in range(0, length, size):
+            slot = self.__draw(label)
+            if slot is not None:
+                segment = _fileobj.segment(offset, min(size, length - offset))
+                if self.__keep(label, slot, segment.detach()):
+                    kept += 1
+        _fileobj.release()
+        return kept
+
+    def add_code(self, _code):
+        """
+        Offers a code object to the reservoir of its label.
+
+        :param _code: The code object to sample. Cannot be 'None'.
+        :return: True if the code object was kept.
+        """
+        assert _code is not None
+
+        label = self.__label(_code)
+        slot = self.__draw(label)
+        if slot is None:
+            return False
+        return self.__keep(label, slot, _code.detach())
+
+    def to_codeset(self):
+        """
+        Returns the segments kept, grouped by label.
+
+        :return: A CodeSet object.
+        """
+        codeset = CodeSet()
+        for label in sorted(self.__reservoirs):
+            for code in self.__reservoirs[label]:
+                codeset._add(code)
+        return codeset
+
+    def __draw(self, _label):
+        """
+        Counts a new segment of the given label and decides if it is kept.
+
+        :return: The slot of the reservoir in which to store the segment, or
+        'None' if the segment is dismissed.
+        """
+        seen = self.__seen.get(_label, 0)
+        self.__seen[_label] = seen + 1
+        reservoir = self.__reservoirs.setdefault(_label, [])
+        if len(reservoir) < self.quota_of(_label):
+            return len(reservoir)
+        slot = self.__random.randrange(seen + 1)
+        if slot < len(reservoir):
+            return slot
+        return None
+
+    def __keep(self, _label, _slot, _code):
+        """
+        Stores a segment in the given slot of the reservoir of its label,
+        unless a segment with the same contents is already kept.
+
+        :return: True if the segment was stored.
+        """
+        if _code.digest in self.__digests:
+            return False
+        reservoir = self.__reservoirs[_label]
+        if _slot == len(reservoir):
+            reservoir.append(_code)
+        else:
+            self.__digests.discard(reservoir[_slot].digest)
+            reservoir[_slot] = _code
+        self.__digests.add(_code.digest)
+        return True
+
+    @staticmethod
+    def __label(_code):
+        """
+        Returns the label used to balance the given code object: its first
+        label, or an empty string if it has none.
+        """
+        labels = _code.labels
+        return labels[0] if len(labels) > 0 else ""
+
+
 class FileSet(DataSet):
 
     def __init__(self, _dict=None):
         super().__init__(_dict)
 
-    def load_from_directory(self, _dir, _filter=None):
+    def load_from_directory(self, _dir, _filter=None, _mmap=False, _stream=False, _workers=None,
+                            _manifest=None, _archives=False):
         """
         Creates a dataset of FileObject by reading all files within the
         given directory matching the provided filter.
@@ -100,20 +624,88 @@ class FileSet(DataSet):
         Each filtered filename will be used to create a FileObject and
         stored into the DataSet object.
 
+        Files are read by a pool of threads, but are added to the data set in
+        the order they are listed by scan_directory(). When several files have
+        the same contents, the first one listed is kept, so loading the same
+        directory always results in the same data set. Files are only hashed
+        when needed to detect duplicates; see ContentIndex.
+
+        If a manifest is provided, files which did not change since they were
+        recorded in the manifest are restored from it without being read, and
+        all the files loaded are recorded in the manifest. The manifest must be
+        saved afterwards, once the files are labelled; see CorpusManifest.save().
+
+        If '_archives' is True, the members of the archives found in the
+        directory are loaded instead of the archives themselves, as with
+        FileSet.load_from_archive(). The filter is then matched against the
+        names of the members, and archives are not recorded in the manifest.
+
         :param _dir: The directory to traverse and list files from.
         :param _filter: A filter to exclude specific files. If none provided, allows
         all files.
+        :param _mmap: If True, files are memory-mapped when their contents are
+        needed rather than read in memory when loaded. See FileObject.
+        :param _stream: If True, files are read in blocks when their contents are
+        needed rather than read in memory when loaded. See FileObject.
+        :param _workers: The number of threads reading files. Defaults to
+        DEFAULT_IO_WORKERS.
+        :param _manifest: A CorpusManifest of the files of the directory, or 'None'.
+        :param _archives: Load the members of archives rather than the archives.
         :return:
         """
         assert _dir is not None
         assert os.path.isdir(_dir)
 
-        for root, dirs, filenames in os.walk(_dir):
-            for filename in filenames:
-                if _filter == None:
-                    self.__add_file(os.path.join(root, filename))
-                elif re.match(_filter, filename):
-                    self.__add_file(os.path.join(root, filename))
+        workers = DEFAULT_IO_WORKERS if _workers is None else _workers
+        assert workers > 0
+
+        if _archives:
+            match = re.compile(_filter or ".*").match
+            entries = (e for e in _scan_entries(_dir) if is_archive(e.name) or match(e.name))
+        else:
+            entries = _scan_entries(_dir, _filter)
+
+        def load(_entry):
+            if _archives and is_archive(_entry.name):
+                return None
+            return _load_entry(_entry, _mmap, _stream, _manifest)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunk = list(islice(entries, IO_CHUNK_SIZE))
+            while len(chunk) > 0:
+                for entry, loaded in zip(chunk, executor.map(load, chunk)):
+                    if loaded is None:
+                        try:
+                            self.load_from_archive(entry.path, _filter)
+                        except ARCHIVE_ERRORS as e:
+                            warn("Cannot read archive '{a:s}': {e:s}.".format(a=entry.path, e=str(e)))
+                        continue
+                    new_file, signature = loaded
+                    if _manifest is not None:
+                        _manifest.record(new_file.filename, signature, new_file)
+                    self.__insert(new_file)
+                chunk = list(islice(entries, IO_CHUNK_SIZE))
+
+    def load_from_archive(self, _archive, _filter=None):
+        """
+        Adds the members of the given archive to the data set.
+
+        The members are decompressed in memory, one at a time, and are never
+        written to disk. Each member is labelled using its extension. See
+        resyst.archive for the supported formats.
+
+        :param _archive: The path of a zip, tar or compressed file.
+        :param _filter: A regular expression matched against the base name of
+        each member. If 'None', all members are added.
+        :return:
+        """
+        assert _archive is not None
+        assert os.path.isfile(_archive)
+
+        for name, data in iter_archive(_archive, _filter):
+            member = ArchiveMember(_archive, name, data)
+            member.set_extension_as_label()
+            self.__insert(member)
 
     def add_directory(self, _directory, _filter=".*"):
         """
@@ -132,10 +724,8 @@ class FileSet(DataSet):
         assert _directory is not None
         assert os.path.isdir(_directory)
 
-        for root, dirs, files in os.walk(_directory):
-            for file in files:
-                if re.match(_filter, file):
-                    self.__add_file(file)
+        for file in scan_directory(_directory, _filter):
+            self.__add_file(file)
 
     def add_file(self, _file):
         """
@@ -169,30 +759,44 @@ class FileSet(DataSet):
             if os.path.isdir(_files):
                 self.add_directory(_files)
 
-    def __add_file(self, _file):
+    def __add_file(self, _file, _mmap=False, _stream=False):
         """
         Adds a file to the dataset if it is not already currently
         referenced by it.
 
-        This function will add the given file to the dataset unless is is
-        already in the internal dictionary. To determine if the file is already
-         in the data set, the files are stored internally within a dictionary
-         object. A hash of the file, obtained via FileObject.hash(), is used as key.
-         If the hash of the new file is already present in the dictionary, the file
-         will not be added.
+        This function will add the given file to the dataset unless a file
+        with the same contents is already in the data set. Duplicates are
+        detected by the ContentIndex of the data set, which only hashes the
+        file if another file has the same size.
+
+        Memory-mapped and streamed files are released once compared, and mapped
+        again when their contents are needed.
 
         :param _file: The absolute path of the file to add.
+        :param _mmap: Memory-map the file lazily rather than reading it.
+        :param _stream: Stream the file in blocks rather than reading it.
         :return: None
         """
         assert _file is not None
         assert os.path.isfile(_file)
 
+        self.__insert(_load_file(_file, _mmap, _stream))
+
+    def __insert(self, _file):
+        """
+        Adds a loaded file object to the dataset, unless a file with the same
+        contents is already present.
 
-        new_file = FileObject(_file)
-        file_hash = new_file.hash
-        if file_hash not in self.objects.keys():
-            self.objects[file_hash] = new_file
+        Memory-mapped and streamed files are released once compared to the
+        other files.
+
+        :param _file: The FileObject to add.
+        :return: None
+        """
+        added = self._add(_file)
+        _file.release()
+        if added:
             debug("Added file: {f:s}.".format(
-                f = str(new_file)
+                f = _file.filename
             ))
 
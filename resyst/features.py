@@ -11,12 +11,23 @@
 """
 
 import json
-import time
 import random
-import threading
 from enum import Enum
+from itertools import islice
+from functools import partial
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 from resyst.codeobject import *
+from resyst.registry import FeatureRegistry
+from resyst.stats import NATIVE_ENDIAN
+from resyst.matrix import FeatureSchema
+from resyst.matrix import FeatureMatrixBuilder
+from resyst.store import FeatureStore
 from sklearn.preprocessing import normalize
 
 class Feature(Enum):
@@ -41,18 +52,328 @@ class Feature(Enum):
     def __str__(self):
         return self.name
 
+#
+# Registry of the features which can be extracted from code objects, and of
+# the intermediate results they are derived from. New features only need to
+# be registered here to be extracted by FeatureSet.
+#
+REGISTRY = FeatureRegistry()
+
+
+@REGISTRY.intermediate("byte_statistics")
+def _byte_statistics(_code):
+    return _code.byte_statistics()
+
+
+@REGISTRY.intermediate("word_histogram")
+def _word_histogram(_code):
+    return _code.word_histogram()
+
+
+@REGISTRY.intermediate("byte_runs")
+def _byte_runs(_code):
+    return _code.byte_runs()
+
+
+@REGISTRY.intermediate("longest_streak", _requires=["byte_runs"])
+def _longest_streak(_code):
+    return _code.longest_byte_streak()
+
+
+@REGISTRY.intermediate("run_count", _requires=["byte_runs"])
+def _run_count(_code):
+    return _code.run_count()
+
+
+@REGISTRY.feature(Feature.BFD, _width=256, _dtype=np.int64, _requires=["byte_statistics"])
+def _bfd(_code):
+    return _code.bfd()
+
+
+@REGISTRY.feature(Feature.WFD, _width=65536, _dtype=np.int64, _requires=["word_histogram"])
+def _wfd(_code):
+    return _code.wfd()
+
+
+@REGISTRY.feature(Feature.BYTE_VAL_MEAN, _requires=["byte_statistics"])
+def _mean_byte_value(_code):
+    return _code.mean_byte_value()
+
+
+@REGISTRY.feature(Feature.BYTE_VAL_STDDEV, _requires=["byte_statistics"])
+def _byte_std_dev(_code):
+    return _code.byte_std_dev()
+
+
+@REGISTRY.feature(Feature.BYTE_VAL_MAD, _requires=["byte_statistics"])
+def _byte_mean_dev(_code):
+    return _code.byte_mean_dev()
+
+
+@REGISTRY.feature(Feature.LOW_ASCII_FREQ, _width=95, _dtype=np.int64, _offset=32, _requires=["byte_statistics"])
+def _low_ascii_freq(_code):
+    return _code.low_ascii_freq()
+
+
+@REGISTRY.feature(Feature.HIGH_ASCII_FREQ, _width=128, _dtype=np.int64, _offset=128, _requires=["byte_statistics"])
+def _high_ascii_freq(_code):
+    return _code.high_ascii_freq()
+
+
+@REGISTRY.feature(Feature.STD_KURTOSIS, _requires=["byte_statistics"])
+def _byte_std_kurtosis(_code):
+    return _code.byte_std_kurtosis()
+
+
+@REGISTRY.feature(Feature.STD_SKEWNESS, _requires=["byte_statistics"])
+def _byte_std_skewness(_code):
+    return _code.byte_std_skewness()
+
+
+@REGISTRY.feature(Feature.AVG_BYTE_CONTINUITY, _requires=["run_count"])
+def _byte_avg_continuity(_code):
+    return _code.byte_avg_continuity()
+
+
+@REGISTRY.feature(Feature.LONGEST_STREAK, _width=2, _dtype=np.int64, _requires=["longest_streak"])
+def _longest_byte_streak(_code):
+    return _code.longest_byte_streak()
+
+
+@REGISTRY.feature(Feature.SHANNON_ENTROPY, _requires=["byte_statistics"])
+def _shannon_entropy(_code):
+    return _code.shannon_entropy()
+
+
+@REGISTRY.feature(Feature.B_FFFE, _requires=["word_histogram"])
+def _word_count_fffe(_code):
+    return _code.word_count(0xFFFE)
+
+
+@REGISTRY.feature(Feature.B_0001, _requires=["word_histogram"])
+def _word_count_0001(_code):
+    return _code.word_count(0x0001)
+
+
+@REGISTRY.feature(Feature.B_1000, _requires=["word_histogram"])
+def _word_count_1000(_code):
+    return _code.word_count(0x1000)
+
+
+@REGISTRY.feature(Feature.B_FEFF, _requires=["word_histogram"])
+def _word_count_feff(_code):
+    return _code.word_count(0xFEFF)
+
+# Default number of code objects sent to a worker process at once.
+DEFAULT_BATCH_SIZE = 64
+
+
+def _extract_features_from_batch(_features, _codes):
+    """
+    Extracts the given features from each code object of a batch.
+
+    This function is executed by the workers used by
+    FeatureSet.iter_features_from_fileset. It is defined at module level so
+    it can be pickled and sent to worker processes.
+
+    :param _features: A list of Feature objects.
+    :param _codes: A list of CodeObject.
+    :return: A list of (hash, features) tuples, one per code object, in which
+    'features' is a dictionary of features including the labels.
+    """
+    results = []
+    for code in _codes:
+        features = REGISTRY.extract(_features, code)
+        features[Feature.LABEL] = code.labels
+        results.append((code.hash, features))
+        code.release()
+    return results
+
+
+class CacheKeys(object):
+    def __init__(self, _features):
+        """
+        Computes the keys under which the values of features are cached.
+
+        The key of a feature is its name and version. The values of features
+        derived from the word histogram, such as the WFD, also depend on the
+        byte order of the words, which is then appended to the name.
+
+        :param _features: A list of Feature objects.
+        """
+        self.features = list(_features)
+        self.__word_features = {f for f in self.features if REGISTRY.depends_on(f, "word_histogram")}
+        self.__keys = {}
+
+    def of(self, _code):
+        """
+        Returns the cache keys of the features of the given code object.
+
+        :param _code: A CodeObject.
+        :return: A list of (feature name, version) tuples, in the order of the
+        features.
+        """
+        byteorder = NATIVE_ENDIAN if _code.byteorder is None else _code.byteorder
+        keys = self.__keys.get(byteorder)
+        if keys is None:
+            keys = []
+            for feature in self.features:
+                name = feature.name
+                if feature in self.__word_features:
+                    name = "{n:s}:{bo:s}".format(n=name, bo=byteorder)
+                keys.append((name, REGISTRY.spec(feature).version))
+            self.__keys[byteorder] = keys
+        return keys
+
+
+class _BatchQueue(object):
+    def __init__(self, _executor, _features, _codes, _batch_size, _max_pending, _cache=None):
+        """
+        Submits the batches of code objects to the workers extracting their
+        features and collects the results in the order of the batches. See
+        FeatureSet.iter_features_from_fileset.
+
+        :param _executor: The executor of the workers.
+        :param _features: A list of Feature objects.
+        :param _codes: An iterator over the code objects.
+        :param _batch_size: The number of code objects sent to a worker at once.
+        :param _max_pending: The maximum number of batches submitted or waiting
+        to be collected at any time.
+        :param _cache: A FeatureCache consulted before extracting features, or 'None'.
+        """
+        self.executor = _executor
+        self.features = _features
+        self.codes = _codes
+        self.batch_size = _batch_size
+        self.max_pending = _max_pending
+        self.cache = _cache
+        self.cache_keys = CacheKeys(_features) if _cache is not None else None
+        self.__extract = partial(_extract_features_from_batch, _features)
+        self.__pending = {}
+        self.__collected = {}
+        self.__submitted = 0
+        self.__next_batch = 0
+
+    @property
+    def empty(self):
+        """
+        Verifies if all the batches submitted were yielded.
+        """
+        return len(self.__pending) == 0 and len(self.__collected) == 0
+
+    def submit(self):
+        """
+        Submits new batches until '_max_pending' batches are submitted or
+        waiting to be yielded, or until all the code objects are submitted.
+        """
+        while len(self.__pending) + len(self.__collected) < self.max_pending:
+            batch = list(islice(self.codes, self.batch_size))
+            if len(batch) == 0:
+                break
+            self.__submit(batch)
+
+    def __submit(self, _batch):
+        """
+        Submits the code objects of a batch whose features are not all cached.
+        """
+        cached = self.__lookup(_batch)
+        missing = [i for i in range(len(_batch)) if i not in cached]
+        if len(missing) > 0:
+            future = self.executor.submit(self.__extract, [_batch[i] for i in missing])
+            keys = [self.cache_keys.of(_batch[i]) for i in missing] if self.cache is not None else None
+            self.__pending[future] = (self.__submitted, len(_batch), missing, cached, keys)
+        else:
+            self.__collected[self.__submitted] = [cached[i] for i in range(len(_batch))]
+        self.__submitted += 1
+
+    def collect(self):
+        """
+        Waits for at least one batch to complete, unless the next batch to
+        yield is already collected, and adds the features extracted to the
+        cache.
+        """
+        if self.__next_batch in self.__collected:
+            return
+        done, not_done = wait(self.__pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index, count, missing, cached, keys = self.__pending.pop(future)
+            extracted = future.result()
+            if self.cache is not None:
+                self.cache.put([
+                    (code_hash, {k: features[f] for f, k in zip(self.features, code_keys)})
+                    for (code_hash, features), code_keys in zip(extracted, keys)])
+            cached.update(zip(missing, extracted))
+            self.__collected[index] = [cached[i] for i in range(count)]
+
+    def pop_ready(self):
+        """
+        Removes the results of the batches collected which follow the last
+        batch yielded.
+
+        :return: A list of (hash, features) tuples, in the order of the code
+        objects.
+        """
+        results = []
+        while self.__next_batch in self.__collected:
+            results += self.__collected.pop(self.__next_batch)
+            self.__next_batch += 1
+        return results
+
+    def cancel(self):
+        """
+        Cancels the batches not started yet.
+        """
+        for future in self.__pending:
+            future.cancel()
+
+    def __lookup(self, _batch):
+        """
+        Retrieves the features of the code objects of a batch from the cache.
+
+        :param _batch: A list of CodeObject.
+        :return: A dictionary of (hash, features) tuples, in which 'features'
+        includes the labels, keyed by the position within the batch of the
+        objects for which all the features were found in the cache.
+        """
+        found = {}
+        if self.cache is None:
+            return found
+
+        hashes = [_BatchQueue.__hash_of(code) for code in _batch]
+        keys = [self.cache_keys.of(code) for code in _batch]
+        for i, values in enumerate(self.cache.get_many(list(zip(hashes, keys)))):
+            if len(values) == len(keys[i]):
+                features = {f: values[k] for f, k in zip(self.features, keys[i])}
+                features[Feature.LABEL] = _batch[i].labels
+                found[i] = (hashes[i], features)
+        return found
+
+    @staticmethod
+    def __hash_of(_code):
+        """
+        Returns the hash of a code object. A memory-mapped object which was
+        not mapped before is released once hashed, so that it is only mapped
+        again by the worker extracting its features.
+        """
+        loaded = _code.loaded
+        code_hash = _code.hash
+        if not loaded:
+            _code.release()
+        return code_hash
+
 
 class FeatureSet(object):
-    __extracting = False
 
     @staticmethod
-    def extract_features_from_fileset(_features, _codeset):
+    def extract_features_from_fileset(_features, _codeset, _workers=None, _batch_size=DEFAULT_BATCH_SIZE,
+                                      _max_pending=None, _cache=None):
         """
         Extract one or multiple features from all files contained in the given
         file set.
 
         This function will iterate thru each FileObject within the
-        given file set and extract each feature required. This function
+        given file set and extract each feature required. See
+        FeatureSet.iter_features_from_fileset for details. This function
         will return a dictionary of dictionaries:
 
         results = {
@@ -65,168 +386,120 @@ class FeatureSet(object):
 
         :param _features: A list of Feature objects.
         :param _codeset: A CodeSet object with one or more CodeObject
+        :param _workers: The number of worker processes to use. If 'None', features
+        are extracted by a pool of threads of the current process.
+        :param _batch_size: The number of code objects sent to a worker at once.
+        :param _max_pending: The maximum number of batches submitted or waiting
+        to be collected at any time.
+        :param _cache: A FeatureCache consulted before extracting features. If
+        'None', all features are extracted.
         :return: A dictionary of features in which the keys are the hash of the
         code object and the values are dictionaries of features, including the
         labels.
         """
+        extracted_features_dict = {}
+        for code_hash, features in FeatureSet.iter_features_from_fileset(
+                _features, _codeset, _workers, _batch_size, _max_pending, _cache):
+            extracted_features_dict[code_hash] = features
+
+        return FeatureData(extracted_features_dict)
+
+    @staticmethod
+    def iter_features_from_fileset(_features, _codeset, _workers=None, _batch_size=DEFAULT_BATCH_SIZE,
+                                   _max_pending=None, _cache=None):
+        """
+        Extracts one or multiple features from all objects contained in the
+        given code set and yields them as they are collected.
+
+        The code objects are divided in batches which are distributed to a
+        pool of workers. Each worker extracts all the requested features of an
+        object at once, sharing the intermediate results between them, and
+        releases the object afterwards.
+
+        Results are collected as soon as a batch completes, without polling.
+        At most '_max_pending' batches are submitted or waiting to be yielded
+        at any time: no new batch is submitted until the caller consumes the
+        results already collected. Results are yielded in the order of the
+        code set, and an exception raised by a worker is raised again here
+        rather than dropping the results of its batch.
+
+        If a cache is provided, the features of each code object are first
+        looked up in the cache using the hash of the object. Only the objects
+        missing some features are sent to the workers, and the features they
+        extract are added to the cache.
+
+        :param _features: A list of Feature objects.
+        :param _codeset: A CodeSet object with one or more CodeObject
+        :param _workers: The number of worker processes to use. If 'None', features
+        are extracted by a pool of threads of the current process.
+        :param _batch_size: The number of code objects sent to a worker at once.
+        :param _max_pending: The maximum number of batches submitted or waiting
+        to be collected at any time. Defaults to twice the number of workers.
+        :param _cache: A FeatureCache consulted before extracting features. If
+        'None', all features are extracted.
+        :return: A generator of (hash, features) tuples, in which 'features'
+        is a dictionary of features including the labels.
+        """
         assert _features is not None
         assert _codeset is not None
         assert len(_features) > 0
         assert len(_codeset) > 0
-        from queue import Queue
-
-        extracted_features_queue = Queue()
-        extracted_features_dict = {}
-        FeatureSet.__extracting = True
-
-        threads = []
-        process_features_from_queue = threading.Thread(
-            name="t_extracted_features_queue_reader",
-            target=FeatureSet.__manage_extracted_feature_queue,
-            args=(extracted_features_queue, extracted_features_dict)
-        )
-
-        process_features_from_queue.start()
-
-        files = _codeset.objects.values()
-        for file in files:
-            for feature in _features:
-                t = threading.Thread(
-                    name="t_{f:s}_{h:s}".format(f=feature, h=file.hash),
-                    target=FeatureSet.__extract_feature_from_code_object,
-                    args=(feature, file, extracted_features_queue)
-                )
-                while len(threads) >= 30:
-                    time.sleep(0.8)
-                    for st in threads:
-                        if not st.is_alive():
-                            threads.remove(st)
-
-                threads.append(t)
-                t.start()
-            time.sleep(0.3)
-
-        debug("Waiting for feature extraction threads to terminate ({tc:d})...".format(
-            tc=len(threads)
+        assert _batch_size > 0
+
+        if _workers is None:
+            workers = os.cpu_count() or 1
+            executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            assert _workers > 0
+            executor = ProcessPoolExecutor(max_workers=_workers)
+            workers = _workers
+        max_pending = 2 * workers if _max_pending is None else _max_pending
+        assert max_pending > 0
+
+        debug("Extracting features from {cc:d} object(s) in batches of {bs:d} using {wc:d} worker(s)...".format(
+            cc=len(_codeset), bs=_batch_size, wc=workers
         ))
-        time.sleep(2)
-        t_i = 0
-        while len(threads) > 0:
-            t = threads[t_i % len(threads)]
-            t.join(timeout=2)
-            if t.is_alive():
-                debug("\tWaiting on '{tn:s}'...".format(tn=t.name))
-            else:
-                threads.remove(t)
-            t_i += 1
-            time.sleep(2)
-
-        FeatureSet.__extracting = False
-
-        process_features_from_queue.join(timeout=3)
-        if process_features_from_queue.is_alive():
-            warn("Failed to terminate thread '{tn:s}'.".format(tn=process_features_from_queue.name))
-
-        features_data = FeatureData(extracted_features_dict)
-        return features_data
+
+        with executor:
+            queue = _BatchQueue(executor, _features, iter(_codeset), _batch_size, max_pending, _cache)
+            try:
+                while True:
+                    queue.submit()
+                    if queue.empty:
+                        break
+                    queue.collect()
+                    for result in queue.pop_ready():
+                        yield result
+            finally:
+                queue.cancel()
 
     @staticmethod
-    def __extract_feature_from_code_object(_feature, _code, _queue):
+    def feature_schema(_features):
         """
-        Extracts a specific feature from the given code object and adds the extracted
-        information in the provided queue.
-
-        This function will verify the given feature and call the associated function of
-        the code object. It will store the code object, the Feature object and the
-        results into a tuple, which will be enqueued for later retrieval. The tuple
-        enqueue is in the format (_code, _feature, results).
+        Returns the schema of the feature matrices containing the given
+        features, placed in the order of the Feature enumeration.
 
-        :param _feature: The feature to extract. Must be a Feature enum.
-        :param _code: The code object to extract the feature from. Must be a CodeObject.
-        :param _queue: A Queue object in which the data will be enqueued.
-        :return:
+        :param _features: A list of Feature objects.
+        :return: A FeatureSchema object.
         """
-        assert _feature is not None
-        assert _code is not None and isinstance(_code, CodeObject)
-        assert _queue is not None
-        debug("Extracting '{fn:s}' from code object '{h:s}'...".format(
-            fn=_feature, h=_code.hash
-        ))
-        feature_data = None
-
-        if _feature == Feature.BFD:
-            feature_data = _code.bfd()
-        elif _feature == Feature.WFD:
-            feature_data = _code.wfd()
-        elif _feature == Feature.BYTE_VAL_MEAN:
-            feature_data = _code.mean_byte_value()
-        elif _feature == Feature.BYTE_VAL_STDDEV:
-            feature_data = _code.byte_std_dev()
-        elif _feature == Feature.BYTE_VAL_MAD:
-            feature_data = _code.byte_mean_dev()
-        elif _feature == Feature.LOW_ASCII_FREQ:
-            feature_data = _code.low_ascii_freq()
-        elif _feature == Feature.HIGH_ASCII_FREQ:
-            feature_data = _code.high_ascii_freq()
-        elif _feature == Feature.STD_KURTOSIS:
-            feature_data = _code.byte_std_kurtosis()
-        elif _feature == Feature.STD_SKEWNESS:
-            feature_data = _code.byte_mean_dev()
-        elif _feature == Feature.AVG_BYTE_CONTINUITY:
-            feature_data = _code.byte_avg_continuity()
-        elif _feature == Feature.LONGEST_STREAK:
-            feature_data = _code.longest_byte_streak()
-        elif _feature == Feature.SHANNON_ENTROPY:
-            feature_data = _code.shannon_entropy()
-        elif _feature == Feature.B_0001:
-            feature_data = _code.word_count(0x0001)
-        elif _feature == Feature.B_1000:
-            feature_data = _code.word_count(0x1000)
-        elif _feature == Feature.B_FEFF:
-            feature_data = _code.word_count(0xFEFF)
-        elif _feature == Feature.B_FFFE:
-            feature_data = _code.word_count(0xFFFE)
-
-        _queue.put((_code, _feature, feature_data))
+        return FeatureSchema([REGISTRY.spec(f) for f in sorted(_features, key=lambda f: f.value)])
 
     @staticmethod
-    def __manage_extracted_feature_queue(_queue, _features_dict):
+    def extract_feature(_feature, _code):
         """
-        Consumes the objects contained in the given queue and inserts them
-        in the dictionary object provided.
-
-        This function expects a tuple of 3 items to be rad from the Queue. The first
-        item should be a FileObject, the second should be a Feature enumeration and
-        the third one, the value for that Feature extracted from the FileObject:
-        (<FileObject>, <Feature>, feature_result)
+        Extracts a specific feature from the given code object.
 
-        The values of this tuple will be inserted into the given dictionary. The
-        dictionary created by this function is in the following format:
+        The function used to extract the feature, and the intermediate results
+        it needs, are looked up in the feature registry.
 
-        {
-          <FileObject1.hash>     :   {  <Feature1>    :  <Value1>,
-                                        ...
-                                        <FeatureN>    :  <ValueN>,
-          ...
-        }
-
-        :param _queue: A queue.Queue object from which object will be consumed.
-        :param _features_dict: A dictionary object containing the features extracted
-        from file objects.
-        :return:
+        :param _feature: The feature to extract. Must be a registered Feature enum.
+        :param _code: The code object to extract the feature from. Must be a CodeObject.
+        :return: The value of the feature.
         """
-        while FeatureSet.__extracting:
-            (fobj, feature, feature_result) = _queue.get()
-            if fobj.hash in _features_dict:
-                _features_dict[fobj.hash][feature] = feature_result
-                debug("Added feature '{:s}' to '{:s}'.".format(feature, fobj.hash))
-            else:
-                _features_dict[fobj.hash] = {
-                    feature: feature_result,
-                    Feature.LABEL: fobj.labels
-                }
-            _queue.task_done()
-            time.sleep(0.5)
+        assert _feature is not None
+        assert _code is not None and isinstance(_code, CodeObject)
+
+        return REGISTRY.extract([_feature], _code)[_feature]
 
 
 class FeatureData(object):
@@ -240,82 +513,66 @@ class FeatureData(object):
     def data(self):
         return self._data
 
-    def to_feature_matrix2(self):
-        '''
-        Ugly hack. Need better solution
-        :return:
-        '''
+    def feature_schema(self, _features=None):
+        """
+        Returns the schema of the feature matrices built from the current data.
+
+        :param _features: The features to include in the matrix, in column
+        order. If 'None', all the features of the data are included, in the
+        order of the Feature enumeration.
+        :return: A FeatureSchema object.
+        """
+        if _features is None:
+            rows = self._data.values() if isinstance(self._data, dict) else self._data
+            first = next(iter(rows))
+            return FeatureSet.feature_schema([f for f in first.keys() if f != Feature.LABEL])
+        return FeatureSchema([REGISTRY.spec(f) for f in _features])
 
-        feature_matrix = []
+    def to_feature_matrix2(self, _features=None, _sparse=None):
+        """
+        Converts the extracted features into a normalized feature matrix.
+
+        The matrix is preallocated according to the schema of the features and
+        filled one row per code object. Wide schemas, such as the ones including
+        the WFD, produce a CSR sparse matrix.
+
+        :param _features: The features to include in the matrix, in column
+        order. If 'None', all features are included. See feature_schema().
+        :param _sparse: Build a sparse matrix. If 'None', depends on the width
+        of the schema.
+        :return: A tuple containing the normalized matrix and the list of the
+        hashes of the code objects, in row order.
+        """
+        builder = FeatureMatrixBuilder(self.feature_schema(_features), len(self._data), _sparse)
         feature_objects = []
 
-        for fkey in self._data.keys():
-            fdict = self._data[fkey]
+        for fkey, fdict in self._data.items():
             feature_objects.append(fkey)
-            feature_vector = []
-            for skey in fdict.keys():
-                feature_value = fdict[skey]
-                if skey == Feature.BFD:
-                    v = [0] * 256
-                    for bvalue in feature_value.keys():
-                        v[int(bvalue)] = float(feature_value[bvalue])
-                    feature_value = v
-                elif skey == Feature.WFD:
-                    v = [0] * 65536
-                    for bvalue in feature_value.keys():
-                        v[int(bvalue)] = float(feature_value[bvalue])
-                    feature_value = v
-                elif skey == Feature.LOW_ASCII_FREQ:
-                    # 32 to 127
-                    v = [0] * 95
-                    for bvalue in feature_value.keys():
-                        v[int(bvalue) - 32] = float(feature_value[bvalue])
-                    feature_value = v
-                elif skey == Feature.HIGH_ASCII_FREQ:
-                    # 128 to 255
-                    v = [0] * 128
-                    for bvalue in feature_value.keys():
-                        v[int(bvalue) - 128] = float(feature_value[bvalue])
-                    feature_value = v
-                elif skey == Feature.LABEL:
-                    # Single label for now:
-                    #feature_labels.append(feature_value)
-                    pass
-                else:
-                    feature_value = float(feature_value)
-
-                if isinstance(feature_value, list):
-                    feature_vector += feature_value
-                else:
-                    feature_vector.append(feature_value)
-
-            feature_matrix.append(feature_vector)
+            builder.add_row(fdict)
 
-        return normalize(feature_matrix), feature_objects
+        return normalize(builder.build()), feature_objects
 
-
-    def to_feature_matrix(self):
-
-        feature_matrix = []
+    def to_feature_matrix(self, _features=None, _sparse=None):
+        """
+        Converts the features loaded from a file into a normalized feature
+        matrix.
+
+        :param _features: The features to include in the matrix, in column
+        order. If 'None', all features are included. See feature_schema().
+        :param _sparse: Build a sparse matrix. If 'None', depends on the width
+        of the schema.
+        :return: A tuple containing the normalized matrix and the list of the
+        labels, in row order.
+        """
+        builder = FeatureMatrixBuilder(self.feature_schema(_features), len(self._data), _sparse)
         feature_labels = []
 
         for fdict in self._data:
-            feature_vector = []
-            for skey in fdict.keys():
-                feature_value = fdict[skey]
-                if skey == Feature.LABEL:
-                        # Single label for now:
-                        feature_labels.append(feature_value)
-                else:
-                    if isinstance(feature_value, list):
-                        feature_vector += feature_value
-                    else:
-                        feature_vector.append(feature_value)
-
-            feature_matrix.append(feature_vector)
-
-        return normalize(feature_matrix), feature_labels
+            # Single label for now:
+            feature_labels.append(fdict[Feature.LABEL])
+            builder.add_row(fdict)
 
+        return normalize(builder.build()), feature_labels
 
     def get_training_and_test_sets(self, _percentage):
         """
@@ -500,6 +757,46 @@ class FeatureData(object):
         with open(_destfile, "w+") as f:
             f.write(json.dumps(self._data))
 
+    def save_features_to_store(self, _directory, _features=None):
+        """
+        Saves the extracted features into a binary feature store.
+
+        The raw feature values are written as a matrix following the schema of
+        the features, along with the hash and the first label of each code
+        object. See resyst.store.FeatureStore.
+
+        :param _directory: The directory of the feature store.
+        :param _features: The features to include in the store, in column
+        order. If 'None', all features are included. See feature_schema().
+        :return: The FeatureStore object created.
+        """
+        assert _directory is not None
+
+        schema = self.feature_schema(_features)
+        builder = FeatureMatrixBuilder(schema, len(self._data))
+        hashes = []
+        labels = []
+
+        for fkey, fdict in self._data.items():
+            hashes.append(fkey)
+            # Single label for now:
+            flabels = fdict.get(Feature.LABEL) or [""]
+            labels.append(flabels[0])
+            builder.add_row(fdict)
+
+        columns = [(spec.feature.name, spec.width) for spec in schema.specs]
+        return FeatureStore.write(_directory, columns, builder.build(), hashes, labels)
+
+    @staticmethod
+    def load_features_from_store(_directory):
+        """
+        Opens a feature store created using FeatureData.save_features_to_store().
+
+        :param _directory: The directory of the feature store.
+        :return: A FeatureStore object.
+        """
+        return FeatureStore(_directory)
+
     @staticmethod
     def load_features_from_json(_jsonfile):
         """
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.journal
+    ~~~~~~~~~~~~~
+
+    Append-only journal of extracted features.
+
+    Features are written to the journal one row at a time, as soon as they
+    are extracted, so the features are never all held in memory. Each row is
+    a line of JSON containing the hash and label of a code object and the
+    non-zero columns of its features, following a FeatureSchema. The first
+    line of the journal describes the columns.
+
+    The binary digests of the code objects are also appended to a file next
+    to the journal, 28 bytes per row. A resumed journal loads them into a
+    sorted array to tell which objects are already journalled, without
+    parsing its rows; this array is the only memory used which grows with
+    the number of rows.
+
+    The journal is periodically flushed to disk. A resume marker written
+    next to it records how many rows, and bytes, are safely on disk. When a
+    journal is opened again with the same columns, anything written after
+    the marker is discarded and new rows are appended after the last row
+    recorded, so an interrupted extraction resumes where it stopped. The
+    header and the marker also record the byte order the words of the code
+    objects were read in, since features such as the WFD depend on it.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import os
+import json
+
+import numpy as np
+
+from resyst.log import *
+from resyst.stats import NATIVE_ENDIAN
+from resyst.matrix import MAX_DENSE_WIDTH
+from resyst.store import FeatureStoreWriter
+
+# Suffix of the resume marker of a journal.
+RESUME_SUFFIX = ".resume"
+
+# Suffix of the file of the digests of the rows of a journal.
+DIGESTS_SUFFIX = ".digests"
+
+# Size of the binary SHA224 digest of a code object.
+DIGEST_SIZE = 28
+
+# Default number of rows appended between two synchronizations to disk.
+DEFAULT_SYNC_INTERVAL = 256
+
+
+class FeatureJournal(object):
+    def __init__(self, _file, _schema, _sync_interval=DEFAULT_SYNC_INTERVAL, _byteorder=None):
+        """
+        Opens the feature journal stored in the given file.
+
+        If the file and its resume marker exist and the journal was created
+        with the same columns and byte order, the rows recorded by the marker
+        are kept and new rows are appended after them. Otherwise, a new journal
+        is created.
+
+        :param _file: The file of the journal.
+        :param _schema: The FeatureSchema of the rows.
+        :param _sync_interval: The number of rows appended between two
+        synchronizations to disk.
+        :param _byteorder: The byte order of the words of the code objects,
+        'little' or 'big'. If 'None', the native byte order.
+        """
+        assert _file is not None
+        assert _schema is not None
+        assert _sync_interval > 0
+
+        self.file = _file
+        self.marker = _file + RESUME_SUFFIX
+        self.digests_file = _file + DIGESTS_SUFFIX
+        self.schema = _schema
+        self.sync_interval = _sync_interval
+        self.byteorder = NATIVE_ENDIAN if _byteorder is None else _byteorder
+        self._columns = [[spec.feature.name, spec.width] for spec in _schema.specs]
+        self._digests = np.empty(0, dtype="V{ds:d}".format(ds=DIGEST_SIZE))
+        self._rows = 0
+        self._unsynced = 0
+
+        offset = self.__resume()
+        if offset is None:
+            self._stream = open(_file, "wb")
+            self._digest_stream = open(self.digests_file, "wb")
+            self._stream.write(self.__encode({"columns": self._columns, "byteorder": self.byteorder}))
+            self.sync()
+        else:
+            self._stream = open(_file, "r+b")
+            self._stream.truncate(offset)
+            self._stream.seek(offset)
+            self._digest_stream = open(self.digests_file, "r+b")
+            self._digest_stream.truncate(self._rows * DIGEST_SIZE)
+            self._digest_stream.seek(self._rows * DIGEST_SIZE)
+
+    def __len__(self):
+        """
+        Returns the number of rows of the journal.
+        """
+        return self._rows
+
+    def __contains__(self, _hash):
+        """
+        Verifies if the journal contained a row for the given code object
+        when it was opened. Rows appended since are not considered.
+
+        :param _hash: The hash of a code object.
+        :return: True if the journal contains a row for the object.
+        """
+        digest = np.array(bytes.fromhex(_hash), dtype=self._digests.dtype)
+        position = np.searchsorted(self._digests, digest)
+        return position < len(self._digests) and self._digests[position] == digest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _value, _traceback):
+        self.close()
+
+    def append(self, _hash, _label, _features):
+        """
+        Appends the features of a code object to the journal.
+
+        :param _hash: The hash of the code object.
+        :param _label: The label of the code object, as a string.
+        :param _features: A dictionary of feature values keyed by feature.
+        """
+        assert _hash is not None
+        assert self._stream is not None
+
+        columns, values = self.schema.encode(_features)
+        nonzero = values != 0
+        row = {"hash": _hash, "label": _label,
+               "columns": columns[nonzero].tolist(), "values": values[nonzero].tolist()}
+        self._stream.write(self.__encode(row))
+        self._digest_stream.write(bytes.fromhex(_hash))
+        self._rows += 1
+        self._unsynced += 1
+        if self._unsynced >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Writes the rows appended so far to disk and updates the resume marker.
+        """
+        for stream in [self._stream, self._digest_stream]:
+            stream.flush()
+            os.fsync(stream.fileno())
+
+        marker = {"rows": self._rows, "offset": self._stream.tell(),
+                  "columns": self._columns, "byteorder": self.byteorder}
+        tmp_marker = self.marker + ".tmp"
+        with open(tmp_marker, "wb") as f:
+            f.write(self.__encode(marker))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_marker, self.marker)
+        self._unsynced = 0
+
+    def close(self):
+        """
+        Writes the remaining rows to disk and closes the journal.
+        """
+        if self._stream is not None:
+            self.sync()
+            self._stream.close()
+            self._digest_stream.close()
+            self._stream = None
+            self._digest_stream = None
+
+    def remove(self):
+        """
+        Closes the journal and deletes its file, digests and resume marker.
+        """
+        self.close()
+        for file in [self.file, self.digests_file, self.marker]:
+            if os.path.exists(file):
+                os.remove(file)
+
+    def rows(self):
+        """
+        Reads the rows of the journal, one at a time.
+
+        :return: A generator of (hash, label, columns, values) tuples, in which
+        'columns' and 'values' are numpy arrays of the non-zero columns of the row.
+        """
+        if self._stream is not None:
+            self.sync()
+        count = 0
+        with open(self.file, "rb") as f:
+            f.readline()
+            for line in f:
+                if count >= self._rows:
+                    break
+                row = json.loads(line.decode("utf-8"))
+                yield (row["hash"], row["label"],
+                       np.array(row["columns"], dtype=np.int64), np.array(row["values"], dtype=np.float64))
+                count += 1
+
+    def to_store(self, _directory, _sparse=None):
+        """
+        Writes the rows of the journal into a feature store.
+
+        The journal is read twice: once to count the labels and values of the
+        rows, once to fill the store. Neither pass holds more than a row in
+        memory.
+
+        :param _directory: The directory of the feature store.
+        :param _sparse: Store a sparse matrix. If 'None', sparse matrices are
+        stored for schemas wider than MAX_DENSE_WIDTH columns.
+        :return: The FeatureStore object created.
+        """
+        sparse = len(self.schema) > MAX_DENSE_WIDTH if _sparse is None else _sparse
+
+        labels = set()
+        nnz = 0
+        for _, label, columns, _ in self.rows():
+            labels.add(label)
+            nnz += len(columns)
+
+        writer = FeatureStoreWriter(_directory, self._columns, self._rows, sorted(labels),
+                                    nnz if sparse else None)
+        try:
+            for code_hash, label, columns, values in self.rows():
+                writer.add_row(code_hash, label, columns, values)
+        except:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def __resume(self):
+        """
+        Loads the digests of the rows recorded by the resume marker of an
+        existing journal.
+
+        :return: The offset following the last row recorded, or 'None' if the
+        journal cannot be resumed.
+        """
+        if not all(os.path.isfile(f) for f in [self.file, self.digests_file, self.marker]):
+            return None
+
+        with open(self.marker, "rb") as f:
+            marker = json.loads(f.read().decode("utf-8"))
+        if marker["columns"] != self._columns:
+            warn("Features of journal '{f:s}' differ from the features requested. Starting over.".format(
+                f=self.file))
+            return None
+        if marker.get("byteorder") != self.byteorder:
+            warn("Byte order of journal '{f:s}' differs from the byte order requested. Starting over.".format(
+                f=self.file))
+            return None
+
+        assert os.path.getsize(self.file) >= marker["offset"], "Corrupted journal '{f:s}'.".format(f=self.file)
+        assert os.path.getsize(self.digests_file) >= marker["rows"] * DIGEST_SIZE, \
+            "Corrupted journal '{f:s}'.".format(f=self.file)
+
+        self._digests = np.sort(np.fromfile(self.digests_file, dtype=self._digests.dtype, count=marker["rows"]))
+        self._rows = marker["rows"]
+        return marker["offset"]
+
+    @staticmethod
+    def __encode(_object):
+        """
+        Encodes an object as a line of JSON.
+        """
+        return (json.dumps(_object) + "\n").encode("utf-8")
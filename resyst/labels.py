@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.labels
+    ~~~~~~~~~~~~~
+
+    Integer encoding of the labels of code objects.
+
+    Labels are strings, such as file extensions, shared by many objects.
+    The label dictionary assigns each distinct label a small integer id the
+    first time it is seen; objects only store the ids of their labels. The
+    ids are specific to the process: they are converted back to strings when
+    objects are pickled.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import threading
+
+
+class LabelDictionary(object):
+    def __init__(self):
+        """
+        Creates an empty label dictionary.
+        """
+        self.__lock = threading.Lock()
+        self.__ids = {}
+        self.__names = []
+
+    def __len__(self):
+        """
+        Returns the number of distinct labels in the dictionary.
+        """
+        return len(self.__names)
+
+    def __contains__(self, _name):
+        """
+        Verifies if the given label has an id.
+        """
+        return _name in self.__ids
+
+    def id(self, _name):
+        """
+        Returns the id of the given label, assigning a new id if needed.
+
+        :param _name: The label, as a string. Cannot be 'None'.
+        :return: The integer id of the label.
+        """
+        assert _name is not None
+
+        label_id = self.__ids.get(_name)
+        if label_id is None:
+            with self.__lock:
+                label_id = self.__ids.get(_name)
+                if label_id is None:
+                    label_id = len(self.__names)
+                    self.__names.append(_name)
+                    self.__ids[_name] = label_id
+        return label_id
+
+    def ids(self, _names):
+        """
+        Returns the ids of the given labels, assigning new ids if needed.
+
+        :param _names: An iterable of labels.
+        :return: A tuple of integer ids, in the same order.
+        """
+        return tuple(self.id(name) for name in _names)
+
+    def name(self, _id):
+        """
+        Returns the label of the given id.
+
+        :param _id: An id returned by id().
+        :return: The label, as a string.
+        """
+        return self.__names[_id]
+
+    def names(self, _ids):
+        """
+        Returns the labels of the given ids.
+
+        :param _ids: An iterable of ids returned by id().
+        :return: A list of labels, in the same order.
+        """
+        return [self.__names[i] for i in _ids]
+
+
+# Label dictionary shared by all the objects of the process.
+LABELS = LabelDictionary()
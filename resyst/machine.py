@@ -11,15 +11,151 @@
 """
 import random
 from abc import *
+
+import numpy as np
+import scipy.sparse
 from sklearn.neighbors import *
 from sklearn.svm import *
 from sklearn.tree import DecisionTreeClassifier
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.linear_model import SGDClassifier
+from sklearn.kernel_approximation import Nystroem
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.pipeline import Pipeline
+from sklearn.naive_bayes import GaussianNB
+from sklearn.metrics.pairwise import euclidean_distances
+
+from resyst.log import *
+
+# Number of test samples predicted at once when evaluating a classifier.
+PREDICT_CHUNK_SIZE = 8192
+
+# Number of samples given at once to incremental classifiers.
+DEFAULT_TRAIN_BATCH_SIZE = 1024
+
+# Methods approximating the feature map of the RBF kernel.
+APPROX_NYSTROEM = 'nystroem'
+APPROX_FOURIER = 'fourier'
+APPROX_METHODS = [APPROX_NYSTROEM, APPROX_FOURIER]
+
+# Default number of dimensions of the approximated feature map.
+DEFAULT_APPROX_COMPONENTS = 1000
+
+
+def as_feature_matrix(_values):
+    """
+    Converts feature vectors into a matrix accepted by the classifiers.
+
+    :param _values: A numpy array, a scipy.sparse matrix or a list of
+    feature vectors.
+    :return: A 2-D numpy array or a scipy.sparse matrix.
+    """
+    if scipy.sparse.issparse(_values):
+        return _values
+    return np.atleast_2d(np.asarray(_values, dtype=np.float64))
+
+
+def as_label_array(_labels):
+    """
+    Converts labels into a 1-D numpy array. Samples labelled with a list of
+    labels are given their first label, or "" if the list is empty.
+
+    :param _labels: A sequence of labels or of lists of labels.
+    :return: A 1-D numpy array of labels.
+    """
+    labels = [(l[0] if len(l) > 0 else "") if isinstance(l, (list, tuple)) else l for l in _labels]
+    return np.asarray(labels)
+
+
+def predict_in_chunks(_estimator, _values, _chunk_size=PREDICT_CHUNK_SIZE):
+    """
+    Predicts the labels of the rows of a feature matrix, a chunk of rows at
+    a time, to bound the memory used by the estimator.
+
+    :param _estimator: A fitted scikit-learn estimator.
+    :param _values: A 2-D numpy array or scipy.sparse matrix.
+    :param _chunk_size: The maximum number of rows predicted at once.
+    :return: A 1-D numpy array of the predicted labels, in row order.
+    """
+    assert _chunk_size > 0
+
+    rows = _values.shape[0]
+    if rows <= _chunk_size:
+        return np.asarray(_estimator.predict(_values))
+    return np.concatenate([np.asarray(_estimator.predict(_values[i:i + _chunk_size]))
+                           for i in range(0, rows, _chunk_size)])
+
+
+def confusion_matrix(_expected, _predicted, _labels=None):
+    """
+    Counts the samples of each pair of expected and predicted labels.
+
+    :param _expected: A 1-D numpy array of the expected labels.
+    :param _predicted: A 1-D numpy array of the predicted labels.
+    :param _labels: The labels of the rows and columns of the matrix, sorted.
+    Every label expected or predicted must be included. If 'None', all the
+    labels expected or predicted are included.
+    :return: A tuple (matrix, labels), in which matrix[i, j] is the number of
+    samples of label labels[i] predicted as labels[j].
+    """
+    assert len(_expected) == len(_predicted)
+
+    if _labels is None:
+        _labels = np.union1d(_expected, _predicted)
+    labels = np.asarray(_labels)
+    assert np.isin(_expected, labels).all() and np.isin(_predicted, labels).all(), \
+        "Labels expected or predicted are missing from the labels of the matrix."
+    count = len(labels)
+    expected = np.searchsorted(labels, _expected)
+    predicted = np.searchsorted(labels, _predicted)
+    matrix = np.bincount(expected * count + predicted, minlength=count * count)
+    return matrix.reshape((count, count)), labels
+
+
+def train_incrementally(_classifier, _batches, _classes, _report_interval=100):
+    """
+    Trains an incremental classifier on batches of samples, one batch at a
+    time, and measures its progressive validation accuracy.
+
+    Each batch is first predicted by the classifier trained on the previous
+    batches, then used to train it. The progressive accuracy is the ratio of
+    samples predicted correctly this way; it estimates the accuracy of the
+    classifier on unseen samples without holding any out.
+
+    :param _classifier: An IncrementalClassifier.
+    :param _batches: An iterable of (values, labels) tuples, such as
+    FeatureStore.iter_batches().
+    :param _classes: All the labels which may appear in the batches.
+    :param _report_interval: The number of batches between two reports of
+    the progressive accuracy.
+    :return: A list of (samples trained on, progressive accuracy) tuples,
+    one per batch. The accuracy is 'None' until a batch was predicted.
+    """
+    assert _classifier is not None
+
+    history = []
+    seen = 0
+    tested = 0
+    correct = 0
+    for batch, (values, labels) in enumerate(_batches, 1):
+        labels = as_label_array(labels)
+        if _classifier.fitted:
+            correct += int(np.sum(_classifier.predict(values) == labels))
+            tested += len(labels)
+        _classifier.partial_fit(values, labels, _classes)
+        seen += len(labels)
+        accuracy = correct / float(tested) if tested > 0 else None
+        history.append((seen, accuracy))
+        if accuracy is not None and batch % _report_interval == 0:
+            info("{c:s}: {sc:d} sample(s), progressive accuracy: {acc:0.4f}".format(
+                c=str(_classifier), sc=seen, acc=accuracy))
+    return history
 
 
 class Classifier(metaclass=ABCMeta):
 
     def __init__(self):
-        pass
+        self.confusion = None
 
     def __str__(self):
         return "<Classifier>"
@@ -46,6 +182,43 @@ class Classifier(metaclass=ABCMeta):
     def predict(self, _extracted_features, **kwargs):
         pass
 
+    def _evaluate(self, _estimator, _featureset, _training_to_test_ratio, **kwargs):
+        """
+        Fits the given estimator on the training set of the feature set and
+        evaluates it on the test set.
+
+        The test set is predicted in chunks of 'chunk_size' rows, given in
+        'kwargs' (PREDICT_CHUNK_SIZE by default).
+
+        :param _estimator: A scikit-learn estimator.
+        :param _featureset: The FeatureData to divide into training and test sets.
+        :param _training_to_test_ratio: The ratio of samples used for training.
+        :return: A tuple (accuracy, results). See Classifier._score().
+        """
+        [(training_values, training_labels), (test_values, test_labels)] = \
+            _featureset.get_training_and_test_sets(_training_to_test_ratio)
+        _estimator.fit(as_feature_matrix(training_values), as_label_array(training_labels))
+        predicted = predict_in_chunks(_estimator, as_feature_matrix(test_values),
+                                      kwargs.get('chunk_size', PREDICT_CHUNK_SIZE))
+        return self._score(predicted, as_label_array(test_labels))
+
+    def _score(self, _predicted, _expected):
+        """
+        Computes the accuracy of the given predictions and stores their
+        confusion matrix in the 'confusion' attribute, as returned by
+        confusion_matrix().
+
+        :param _predicted: A 1-D numpy array of predicted labels.
+        :param _expected: A 1-D numpy array of expected labels.
+        :return: A tuple containing the accuracy and the list of (predicted,
+        expected) pairs.
+        """
+        assert len(_predicted) == len(_expected)
+
+        self.confusion = confusion_matrix(_expected, _predicted)
+        accuracy = float(np.mean(_predicted == _expected)) if len(_expected) > 0 else 0.0
+        return accuracy, list(zip(_predicted.tolist(), _expected.tolist()))
+
 
 class SVMClassifier(Classifier):
 
@@ -58,25 +231,74 @@ class SVMClassifier(Classifier):
         return fmt.format(cv=self.svm.C, kv=self.svm.kernel, gv=str(self.svm.gamma))
 
     def test_accuracy(self, _featureset, _training_to_test_ratio = 0.9, **kwargs):
-        [(training_values, training_labels), (test_values, test_labels)] = \
-            _featureset.get_training_and_test_sets(_training_to_test_ratio)
-        results = []
-        self.svm.fit(training_values, training_labels)
-        successful_predictions = 0
-        for i in range(len(test_values)):
-            response = self.svm.predict(test_values[i])
-            expected = test_labels[i]
-            if response == expected:
-                successful_predictions += 1
-            results.append((response, expected))
-
-        accuracy = successful_predictions / float(len(test_values))
-        return accuracy, results
+        return self._evaluate(self.svm, _featureset, _training_to_test_ratio, **kwargs)
 
     def predict(self, _extracted_features, **kwargs):
         response = self.svm.predict(_extracted_features)
         return response
 
+class ApproxSVMClassifier(Classifier):
+    """
+    SVM with an RBF kernel approximated by an explicit feature map, followed
+    by a linear SVM. Training scales linearly with the number of samples,
+    rather than quadratically or worse for SVMClassifier.
+
+    The feature map is either a Nystroem approximation, built from a subset
+    of the training samples, or random Fourier features.
+    """
+
+    def __init__(self, _C=256, _gamma='auto', _method=APPROX_NYSTROEM, _components=DEFAULT_APPROX_COMPONENTS,
+                 _random_state=0):
+        super().__init__()
+        assert _method in APPROX_METHODS
+        assert _components > 0
+
+        self.method = _method
+        self.gamma = _gamma
+        self.components = _components
+        self.random_state = _random_state
+        self.model = Pipeline([
+            ('feature_map', self.__feature_map(1.0 if _gamma == 'auto' else _gamma)),
+            ('svm', LinearSVC(C=_C)),
+        ])
+
+    def __str__(self):
+        fmt = "<ApproxSVM C={cv:d}, method='{mv:s}', components={nc:d}, gamma={gv:s}>"
+        return fmt.format(cv=self.model.named_steps['svm'].C, mv=self.method,
+                          nc=self.components, gv=str(self.gamma))
+
+    def fit(self, _values, _labels):
+        """
+        Trains the feature map and the linear SVM on the given samples.
+
+        A gamma of 'auto' is resolved, as by SVC, to one over the number of
+        features.
+
+        :param _values: A 2-D numpy array or scipy.sparse matrix.
+        :param _labels: The label of each sample.
+        :return: The current object.
+        """
+        gamma = 1.0 / _values.shape[1] if self.gamma == 'auto' else self.gamma
+        self.model.set_params(feature_map=self.__feature_map(gamma))
+        self.model.fit(_values, as_label_array(_labels))
+        return self
+
+    def test_accuracy(self, _featureset, _training_to_test_ratio = 0.9, **kwargs):
+        return self._evaluate(self, _featureset, _training_to_test_ratio, **kwargs)
+
+    def predict(self, _extracted_features, **kwargs):
+        response = self.model.predict(_extracted_features)
+        return response
+
+    def __feature_map(self, _gamma):
+        """
+        Creates the transformer approximating the feature map of the kernel.
+        """
+        if self.method == APPROX_FOURIER:
+            return RBFSampler(gamma=_gamma, n_components=self.components, random_state=self.random_state)
+        return Nystroem(gamma=_gamma, n_components=self.components, random_state=self.random_state)
+
+
 class KNNClassifier(Classifier):
 
     def __init__(self, _k = 3):
@@ -89,21 +311,7 @@ class KNNClassifier(Classifier):
 
 
     def test_accuracy(self, _featureset, _training_to_test_ratio = 0.9, **kwargs):
-        [(training_values, training_labels), (test_values, test_labels)] = \
-            _featureset.get_training_and_test_sets(_training_to_test_ratio)
-
-        results = []
-        self.knn.fit(training_values, training_labels)
-        successful_predictions = 0
-        for i in range(len(test_values)):
-            response = self.knn.predict(test_values[i])
-            expected = test_labels[i]
-            if response == expected:
-                successful_predictions += 1
-            results.append((response, expected))
-
-        accuracy = successful_predictions / float(len(test_values))
-        return accuracy, results
+        return self._evaluate(self.knn, _featureset, _training_to_test_ratio, **kwargs)
 
 
     def predict(self, _extracted_features, **kwargs):
@@ -121,20 +329,7 @@ class DTClassifier(Classifier):
         return fmt
 
     def test_accuracy(self, _featureset, _training_to_test_ratio = 0.9, **kwargs):
-        [(training_values, training_labels), (test_values, test_labels)] = \
-            _featureset.get_training_and_test_sets(_training_to_test_ratio)
-        results = []
-        self.tree.fit(training_values, training_labels)
-        successful_predictions = 0
-        for i in range(len(test_values)):
-            response = self.tree.predict(test_values[i])
-            expected = test_labels[i]
-            if response == expected:
-                successful_predictions += 1
-            results.append((response, expected))
-
-        accuracy = successful_predictions / float(len(test_values))
-        return accuracy, results
+        return self._evaluate(self.tree, _featureset, _training_to_test_ratio, **kwargs)
 
     def predict(self, _extracted_features, **kwargs):
         response = self.tree.predict(_extracted_features)
@@ -152,20 +347,144 @@ class RndClassifier(Classifier):
         [(training_values, training_labels), (test_values, test_labels)] = \
             _featureset.get_training_and_test_sets(_training_to_test_ratio)
 
-        results = []
-        choices = list(set(training_labels + test_labels))
-        successful_predictions = 0
+        expected = as_label_array(test_labels)
+        choices = np.unique(np.concatenate([as_label_array(training_labels), expected]))
+        predicted = choices[[random.randrange(len(choices)) for _ in range(len(expected))]]
+        return self._score(predicted, expected)
 
-        for i in range(len(test_values)):
-            response = random.choice(choices)
-            expected = test_labels[i]
-            if response == expected:
-                successful_predictions += 1
-            results.append((response, expected))
+    def predict(self, _extracted_features, **kwargs):
+        response = random.choice(kwargs['choices'])
+        return response
+
+
+class IncrementalClassifier(Classifier):
+    """
+    Classifier trained one batch of samples at a time, so the training set
+    does not need to fit in memory. See train_incrementally().
+    """
+
+    def __init__(self, _model):
+        super().__init__()
+        self.model = _model
+        self.fitted = False
+
+    def partial_fit(self, _values, _labels, _classes):
+        """
+        Trains the classifier on a batch of samples.
+
+        :param _values: A 2-D numpy array or scipy.sparse matrix.
+        :param _labels: The label of each sample.
+        :param _classes: All the labels the classifier will be trained on.
+        """
+        self.model.partial_fit(_values, as_label_array(_labels), classes=np.asarray(sorted(_classes)))
+        self.fitted = True
 
-        accuracy = successful_predictions / float(len(test_values))
-        return accuracy, results
+    def test_accuracy(self, _featureset, _training_to_test_ratio=0.9, **kwargs):
+        [(training_values, training_labels), (test_values, test_labels)] = \
+            _featureset.get_training_and_test_sets(_training_to_test_ratio)
+        training_values = as_feature_matrix(training_values)
+        training_labels = as_label_array(training_labels)
+        expected = as_label_array(test_labels)
+        classes = np.union1d(training_labels, expected)
+
+        batch_size = kwargs.get('batch_size', DEFAULT_TRAIN_BATCH_SIZE)
+        batches = ((training_values[i:i + batch_size], training_labels[i:i + batch_size])
+                   for i in range(0, len(training_labels), batch_size))
+        train_incrementally(self, batches, classes)
+        predicted = predict_in_chunks(self, as_feature_matrix(test_values),
+                                      kwargs.get('chunk_size', PREDICT_CHUNK_SIZE))
+        return self._score(predicted, expected)
 
     def predict(self, _extracted_features, **kwargs):
-        response = random.choice(kwargs['choices'])
+        response = self.model.predict(_extracted_features)
         return response
+
+
+class SGDSVMClassifier(IncrementalClassifier):
+
+    def __init__(self, _alpha=0.0001):
+        super().__init__(SGDClassifier(loss='hinge', alpha=_alpha))
+
+    def __str__(self):
+        fmt = "<SGD-SVM alpha={av:s}>"
+        return fmt.format(av=str(self.model.alpha))
+
+
+class NBClassifier(IncrementalClassifier):
+
+    def __init__(self):
+        super().__init__(GaussianNB())
+
+    def __str__(self):
+        return "<NaiveBayes>"
+
+    def partial_fit(self, _values, _labels, _classes):
+        super().partial_fit(_dense(_values), _labels, _classes)
+
+    def predict(self, _extracted_features, **kwargs):
+        return super().predict(_dense(_extracted_features))
+
+
+class PrototypeClassifier(IncrementalClassifier):
+    """
+    Classifier representing each label by prototypes, the centers of
+    clusters of its samples found with mini-batch k-means. Samples are
+    given the label of their nearest prototype.
+    """
+
+    def __init__(self, _prototypes=8):
+        super().__init__(None)
+        self.prototypes = _prototypes
+        self.clusters = {}
+        self.__pending = {}
+
+    def __str__(self):
+        fmt = "<Prototypes K={kv:d}>"
+        return fmt.format(kv=self.prototypes)
+
+    def partial_fit(self, _values, _labels, _classes):
+        """
+        Updates the prototypes of each label with the samples of the batch.
+
+        The clusters of a label are only created once at least as many
+        samples as prototypes were seen; until then, its samples are kept and
+        used as its prototypes.
+        """
+        labels = as_label_array(_labels)
+        for label in np.unique(labels):
+            values = _values[labels == label]
+            clusters = self.clusters.get(label)
+            if clusters is None:
+                pending = self.__pending.get(label, [])
+                pending.append(values)
+                if sum(v.shape[0] for v in pending) < self.prototypes:
+                    self.__pending[label] = pending
+                    continue
+                values = scipy.sparse.vstack(pending) if scipy.sparse.issparse(values) else np.vstack(pending)
+                self.__pending.pop(label, None)
+                clusters = MiniBatchKMeans(n_clusters=self.prototypes, random_state=0)
+                self.clusters[label] = clusters
+            clusters.partial_fit(values)
+        self.fitted = len(self.clusters) + len(self.__pending) > 0
+
+    def predict(self, _extracted_features, **kwargs):
+        centers = []
+        owners = []
+        for label in sorted(set(self.clusters) | set(self.__pending)):
+            if label in self.clusters:
+                label_centers = self.clusters[label].cluster_centers_
+            else:
+                label_centers = np.vstack([_dense(v) for v in self.__pending[label]])
+            centers.append(label_centers)
+            owners += [label] * len(label_centers)
+        nearest = euclidean_distances(_extracted_features, np.vstack(centers)).argmin(axis=1)
+        return np.asarray(owners)[nearest]
+
+
+def _dense(_values):
+    """
+    Converts a scipy.sparse matrix into a numpy array.
+    """
+    if scipy.sparse.issparse(_values):
+        return _values.toarray()
+    return _values
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.manifest
+    ~~~~~~~~~~~~~
+
+    Persistent manifest of the files of a corpus.
+
+    The manifest records the path, size, modification time, inode, hash and
+    labels of each file loaded into a FileSet. When the same directory is
+    loaded again, files whose size, modification time and inode did not
+    change are restored from the manifest: their contents are neither read
+    nor hashed until they are actually needed.
+
+    The manifest is stored as JSON lines: a header, then one line per file.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import os
+import json
+import threading
+
+from resyst.log import *
+
+MANIFEST_VERSION = 1
+
+
+def file_signature(_stat):
+    """
+    Returns the properties of a file used to detect changes to its contents.
+
+    :param _stat: The os.stat_result of the file.
+    :return: A tuple (size, modification time in nanoseconds, inode).
+    """
+    return _stat.st_size, _stat.st_mtime_ns, _stat.st_ino
+
+
+class CorpusManifest(object):
+    def __init__(self, _file):
+        """
+        Opens the manifest stored in the given file. If the file does not
+        exist, the manifest is empty.
+
+        :param _file: The file of the manifest.
+        """
+        assert _file is not None
+
+        self.file = _file
+        self.__lock = threading.Lock()
+        # Path -> record read from the file.
+        self.__previous = {}
+        # Path -> (signature, FileObject) recorded during this session.
+        self.__current = {}
+
+        if os.path.isfile(_file):
+            with open(_file, "r") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != MANIFEST_VERSION:
+                    warn("Ignoring manifest '{f:s}' of unsupported version.".format(f=_file))
+                    return
+                for line in f:
+                    record = json.loads(line)
+                    self.__previous[record["path"]] = record
+
+    def __len__(self):
+        """
+        Returns the number of files recorded during this session.
+        """
+        return len(self.__current)
+
+    def lookup(self, _path, _signature):
+        """
+        Retrieves the manifest record of a file if the file did not change.
+
+        :param _path: The path of the file.
+        :param _signature: The current signature of the file. See file_signature().
+        :return: A dictionary with the 'hash' and 'labels' of the file, or
+        'None' if the file is not in the manifest or changed.
+        """
+        record = self.__previous.get(_path)
+        if record is None:
+            return None
+        if (record["size"], record["mtime"], record["inode"]) != tuple(_signature):
+            return None
+        return record
+
+    def record(self, _path, _signature, _file):
+        """
+        Records a file loaded during this session.
+
+        The hash and labels of the file object are read when the manifest is
+        saved, so labels added after loading are recorded as well.
+
+        :param _path: The path of the file.
+        :param _signature: The signature of the file when it was loaded.
+        :param _file: The FileObject created from the file.
+        """
+        with self.__lock:
+            self.__current[_path] = (tuple(_signature), _file)
+
+    def save(self):
+        """
+        Writes the files recorded during this session to the manifest file,
+        replacing its previous contents. Files which were not loaded during
+        this session are dropped from the manifest.
+        """
+        tmp_file = self.file + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(json.dumps({"version": MANIFEST_VERSION}) + "\n")
+            for path, (signature, fileobj) in self.__current.items():
+                size, mtime, inode = signature
+                record = {"path": path, "size": size, "mtime": mtime, "inode": inode,
+                          "hash": fileobj.hash, "labels": list(fileobj.labels)}
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_file, self.file)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.matrix
+    ~~~~~~~~~~~~~
+
+    Conversion of extracted features into feature matrices.
+
+    A FeatureSchema fixes the order and position of the columns of each
+    feature, based on the width declared in the feature registry. The
+    FeatureMatrixBuilder preallocates a matrix for a given number of rows
+    and fills it one row at a time, either as a dense numpy array or, for
+    wide schemas such as those including the WFD, as a CSR sparse matrix.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import numpy as np
+import scipy.sparse
+
+# Schemas wider than this number of columns are built as sparse matrices
+# by default.
+MAX_DENSE_WIDTH = 4096
+
+
+class FeatureSchema(object):
+    def __init__(self, _specs):
+        """
+        Creates a schema placing the given features side by side, in the
+        order provided.
+
+        :param _specs: A list of FeatureSpec objects.
+        """
+        assert _specs is not None
+        assert len(_specs) > 0
+
+        self._specs = list(_specs)
+        self._offsets = {}
+        self._widths = {}
+        width = 0
+        for spec in self._specs:
+            assert spec.feature not in self._offsets
+            self._offsets[spec.feature] = width
+            self._widths[spec.feature] = spec.width
+            width += spec.width
+        self._width = width
+
+    def __len__(self):
+        """
+        Returns the number of columns of the schema.
+        """
+        return self._width
+
+    def __eq__(self, _other):
+        if isinstance(_other, self.__class__):
+            return self.features == _other.features
+        return False
+
+    def __ne__(self, _other):
+        return not self.__eq__(_other)
+
+    @property
+    def features(self):
+        """
+        Returns the features of the schema, in column order.
+        :return: A list of features.
+        """
+        return [spec.feature for spec in self._specs]
+
+    @property
+    def specs(self):
+        """
+        Returns the specifications of the features of the schema.
+        :return: A list of FeatureSpec objects.
+        """
+        return list(self._specs)
+
+    def columns(self, _feature):
+        """
+        Returns the columns occupied by the given feature.
+
+        :param _feature: A feature of the schema.
+        :return: A slice object selecting the columns of the feature.
+        """
+        offset = self._offsets[_feature]
+        return slice(offset, offset + self._widths[_feature])
+
+    def encode(self, _features):
+        """
+        Converts a dictionary of feature values into the column indexes and
+        values of a row of the matrix.
+
+        Features returned as dictionaries, such as the BFD, are stored in the
+        column of each key, relative to the offset of the feature. Sequences
+        are stored in consecutive columns and other values in a single column.
+        Features of the dictionary which are not part of the schema are
+        ignored.
+
+        :param _features: A dictionary of feature values keyed by feature.
+        :return: A tuple of numpy arrays (columns, values).
+        """
+        columns = []
+        values = []
+        for spec in self._specs:
+            offset = self._offsets[spec.feature]
+            value = _features[spec.feature]
+            if isinstance(value, dict):
+                keys = np.fromiter((int(k) for k in value.keys()), dtype=np.int64, count=len(value))
+                columns.append(keys - spec.offset + offset)
+                values.append(np.fromiter(value.values(), dtype=np.float64, count=len(value)))
+            elif isinstance(value, (list, tuple, np.ndarray)):
+                assert len(value) == spec.width
+                columns.append(np.arange(offset, offset + spec.width))
+                values.append(np.asarray(value, dtype=np.float64))
+            else:
+                columns.append(np.array([offset]))
+                values.append(np.array([value], dtype=np.float64))
+        return np.concatenate(columns), np.concatenate(values)
+
+
+class FeatureMatrixBuilder(object):
+    def __init__(self, _schema, _rows, _sparse=None, _dtype=np.float32):
+        """
+        Preallocates a feature matrix for the given schema and number of rows.
+
+        :param _schema: The FeatureSchema of the matrix.
+        :param _rows: The number of rows of the matrix.
+        :param _sparse: Build a CSR sparse matrix rather than a dense array. If
+        'None', sparse matrices are built for schemas wider than MAX_DENSE_WIDTH
+        columns.
+        :param _dtype: The numpy type of the values of the matrix.
+        """
+        assert _schema is not None
+        assert _rows >= 0
+
+        self.schema = _schema
+        self.sparse = len(_schema) > MAX_DENSE_WIDTH if _sparse is None else _sparse
+        self._rows = _rows
+        self._dtype = np.dtype(_dtype)
+        self._count = 0
+        if self.sparse:
+            self._indptr = np.zeros(_rows + 1, dtype=np.int64)
+            self._indices = []
+            self._values = []
+        else:
+            self._matrix = np.zeros((_rows, len(_schema)), dtype=self._dtype)
+
+    def __len__(self):
+        """
+        Returns the number of rows filled so far.
+        """
+        return self._count
+
+    def add_row(self, _features):
+        """
+        Fills the next row of the matrix with the given features.
+
+        :param _features: A dictionary of feature values keyed by feature.
+        :return: The index of the row filled.
+        """
+        assert self._count < self._rows
+
+        columns, values = self.schema.encode(_features)
+        row = self._count
+        if self.sparse:
+            nonzero = values != 0
+            order = np.argsort(columns[nonzero], kind="mergesort")
+            self._indices.append(columns[nonzero][order].astype(np.int32))
+            self._values.append(values[nonzero][order].astype(self._dtype))
+            self._indptr[row + 1] = self._indptr[row] + len(order)
+        else:
+            self._matrix[row, columns] = values
+        self._count += 1
+        return row
+
+    def build(self):
+        """
+        Returns the matrix containing the rows filled so far.
+
+        :return: A numpy array, or a scipy.sparse.csr_matrix for sparse matrices.
+        """
+        if not self.sparse:
+            return self._matrix[:self._count]
+
+        indptr = self._indptr[:self._count + 1]
+        if self._count > 0:
+            indices = np.concatenate(self._indices)
+            values = np.concatenate(self._values)
+        else:
+            indices = np.zeros(0, dtype=np.int32)
+            values = np.zeros(0, dtype=self._dtype)
+        return scipy.sparse.csr_matrix(
+            (values, indices, indptr), shape=(self._count, len(self.schema)))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.registry
+    ~~~~~~~~~~~~~
+
+    Declarative registry of features and of the intermediate results they
+    are derived from.
+
+    Each feature declares the width and type of its output and the
+    intermediate results it depends on, such as the byte histogram or the
+    run-length encoding of the data. Intermediate results may depend on
+    other intermediate results. When features are extracted from a code
+    object, the registry computes each intermediate result they need exactly
+    once, in dependency order, before computing the features themselves.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import numpy as np
+
+
+class IntermediateSpec(object):
+    def __init__(self, _name, _function, _requires=None):
+        """
+        Describes an intermediate result shared by several features.
+
+        :param _name: The name of the intermediate result.
+        :param _function: A function computing the intermediate result from a
+        code object. It is expected to cache its result on the object.
+        :param _requires: The names of the intermediate results this result is
+        derived from.
+        """
+        assert _name is not None
+        assert _function is not None
+        self.name = _name
+        self.function = _function
+        self.requires = list(_requires or [])
+
+    def __str__(self):
+        return "<Intermediate '{n:s}'>".format(n=self.name)
+
+
+class FeatureSpec(object):
+    def __init__(self, _feature, _function, _width=1, _dtype=np.float64, _offset=0, _requires=None,
+                 _version=1):
+        """
+        Describes how a feature is extracted and the shape of its values.
+
+        :param _feature: The Feature enum identifying the feature.
+        :param _function: A function extracting the feature from a code object.
+        :param _width: The number of columns occupied by the feature in a
+        feature vector.
+        :param _dtype: The numpy type of the values of the feature.
+        :param _offset: For features returned as dictionaries, the key stored
+        in the first column of the feature.
+        :param _requires: The names of the intermediate results the feature is
+        derived from.
+        :param _version: The version of the implementation of the feature. It
+        must be increased whenever the values returned by the function change,
+        so values cached by previous versions are not reused.
+        """
+        assert _feature is not None
+        assert _function is not None
+        assert _width > 0
+        self.feature = _feature
+        self.function = _function
+        self.width = _width
+        self.dtype = np.dtype(_dtype)
+        self.offset = _offset
+        self.requires = list(_requires or [])
+        self.version = _version
+
+    def __str__(self):
+        fmt = "<FeatureSpec {f!s} Width={w:d}, Type={t!s}>"
+        return fmt.format(f=self.feature, w=self.width, t=self.dtype)
+
+
+class FeatureRegistry(object):
+    def __init__(self):
+        self.__intermediates = {}
+        self.__features = {}
+
+    def __contains__(self, _feature):
+        return _feature in self.__features
+
+    def __len__(self):
+        return len(self.__features)
+
+    def intermediate(self, _name, _requires=None):
+        """
+        Decorator registering a function computing an intermediate result.
+
+        :param _name: The name of the intermediate result.
+        :param _requires: The names of the intermediate results it depends on.
+        All of them must already be registered.
+        :return: The decorator.
+        """
+        assert _name not in self.__intermediates
+        for name in _requires or []:
+            assert name in self.__intermediates
+
+        def register(_function):
+            self.__intermediates[_name] = IntermediateSpec(_name, _function, _requires)
+            return _function
+        return register
+
+    def feature(self, _feature, _width=1, _dtype=np.float64, _offset=0, _requires=None, _version=1):
+        """
+        Decorator registering a function extracting a feature.
+
+        :param _feature: The Feature enum identifying the feature.
+        :param _width: The number of columns occupied by the feature.
+        :param _dtype: The numpy type of the values of the feature.
+        :param _offset: For features returned as dictionaries, the key stored
+        in the first column of the feature.
+        :param _requires: The names of the intermediate results it depends on.
+        All of them must already be registered.
+        :param _version: The version of the implementation of the feature.
+        :return: The decorator.
+        """
+        assert _feature not in self.__features
+        for name in _requires or []:
+            assert name in self.__intermediates
+
+        def register(_function):
+            self.__features[_feature] = FeatureSpec(
+                _feature, _function, _width, _dtype, _offset, _requires, _version)
+            return _function
+        return register
+
+    def spec(self, _feature):
+        """
+        Returns the specification of the given feature.
+
+        :param _feature: A registered Feature enum.
+        :return: The FeatureSpec of the feature.
+        """
+        assert _feature in self.__features, "Unknown feature: {f!s}".format(f=_feature)
+        return self.__features[_feature]
+
+    @property
+    def features(self):
+        """
+        Returns the registered features, in order of registration.
+        :return: A list of Feature enums.
+        """
+        return list(self.__features.keys())
+
+    def schedule(self, _features):
+        """
+        Returns the intermediate results needed by the given features, in an
+        order in which each intermediate result follows its dependencies.
+
+        :param _features: A list of registered Feature enums.
+        :return: A list of intermediate result names, without duplicates.
+        """
+        order = []
+        for feature in _features:
+            for name in self.spec(feature).requires:
+                self.__visit(name, order)
+        return order
+
+    def depends_on(self, _feature, _name):
+        """
+        Verifies if a feature is derived, directly or not, from the given
+        intermediate result.
+
+        :param _feature: A registered Feature enum.
+        :param _name: The name of an intermediate result.
+        :return: True if the intermediate result is needed by the feature.
+        """
+        return _name in self.schedule([_feature])
+
+    def extract(self, _features, _code):
+        """
+        Extracts the given features from a code object.
+
+        The intermediate results needed by the features are computed first,
+        each of them once. The dependencies of an intermediate result are
+        skipped when the code object can provide it directly (see
+        CodeObject.has_intermediate).
+
+        :param _features: A list of registered Feature enums.
+        :param _code: The CodeObject to extract the features from.
+        :return: A dictionary of feature values keyed by Feature enum.
+        """
+        assert _features is not None
+        assert _code is not None
+
+        done = set()
+        for feature in _features:
+            for name in self.spec(feature).requires:
+                self.__compute(name, _code, done)
+
+        return {feature: self.spec(feature).function(_code) for feature in _features}
+
+    def __visit(self, _name, _order, _path=()):
+        """
+        Appends the given intermediate result and its dependencies to the
+        given list in dependency order.
+        """
+        assert _name not in _path, "Circular dependency on '{n:s}'.".format(n=_name)
+        if _name in _order:
+            return
+        for name in self.__intermediates[_name].requires:
+            self.__visit(name, _order, _path + (_name,))
+        _order.append(_name)
+
+    def __compute(self, _name, _code, _done):
+        """
+        Computes the given intermediate result, and its dependencies if
+        needed, on the given code object.
+        """
+        if _name in _done:
+            return
+        spec = self.__intermediates[_name]
+        if not _code.has_intermediate(_name):
+            for name in spec.requires:
+                self.__compute(name, _code, _done)
+        spec.function(_code)
+        _done.add(_name)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.search
+    ~~~~~~~~~~~~~
+
+    Successive halving search of the parameters of a classifier.
+
+    Rather than cross-validating every combination of parameters on all the
+    samples, as GridSearchCV does, all the candidates are first evaluated on
+    a small subsample. Only the best third of them is kept and evaluated
+    again on a subsample three times larger, and so on until a single
+    candidate remains or the budget of samples is reached. Most candidates
+    are therefore only ever trained on a small fraction of the samples.
+
+    The subsamples are stratified and nested: each round includes the
+    samples of the previous one.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import math
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid
+from sklearn.model_selection import StratifiedKFold
+try:
+    from sklearn.externals.joblib import Parallel, delayed
+except ImportError:
+    from joblib import Parallel, delayed
+
+from resyst.log import *
+
+# Ratio between the number of candidates of two consecutive rounds, and
+# between the number of samples they are evaluated on.
+DEFAULT_HALVING_FACTOR = 3
+
+
+def stratified_order(_labels, _random_state=None):
+    """
+    Returns an order of the samples in which every prefix contains about the
+    same proportion of each label as the whole set.
+
+    :param _labels: A 1-D numpy array of labels.
+    :param _random_state: The seed of the random number generator.
+    :return: A numpy array of sample indexes.
+    """
+    rnd = np.random.RandomState(_random_state)
+    keys = np.empty(len(_labels), dtype=np.float64)
+    for label in np.unique(_labels):
+        indexes = np.flatnonzero(_labels == label)
+        ranks = rnd.permutation(len(indexes))
+        keys[indexes] = (ranks + rnd.uniform(size=len(indexes))) / len(indexes)
+    return np.argsort(keys, kind="mergesort")
+
+
+def _fit_and_score(_estimator, _params, _values, _labels, _train, _test, _scorer):
+    """
+    Fits a copy of the estimator with the given parameters on the training
+    samples and scores it on the test samples.
+    """
+    estimator = clone(_estimator).set_params(**_params)
+    estimator.fit(_values[_train], _labels[_train])
+    return _scorer(estimator, _values[_test], _labels[_test])
+
+
+class SuccessiveHalvingSearch(object):
+    def __init__(self, _estimator, _param_grid, _budget=None, _min_samples=None,
+                 _factor=DEFAULT_HALVING_FACTOR, _cv=5, _scoring=None, _n_jobs=1, _random_state=None):
+        """
+        Creates a successive halving search over the given parameters.
+
+        :param _estimator: The scikit-learn estimator to search the parameters of.
+        :param _param_grid: The candidate parameters, in the same format as
+        the 'param_grid' of GridSearchCV.
+        :param _budget: The maximum number of samples a candidate is evaluated
+        on, in the last round. If 'None', all the samples.
+        :param _min_samples: The number of samples of the first round. If
+        'None', it is chosen so that the last round reaches the budget.
+        :param _factor: The ratio between the number of candidates of two
+        consecutive rounds, and between the number of samples they use.
+        :param _cv: The number of folds of the cross-validation of each round.
+        :param _scoring: The scoring of the candidates, as accepted by GridSearchCV.
+        :param _n_jobs: The number of worker processes evaluating candidates.
+        :param _random_state: The seed of the subsampling and of the folds.
+        """
+        assert _estimator is not None
+        assert _factor > 1
+        assert _cv > 1
+
+        self.estimator = _estimator
+        self.candidates = list(ParameterGrid(_param_grid))
+        self.budget = _budget
+        self.min_samples = _min_samples
+        self.factor = _factor
+        self.cv = _cv
+        self.scoring = _scoring
+        self.n_jobs = _n_jobs
+        self.random_state = _random_state
+        self.best_params_ = None
+        self.best_score_ = None
+        self.rounds_ = []
+
+    @property
+    def round_count(self):
+        """
+        Returns the number of rounds needed to reduce the candidates to one.
+        """
+        return max(1, int(math.ceil(math.log(len(self.candidates), self.factor))))
+
+    def fit(self, _values, _labels):
+        """
+        Searches the best parameters on the given samples.
+
+        The best parameters and their score are stored in the 'best_params_'
+        and 'best_score_' attributes. The candidates, number of samples and
+        scores of each round are stored in 'rounds_'.
+
+        :param _values: A 2-D numpy array or scipy.sparse matrix of samples.
+        :param _labels: The label of each sample.
+        :return: The current object.
+        """
+        labels = np.asarray(_labels)
+        assert _values.shape[0] == len(labels)
+
+        budget = len(labels) if self.budget is None else min(self.budget, len(labels))
+        rounds = self.round_count
+        min_samples = self.min_samples
+        if min_samples is None:
+            min_samples = budget // self.factor ** (rounds - 1)
+        # Each fold needs at least one sample of each label.
+        min_samples = min(budget, max(min_samples, self.cv * len(np.unique(labels))))
+
+        order = stratified_order(labels, self.random_state)
+        scorer = get_scorer(self.scoring) if self.scoring is not None else _default_scorer
+        candidates = self.candidates
+        self.rounds_ = []
+        for iteration in range(rounds):
+            samples = min(budget, min_samples * self.factor ** iteration)
+            if iteration == rounds - 1:
+                samples = budget
+            subset = np.sort(order[:samples])
+            scores = self.__evaluate(candidates, _values[subset], labels[subset], scorer)
+            info("Round {r:d}: {cc:d} candidate(s) evaluated on {sc:d} sample(s).".format(
+                r=iteration + 1, cc=len(candidates), sc=samples))
+            self.rounds_.append((candidates, samples, scores))
+
+            ranking = np.argsort(-scores, kind="mergesort")
+            if iteration == rounds - 1:
+                self.best_params_ = candidates[ranking[0]]
+                self.best_score_ = float(scores[ranking[0]])
+            else:
+                kept = int(math.ceil(len(candidates) / self.factor))
+                candidates = [candidates[i] for i in ranking[:kept]]
+        return self
+
+    def __evaluate(self, _candidates, _values, _labels, _scorer):
+        """
+        Cross-validates each candidate on the given samples.
+
+        :return: A numpy array of the mean score of each candidate.
+        """
+        folds = list(StratifiedKFold(n_splits=self.cv, shuffle=True, random_state=self.random_state)
+                     .split(np.zeros(len(_labels)), _labels))
+        scores = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_and_score)(self.estimator, params, _values, _labels, train, test, _scorer)
+            for params in _candidates for train, test in folds)
+        return np.asarray(scores, dtype=np.float64).reshape((len(_candidates), len(folds))).mean(axis=1)
+
+
+def _default_scorer(_estimator, _values, _labels):
+    """
+    Scores an estimator using its own score() function.
+    """
+    return _estimator.score(_values, _labels)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.stats
+    ~~~~~~~~~~~~~
+
+    Vectorized statistics over the byte and word values of binary data.
+
+    All the statistical features of a code object (mean, deviations,
+    moments and entropy) only depend on how many times each byte value
+    appears in the data. This module builds that 256-bin histogram once
+    with numpy and derives every statistic from it in O(256), regardless
+    of the size of the data.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import sys
+import math
+
+import numpy as np
+
+BYTE_VALUES = np.arange(256, dtype=np.int64)
+
+LITTLE_ENDIAN = "little"
+BIG_ENDIAN = "big"
+NATIVE_ENDIAN = sys.byteorder
+BYTE_ORDERS = [LITTLE_ENDIAN, BIG_ENDIAN]
+
+
+def as_buffer(_data):
+    """
+    Returns an object exposing the buffer protocol for the given data.
+
+    Strings are encoded using UTF-8, all other objects are expected to be
+    bytes-like objects and are returned as is.
+
+    :param _data: A string or bytes-like object.
+    :return: A bytes-like object.
+    """
+    if isinstance(_data, str):
+        return _data.encode("utf-8")
+    return _data
+
+
+def byte_array(_data):
+    """
+    Returns a read-only numpy view of the given data as unsigned bytes.
+
+    No copy of the data is made when a bytes-like object is provided.
+
+    :param _data: A string or bytes-like object.
+    :return: A numpy array of uint8.
+    """
+    buffer = as_buffer(_data)
+    if len(buffer) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(buffer, dtype=np.uint8)
+
+
+def byte_histogram(_data):
+    """
+    Counts the occurrences of each byte value within the given data.
+
+    :param _data: A string or bytes-like object.
+    :return: A numpy array of 256 integers in which the value at index i
+    is the number of occurrences of the byte i.
+    """
+    return np.bincount(byte_array(_data), minlength=256).astype(np.int64)
+
+
+def word_histogram(_data, _byteorder=None):
+    """
+    Counts the occurrences of each 16-bit word value within the given data.
+
+    The data is read as consecutive, non-overlapping 16-bit words. If the
+    data contains an odd number of bytes, the last byte is ignored.
+
+    :param _data: A string or bytes-like object.
+    :param _byteorder: The byte order of the words, either 'little' or 'big'.
+    If 'None', the native byte order of the system is used.
+    :return: A numpy array of 65536 integers in which the value at index i
+    is the number of occurrences of the word i.
+    """
+    byteorder = NATIVE_ENDIAN if _byteorder is None else _byteorder
+    assert byteorder in BYTE_ORDERS
+
+    data = byte_array(_data)
+    words = data[:len(data) // 2 * 2].view("<u2" if byteorder == LITTLE_ENDIAN else ">u2")
+    return np.bincount(words, minlength=65536).astype(np.int64)
+
+
+def byte_runs(_data):
+    """
+    Computes the run-length encoding of the given data.
+
+    A run is a maximal sequence of consecutive identical bytes. For example,
+    the data "AABB12CCCC" contains the runs A (2), B (2), 1 (1), 2 (1) and
+    C (4).
+
+    :param _data: A string or bytes-like object.
+    :return: A tuple of numpy arrays (values, lengths) containing the byte
+    value and the length of each run, in order of appearance.
+    """
+    data = byte_array(_data)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(data)))
+    return data[starts], lengths
+
+
+class RunLengths(object):
+    def __init__(self, _values, _lengths):
+        """
+        Describes the runs of identical bytes of some data.
+
+        :param _values: A sequence containing the byte value of each run.
+        :param _lengths: A sequence containing the length of each run.
+        """
+        assert len(_values) == len(_lengths)
+        self._values = np.asarray(_values, dtype=np.uint8)
+        self._lengths = np.asarray(_lengths, dtype=np.int64)
+
+    def __len__(self):
+        """
+        Returns the number of runs.
+        """
+        return len(self._lengths)
+
+    @staticmethod
+    def from_data(_data):
+        """
+        Run-length encodes the given data in a single pass.
+
+        :param _data: A string or bytes-like object.
+        :return: A RunLengths object describing the runs of the data.
+        """
+        return RunLengths(*byte_runs(_data))
+
+    @property
+    def values(self):
+        """
+        Returns the byte value of each run.
+        :return: A numpy array of uint8.
+        """
+        return self._values
+
+    @property
+    def lengths(self):
+        """
+        Returns the length of each run.
+        :return: A numpy array of integers.
+        """
+        return self._lengths
+
+    @property
+    def first(self):
+        """
+        Returns the first run as a (byte, length) tuple, or 'None' if there
+        is no run.
+        """
+        return self.__run(0) if len(self) > 0 else None
+
+    @property
+    def last(self):
+        """
+        Returns the last run as a (byte, length) tuple, or 'None' if there
+        is no run.
+        """
+        return self.__run(len(self) - 1) if len(self) > 0 else None
+
+    @property
+    def longest(self):
+        """
+        Returns the first of the longest runs as a (byte, length) tuple, or
+        (0, 0) if there is no run.
+        """
+        if len(self) == 0:
+            return 0, 0
+        return self.__run(int(self._lengths.argmax()))
+
+    @property
+    def mean_length(self):
+        """
+        Returns the average length of the runs, or 0 if there is no run.
+        """
+        if len(self) == 0:
+            return 0.0
+        return int(self._lengths.sum()) / len(self)
+
+    def length_histogram(self):
+        """
+        Counts the runs of each length.
+        :return: A numpy array in which the value at index i is the number
+        of runs of length i.
+        """
+        return np.bincount(self._lengths)
+
+    def __run(self, _index):
+        """
+        Returns the run at the given index as a (byte, length) tuple.
+        """
+        return int(self._values[_index]), int(self._lengths[_index])
+
+
+class ByteStatistics(object):
+    def __init__(self, _histogram):
+        """
+        Computes the moments of a byte value distribution from its histogram.
+
+        The central moments are computed once, when the object is created,
+        and are shared by all the statistics returned by this object.
+
+        :param _histogram: A sequence of 256 counts, one per byte value.
+        """
+        assert _histogram is not None
+        assert len(_histogram) == 256
+
+        self._histogram = np.asarray(_histogram, dtype=np.int64)
+        self._count = int(self._histogram.sum())
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._m3 = 0.0
+        self._m4 = 0.0
+        self._abs_dev = 0.0
+
+        if self._count > 0:
+            self._mean = int(np.dot(self._histogram, BYTE_VALUES)) / self._count
+            counts = self._histogram.astype(np.float64)
+            d = BYTE_VALUES - self._mean
+            d2 = d * d
+            self._m2 = float(np.dot(counts, d2))
+            self._m3 = float(np.dot(counts, d2 * d))
+            self._m4 = float(np.dot(counts, d2 * d2))
+            self._abs_dev = float(np.dot(counts, np.abs(d)))
+
+    def __len__(self):
+        """
+        Returns the number of bytes described by the histogram.
+        """
+        return self._count
+
+    @staticmethod
+    def from_data(_data):
+        """
+        Creates a ByteStatistics object from the given binary data.
+
+        :param _data: A string or bytes-like object.
+        :return: A ByteStatistics object describing the data.
+        """
+        return ByteStatistics(byte_histogram(_data))
+
+    @property
+    def histogram(self):
+        """
+        Returns the byte histogram the statistics are derived from.
+        :return: A numpy array of 256 integers.
+        """
+        return self._histogram
+
+    @property
+    def mean(self):
+        """
+        Returns the arithmetic mean of the byte values.
+        :return: The mean byte value, or 0 if there is no data.
+        """
+        return self._mean
+
+    @property
+    def std_dev(self):
+        """
+        Returns the sample standard deviation of the byte values.
+        :return: The standard deviation, or 0 if there are less than 2 bytes.
+        """
+        if self._count < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self._count - 1))
+
+    @property
+    def mean_dev(self):
+        """
+        Returns the mean absolute deviation (MAD) of the byte values.
+        :return: The mean absolute deviation, or 0 if there is no data.
+        """
+        if self._count == 0:
+            return 0.0
+        return self._abs_dev / self._count
+
+    @property
+    def kurtosis(self):
+        """
+        Returns the standard kurtosis of the byte values.
+
+        :return: The standard kurtosis, or 0 if all bytes have the same value.
+
+        References:
+            https://en.wikipedia.org/wiki/Kurtosis
+        """
+        s = self.std_dev
+        if s == 0:
+            return 0.0
+        return self._m4 / ((self._count - 1) * math.pow(s, 4))
+
+    @property
+    def skewness(self):
+        """
+        Returns the standard skewness of the byte values.
+        :return: The standard skewness, or 0 if all bytes have the same value.
+        """
+        s = self.std_dev
+        if s == 0:
+            return 0.0
+        return self._m3 / ((self._count - 1) * math.pow(s, 3))
+
+    @property
+    def entropy(self):
+        """
+        Returns the Shannon entropy of the byte values, using base 256 so
+        the result is between 0 and 1.
+        :return: The Shannon entropy of the data.
+        """
+        if self._count == 0:
+            return 0.0
+        p = self._histogram[self._histogram > 0] / float(self._count)
+        return 0.0 - float(np.sum(p * np.log(p))) / math.log(256)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.store
+    ~~~~~~~~~~~~~
+
+    Binary, columnar storage of extracted features.
+
+    A feature store is a directory containing the raw feature matrix as
+    numpy arrays, the hash of the code object of each row and the label of
+    each row encoded as an integer. A small JSON file describes the columns
+    of the matrix and the label of each integer. The arrays are memory-mapped
+    when the store is opened, so no parsing is needed to load the features.
+
+    Dense matrices are stored in 'values.npy'. Sparse matrices are stored as
+    the 'data.npy', 'indices.npy' and 'indptr.npy' arrays of a CSR matrix.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import os
+import json
+import shutil
+
+import numpy as np
+import scipy.sparse
+from numpy.lib.format import open_memmap
+
+from sklearn.preprocessing import normalize
+
+STORE_VERSION = 1
+
+SCHEMA_FILE = "schema.json"
+VALUES_FILE = "values.npy"
+DATA_FILE = "data.npy"
+INDICES_FILE = "indices.npy"
+INDPTR_FILE = "indptr.npy"
+HASHES_FILE = "hashes.npy"
+LABELS_FILE = "labels.npy"
+
+# Type of the hashes stored. Hashes are hexadecimal strings of at most
+# 64 characters.
+HASH_DTYPE = np.dtype("<U64")
+
+
+def memory_map_matrix(_matrix, _directory, _dtype=np.float64):
+    """
+    Writes a feature matrix into the given directory and memory-maps it.
+
+    Worker processes receiving a memory-mapped array only receive the name of
+    its file, so all of them share the same copy of the matrix rather than
+    each receiving a pickled copy. The values are converted to '_dtype'
+    first; float64 is used by default since it is the type most estimators
+    convert their input to.
+
+    :param _matrix: A numpy array or scipy.sparse matrix.
+    :param _directory: An existing directory in which to write the matrix.
+    It must not be removed while the matrix is used.
+    :param _dtype: The numpy type of the values of the matrix.
+    :return: A read-only memory-mapped numpy array, or a scipy.sparse.csr_matrix
+    backed by memory-mapped arrays.
+    """
+    assert os.path.isdir(_directory)
+
+    def map_array(_file, _array):
+        path = os.path.join(_directory, _file)
+        np.save(path, _array)
+        return np.load(path, mmap_mode="r")
+
+    if scipy.sparse.issparse(_matrix):
+        matrix = scipy.sparse.csr_matrix(_matrix, dtype=_dtype)
+        return scipy.sparse.csr_matrix(
+            (map_array(DATA_FILE, matrix.data), map_array(INDICES_FILE, matrix.indices),
+             map_array(INDPTR_FILE, matrix.indptr)),
+            shape=matrix.shape, copy=False)
+    return map_array(VALUES_FILE, np.asarray(_matrix, dtype=_dtype))
+
+
+class FeatureStore(object):
+    def __init__(self, _directory):
+        """
+        Opens the feature store located in the given directory.
+
+        The arrays of the store are memory-mapped in read-only mode and only
+        read from disk when accessed.
+
+        :param _directory: The directory of a store created with FeatureStore.write().
+        """
+        assert _directory is not None
+        assert FeatureStore.is_store(_directory), "Not a feature store: '{d:s}'.".format(d=_directory)
+
+        self.directory = _directory
+        with open(os.path.join(_directory, SCHEMA_FILE), "r") as f:
+            self._schema = json.load(f)
+        assert self._schema["version"] == STORE_VERSION
+
+        self._hashes = self.__load(HASHES_FILE)
+        self._label_ids = self.__load(LABELS_FILE)
+        if self.sparse:
+            self._matrix = scipy.sparse.csr_matrix(
+                (self.__load(DATA_FILE), self.__load(INDICES_FILE), self.__load(INDPTR_FILE)),
+                shape=(self._schema["rows"], self.width))
+        else:
+            self._matrix = self.__load(VALUES_FILE)
+
+    def __len__(self):
+        """
+        Returns the number of rows of the store.
+        """
+        return self._schema["rows"]
+
+    @staticmethod
+    def is_store(_directory):
+        """
+        Verifies if the given path is the directory of a feature store.
+
+        :param _directory: A path.
+        :return: True if the path contains a feature store, False otherwise.
+        """
+        return os.path.isfile(os.path.join(_directory, SCHEMA_FILE))
+
+    @staticmethod
+    def write(_directory, _columns, _matrix, _hashes, _labels):
+        """
+        Writes a feature matrix and the hashes and labels of its rows into a
+        new feature store.
+
+        The store is first written into a temporary directory, then moved to
+        the given directory, replacing any feature store already there.
+
+        :param _directory: The directory of the store.
+        :param _columns: A list of (feature name, width) tuples describing the
+        columns of the matrix, in order.
+        :param _matrix: A numpy array or scipy.sparse matrix of the raw feature
+        values, one row per code object.
+        :param _hashes: The hash of the code object of each row.
+        :param _labels: The label of each row, as a string.
+        :return: The FeatureStore object opened from the directory.
+        """
+        assert _matrix.shape[0] == len(_hashes) == len(_labels)
+
+        sparse = scipy.sparse.issparse(_matrix)
+        if sparse:
+            _matrix = scipy.sparse.csr_matrix(_matrix)
+        writer = FeatureStoreWriter(_directory, _columns, _matrix.shape[0], sorted(set(_labels)),
+                                    _matrix.nnz if sparse else None)
+        try:
+            all_columns = np.arange(_matrix.shape[1])
+            for row in range(_matrix.shape[0]):
+                if sparse:
+                    start, end = _matrix.indptr[row], _matrix.indptr[row + 1]
+                    writer.add_row(_hashes[row], _labels[row],
+                                   _matrix.indices[start:end], _matrix.data[start:end])
+                else:
+                    writer.add_row(_hashes[row], _labels[row], all_columns, _matrix[row])
+        except:
+            writer.abort()
+            raise
+        return writer.close()
+
+    @property
+    def sparse(self):
+        """
+        Returns True if the feature matrix is stored as a sparse matrix.
+        """
+        return self._schema["sparse"]
+
+    @property
+    def columns(self):
+        """
+        Returns the columns of the feature matrix.
+        :return: A list of (feature name, width) tuples, in column order.
+        """
+        return [(name, width) for name, width in self._schema["columns"]]
+
+    @property
+    def width(self):
+        """
+        Returns the number of columns of the feature matrix.
+        """
+        return sum(width for _, width in self._schema["columns"])
+
+    @property
+    def matrix(self):
+        """
+        Returns the raw feature matrix.
+        :return: A memory-mapped numpy array, or a scipy.sparse.csr_matrix
+        backed by memory-mapped arrays.
+        """
+        return self._matrix
+
+    @property
+    def hashes(self):
+        """
+        Returns the hash of the code object of each row.
+        :return: A numpy array of strings.
+        """
+        return self._hashes
+
+    @property
+    def label_names(self):
+        """
+        Returns the distinct labels of the store, indexed by label id.
+        :return: A list of strings.
+        """
+        return list(self._schema["labels"])
+
+    @property
+    def label_ids(self):
+        """
+        Returns the label id of each row.
+        :return: A numpy array of integers.
+        """
+        return self._label_ids
+
+    @property
+    def labels(self):
+        """
+        Returns the label of each row.
+        :return: A numpy array of strings.
+        """
+        return np.array(self._schema["labels"], dtype=np.str_)[self._label_ids]
+
+    def to_feature_matrix(self):
+        """
+        Returns the normalized feature matrix and the labels of its rows,
+        in the same format as FeatureData.to_feature_matrix().
+
+        :return: A tuple containing the normalized matrix and the labels.
+        """
+        return normalize(self._matrix), self.labels
+
+    def iter_batches(self, _batch_size, _seed=None):
+        """
+        Reads the normalized rows of the store in batches, so that the whole
+        matrix never has to be loaded in memory.
+
+        Rows are normalized individually, so a batch holds the same values as
+        the corresponding rows of to_feature_matrix().
+
+        :param _batch_size: The maximum number of rows of a batch.
+        :param _seed: If not 'None', the rows are read in a random order
+        generated from this seed rather than in the order of the store. The
+        rows of each batch are read in increasing order.
+        :return: A generator of (matrix, labels) tuples, in which 'matrix' is
+        a numpy array or a scipy.sparse.csr_matrix and 'labels' a numpy array
+        of strings.
+        """
+        assert _batch_size > 0
+
+        names = np.array(self._schema["labels"], dtype=np.str_)
+        order = None
+        if _seed is not None:
+            order = np.random.RandomState(_seed).permutation(len(self))
+        for start in range(0, len(self), _batch_size):
+            if order is None:
+                rows = slice(start, start + _batch_size)
+            else:
+                rows = np.sort(order[start:start + _batch_size])
+            yield normalize(self._matrix[rows]), names[self._label_ids[rows]]
+
+    def __load(self, _file):
+        """
+        Memory-maps the given array of the store.
+        """
+        return np.load(os.path.join(self.directory, _file), mmap_mode="r")
+
+
+class FeatureStoreWriter(object):
+    def __init__(self, _directory, _columns, _rows, _label_names, _nnz=None, _dtype=np.float32):
+        """
+        Creates a new feature store of a known number of rows and fills it one
+        row at a time.
+
+        The arrays of the store are preallocated on disk and memory-mapped, so
+        the memory used does not depend on the number of rows. They are written
+        into a temporary directory which replaces the given directory when the
+        writer is closed.
+
+        :param _directory: The directory of the store.
+        :param _columns: A list of (feature name, width) tuples describing the
+        columns of the matrix, in order.
+        :param _rows: The number of rows of the store.
+        :param _label_names: The distinct labels of the rows.
+        :param _nnz: For sparse stores, the total number of non-zero values of
+        all the rows. If 'None', the matrix is stored as a dense array.
+        :param _dtype: The numpy type of the values of the matrix.
+        """
+        assert _directory is not None
+        assert _rows >= 0
+        assert not os.path.exists(_directory) or FeatureStore.is_store(_directory), \
+            "Refusing to overwrite '{d:s}'.".format(d=_directory)
+
+        self.directory = _directory
+        self.sparse = _nnz is not None
+        self._columns = [(name, int(width)) for name, width in _columns]
+        self._width = sum(width for _, width in self._columns)
+        self._rows = _rows
+        self._label_names = list(_label_names)
+        self._label_ids = {label: i for i, label in enumerate(self._label_names)}
+        self._count = 0
+        self._nnz = 0
+
+        self._tmp_directory = _directory.rstrip(os.sep) + ".tmp"
+        if os.path.exists(self._tmp_directory):
+            shutil.rmtree(self._tmp_directory)
+        os.makedirs(self._tmp_directory)
+
+        if self.sparse:
+            self._data = self.__create(DATA_FILE, _dtype, (_nnz,))
+            self._indices = self.__create(INDICES_FILE, np.int32, (_nnz,))
+            self._indptr = self.__create(INDPTR_FILE, np.int64, (_rows + 1,))
+            self._indptr[0] = 0
+        else:
+            self._values = self.__create(VALUES_FILE, _dtype, (_rows, self._width))
+        self._hashes = self.__create(HASHES_FILE, HASH_DTYPE, (_rows,))
+        self._labels = self.__create(LABELS_FILE, np.int32, (_rows,))
+
+    def __len__(self):
+        """
+        Returns the number of rows written so far.
+        """
+        return self._count
+
+    def add_row(self, _hash, _label, _columns, _values):
+        """
+        Writes the next row of the store.
+
+        :param _hash: The hash of the code object of the row.
+        :param _label: The label of the row. Must be one of the label names
+        given when creating the writer.
+        :param _columns: The column of each value of the row, in increasing order.
+        :param _values: The values of the row.
+        """
+        assert self._count < self._rows
+        assert len(_hash) <= HASH_DTYPE.itemsize // 4
+        assert len(_columns) == len(_values)
+
+        row = self._count
+        self._hashes[row] = _hash
+        self._labels[row] = self._label_ids[_label]
+        if self.sparse:
+            end = self._nnz + len(_columns)
+            self._indices[self._nnz:end] = _columns
+            self._data[self._nnz:end] = _values
+            self._nnz = end
+            self._indptr[row + 1] = end
+        else:
+            self._values[row, _columns] = _values
+        self._count += 1
+
+    def close(self):
+        """
+        Completes the store and moves it to its directory, replacing any
+        feature store already there.
+
+        :return: The FeatureStore object opened from the directory.
+        """
+        assert self._count == self._rows
+        if self.sparse:
+            assert self._nnz == len(self._data)
+
+        arrays = [self._hashes, self._labels]
+        arrays += [self._data, self._indices, self._indptr] if self.sparse else [self._values]
+        for array in arrays:
+            array.flush()
+        del arrays
+        self.__release()
+
+        schema = {
+            "version": STORE_VERSION,
+            "rows": self._rows,
+            "columns": self._columns,
+            "labels": self._label_names,
+            "sparse": self.sparse,
+        }
+        # The schema file is written last: a directory without it is not
+        # considered a feature store.
+        with open(os.path.join(self._tmp_directory, SCHEMA_FILE), "w+") as f:
+            json.dump(schema, f)
+
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.rename(self._tmp_directory, self.directory)
+
+        return FeatureStore(self.directory)
+
+    def abort(self):
+        """
+        Discards the rows written so far.
+        """
+        self.__release()
+        shutil.rmtree(self._tmp_directory, ignore_errors=True)
+
+    def __create(self, _file, _dtype, _shape):
+        """
+        Creates a memory-mapped array of the store.
+        """
+        return open_memmap(os.path.join(self._tmp_directory, _file), mode="w+", dtype=_dtype, shape=_shape)
+
+    def __release(self):
+        """
+        Closes the memory-mapped arrays of the store.
+        """
+        self._hashes = self._labels = None
+        self._data = self._indices = self._indptr = self._values = None
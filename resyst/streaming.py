@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+    resyst.streaming
+    ~~~~~~~~~~~~~
+
+    Out-of-core feature extraction for data larger than the memory.
+
+    The FeatureAccumulator consumes data in blocks of bounded size and
+    merges the partial results of each block: the byte and word histograms
+    are added, and the state of the byte runs is carried across the block
+    boundaries. Every statistic derived from the accumulator is identical
+    to the one computed over the whole data in memory.
+
+    :copyright: 2017, Jonathan Racicot, see AUTHORS for more details
+    :license: MIT, see LICENSE for more details
+"""
+import hashlib
+
+import numpy as np
+
+from resyst.stats import *
+
+# Default size of the blocks read when streaming a file, in bytes.
+STREAM_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class FeatureAccumulator(object):
+    def __init__(self, _byteorder=None):
+        """
+        Creates an empty accumulator.
+
+        :param _byteorder: The byte order, 'little' or 'big', of the 16-bit
+        words counted by the accumulator. If 'None', the native byte order is
+        used.
+        """
+        self.byteorder = NATIVE_ENDIAN if _byteorder is None else _byteorder
+        assert self.byteorder in BYTE_ORDERS
+
+        self._count = 0
+        self._byte_histogram = np.zeros(256, dtype=np.int64)
+        self._word_histogram = np.zeros(65536, dtype=np.int64)
+        self._sha224 = hashlib.sha224()
+        # Trailing byte of the data which does not form a complete word yet.
+        self._tail = None
+        # Runs of identical bytes, as (byte, length) tuples: the first and last
+        # runs of the data and the first of its longest runs.
+        self._first_run = None
+        self._last_run = None
+        self._longest_run = None
+        self._single_run = False
+        self._run_count = 0
+
+    def __len__(self):
+        """
+        Returns the number of bytes consumed by the accumulator.
+        """
+        return self._count
+
+    @staticmethod
+    def from_file(_file, _blocksize=STREAM_BLOCK_SIZE, _byteorder=None):
+        """
+        Creates an accumulator from the contents of the given file.
+
+        The file is read in blocks of the given size into a single buffer,
+        so the memory used does not depend on the size of the file.
+
+        :param _file: The file to read.
+        :param _blocksize: The size, in bytes, of the blocks to read.
+        :param _byteorder: The byte order of the 16-bit words.
+        :return: A FeatureAccumulator describing the contents of the file.
+        """
+        assert _file is not None
+        assert _blocksize > 0
+
+        accumulator = FeatureAccumulator(_byteorder)
+        buffer = bytearray(_blocksize)
+        view = memoryview(buffer)
+        with open(_file, "rb") as f:
+            size = f.readinto(buffer)
+            while size > 0:
+                accumulator.update(view[:size])
+                size = f.readinto(buffer)
+        return accumulator
+
+    def update(self, _block):
+        """
+        Consumes the given block of data, which follows the data consumed so
+        far.
+
+        :param _block: A bytes-like object.
+        :return:
+        """
+        data = byte_array(_block)
+        if len(data) == 0:
+            return
+
+        if self._sha224 is not None:
+            self._sha224.update(data)
+        if self._tail is not None:
+            # Complete the word started at the end of the previous block.
+            word = bytes([self._tail, int(data[0])])
+            self._word_histogram[int.from_bytes(word, self.byteorder)] += 1
+            self._tail = None
+            words = data[1:]
+        else:
+            words = data
+        if len(words) % 2 == 1:
+            self._tail = int(words[-1])
+        self._word_histogram += word_histogram(words, self.byteorder)
+        self._byte_histogram += np.bincount(data, minlength=256)
+        self._count += len(data)
+
+        runs = RunLengths.from_data(data)
+        self.__merge_runs(runs.first, runs.last, runs.longest, len(runs))
+
+    def merge(self, _other):
+        """
+        Merges the results of another accumulator into this accumulator.
+
+        The other accumulator must describe the data immediately following the
+        data described by this accumulator, and this accumulator must have
+        consumed a whole number of words.
+
+        :param _other: A FeatureAccumulator.
+        :return:
+        """
+        assert _other is not None
+        assert _other.byteorder == self.byteorder
+        assert self._tail is None or len(_other) == 0
+
+        if len(_other) == 0:
+            return
+        self._byte_histogram += _other._byte_histogram
+        self._word_histogram += _other._word_histogram
+        self._count += _other._count
+        self._tail = _other._tail
+        # The digest of the merged data cannot be derived from the digests of
+        # its parts; it must be computed from the data itself.
+        self._sha224 = None
+        self.__merge_runs(
+            _other._first_run, _other._last_run, _other._longest_run, _other._run_count)
+
+    def __merge_runs(self, _first, _last, _longest, _count):
+        """
+        Merges the runs of the data following the data consumed so far.
+
+        :param _first: The first run of the following data.
+        :param _last: The last run of the following data.
+        :param _longest: The first longest run of the following data.
+        :param _count: The number of runs of the following data.
+        """
+        _single = _count == 1
+        if self._last_run is None:
+            self._first_run, self._last_run, self._longest_run = _first, _last, _longest
+            self._single_run = _single
+            self._run_count = _count
+            return
+
+        joined = None
+        self._run_count += _count
+        if self._last_run[0] == _first[0]:
+            # The last run consumed so far continues in the following data.
+            joined = (_first[0], self._last_run[1] + _first[1])
+            self._run_count -= 1
+            if joined[1] > self._longest_run[1]:
+                self._longest_run = joined
+            if self._single_run:
+                self._first_run = joined
+            if _single:
+                _last = joined
+        if _longest[1] > self._longest_run[1]:
+            self._longest_run = _longest
+        self._last_run = _last
+        self._single_run = self._single_run and _single and joined is not None
+
+    def byte_statistics(self):
+        """
+        Returns the statistics of the byte values consumed.
+        :return: A ByteStatistics object.
+        """
+        return ByteStatistics(self._byte_histogram.copy())
+
+    def word_histogram(self):
+        """
+        Returns the histogram of the 16-bit words consumed.
+        :return: A numpy array of 65536 integers.
+        """
+        return self._word_histogram.copy()
+
+    def longest_byte_streak(self):
+        """
+        Returns the first longest streak of identical bytes consumed.
+        :return: A tuple containing the value of the byte and the length of
+        its streak, or (0, 0) if no data was consumed.
+        """
+        if self._longest_run is None:
+            return 0, 0
+        return self._longest_run
+
+    def run_count(self):
+        """
+        Returns the number of runs of identical bytes consumed.
+        :return: The number of runs.
+        """
+        return self._run_count
+
+    def sha224(self):
+        """
+        Returns the hexadecimal SHA224 digest of the data consumed.
+        :return: The SHA224 digest, or 'None' if it is not known because
+        the accumulator was merged with another one.
+        """
+        if self._sha224 is None:
+            return None
+        return self._sha224.hexdigest()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from resyst.codeobject import CodeObject
+from resyst.dataset import CodeSet
+from resyst.features import FeatureSet
+
+
+@pytest.fixture
+def make_codeset():
+    """
+    Returns a function creating a code set of random code objects. The
+    labels given are assigned to the objects in turn.
+    """
+    def make(_count=20, _size=2048, _seed=0, _labels=("BIN",)):
+        rnd = random.Random(_seed)
+        codes = {}
+        for i in range(_count):
+            code = CodeObject(bytes(rnd.randrange(256) for _ in range(_size)))
+            code.add_label(_labels[i % len(_labels)])
+            codes[code.hash] = code
+        return CodeSet(codes)
+    return make
+
+
+@pytest.fixture
+def make_features(make_codeset):
+    """
+    Returns a function extracting the given features from random code
+    objects labelled 'EXE' and 'TXT'.
+    """
+    def make(_features, _count=12, _size=1024):
+        codeset = make_codeset(_count, _size, _labels=("EXE", "TXT", "TXT"))
+        return FeatureSet.extract_features_from_fileset(_features, codeset)
+    return make
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+import resyst.features
+from resyst.cache import FeatureCache
+from resyst.codeobject import CodeObject
+from resyst.codeobject import FileObject
+from resyst.dataset import CodeSet
+from resyst.features import Feature
+from resyst.features import FeatureSet
+
+
+FEATURES = [Feature.BFD, Feature.BYTE_VAL_MEAN, Feature.LONGEST_STREAK]
+
+
+def fill_cache(_file, _worker):
+    with FeatureCache(_file) as cache:
+        for i in range(50):
+            cache.put([("{w:d}-{i:d}".format(w=_worker, i=i), {("BFD", 1): {i: _worker}})])
+
+
+class TestFeatureCache(object):
+    def test_get_put(self, tmpdir):
+        with FeatureCache(str(tmpdir.join("cache.db"))) as cache:
+            cache.put([("abc", {("BFD", 1): {0: 3, 255: 1}, ("BYTE_VAL_MEAN", 1): 63.75})])
+            assert len(cache) == 2
+            assert cache.get("abc", [("BFD", 1), ("BYTE_VAL_MEAN", 1)]) == {
+                ("BFD", 1): {0: 3, 255: 1}, ("BYTE_VAL_MEAN", 1): 63.75}
+            assert cache.get("abc", [("BFD", 2)]) == {}
+            assert cache.get("def", [("BFD", 1)]) == {}
+
+            size = cache.size
+            cache.put([("abc", {("BYTE_VAL_MEAN", 1): 1.0})])
+            assert cache.size == size
+            assert cache.get("abc", [("BYTE_VAL_MEAN", 1)]) == {("BYTE_VAL_MEAN", 1): 1.0}
+
+            cache.clear()
+            assert len(cache) == 0
+            assert cache.size == 0
+
+    def test_persistent(self, tmpdir):
+        file = str(tmpdir.join("cache.db"))
+        with FeatureCache(file) as cache:
+            cache.put([("abc", {("BFD", 1): {1: 1}})])
+        with FeatureCache(file) as cache:
+            assert cache.get("abc", [("BFD", 1)]) == {("BFD", 1): {1: 1}}
+
+    def test_eviction(self, tmpdir):
+        with FeatureCache(str(tmpdir.join("cache.db")), _max_size=2000) as cache:
+            value = bytes(100)
+            for i in range(10):
+                cache.put([(str(i), {("BFD", 1): value})])
+            assert cache.get("0", [("BFD", 1)]) != {}
+            for i in range(10, 30):
+                cache.put([(str(i), {("BFD", 1): value})])
+
+            assert cache.size <= 2000
+            assert cache.get("29", [("BFD", 1)]) != {}
+            assert cache.get("1", [("BFD", 1)]) == {}
+
+    def test_concurrent_writers(self, tmpdir):
+        file = str(tmpdir.join("cache.db"))
+        FeatureCache(file).close()
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(fill_cache, [file] * 4, range(4)))
+
+        with FeatureCache(file) as cache:
+            assert len(cache) == 200
+            assert cache.get("3-49", [("BFD", 1)]) == {("BFD", 1): {49: 3}}
+
+    def test_get_many(self, tmpdir):
+        with FeatureCache(str(tmpdir.join("cache.db"))) as cache:
+            cache.put([("a", {("BFD", 1): 1}), ("b", {("BFD", 1): 2})])
+            assert cache.get_many([("a", [("BFD", 1)]), ("c", [("BFD", 1)]), ("b", [("BFD", 1), ("WFD", 1)])]) == [
+                {("BFD", 1): 1}, {}, {("BFD", 1): 2}]
+
+
+class TestCachedExtraction(object):
+    def test_cached_features_not_extracted(self, tmpdir, monkeypatch, make_codeset):
+        codeset = make_codeset(_count=10, _size=512)
+        with FeatureCache(str(tmpdir.join("cache.db"))) as cache:
+            expected = FeatureSet.extract_features_from_fileset(FEATURES, codeset, _cache=cache)
+            assert len(cache) == len(codeset) * len(FEATURES)
+
+            extracted = []
+            original = resyst.features._extract_features_from_batch
+
+            def extract(_features, _codes):
+                extracted.extend(_codes)
+                return original(_features, _codes)
+            monkeypatch.setattr(resyst.features, "_extract_features_from_batch", extract)
+
+            for code in make_codeset(_count=2, _size=512, _seed=1):
+                codeset.add_code_from_file(code, 0)
+            features = FeatureSet.extract_features_from_fileset(FEATURES, codeset, _batch_size=3, _cache=cache)
+
+            assert len(extracted) == 2
+            assert list(features.data.keys()) == list(codeset.objects.keys())
+            for code_hash, values in expected.data.items():
+                assert features.data[code_hash] == values
+
+    def test_version_change(self, tmpdir, monkeypatch, make_codeset):
+        codeset = make_codeset(_count=3, _size=512)
+        with FeatureCache(str(tmpdir.join("cache.db"))) as cache:
+            FeatureSet.extract_features_from_fileset(FEATURES, codeset, _cache=cache)
+            monkeypatch.setattr(resyst.features.REGISTRY.spec(Feature.BFD), "version", 2)
+            FeatureSet.extract_features_from_fileset(FEATURES, codeset, _cache=cache)
+            assert len(cache) == len(codeset) * (len(FEATURES) + 1)
+
+    def test_byte_order(self, tmpdir):
+        codeset = CodeSet({c.hash: c for c in [CodeObject(b"\x00\x01" * 50)]})
+        features = [Feature.B_0001, Feature.BYTE_VAL_MEAN]
+        with FeatureCache(str(tmpdir.join("cache.db"))) as cache:
+            results = {}
+            for byteorder in ["little", "big", "little"]:
+                for code in codeset:
+                    code.byteorder = byteorder
+                    code.invalidate_cache()
+                data = FeatureSet.extract_features_from_fileset(features, codeset, _cache=cache)
+                results[byteorder] = list(data.data.values())[0][Feature.B_0001]
+            assert results == {"little": 0.0, "big": 50.0}
+            # The byte mean does not depend on the byte order and is cached once.
+            assert len(cache) == 3
+
+    def test_mapped_files_released(self, tmpdir):
+        rnd = random.Random(2)
+        for i in range(5):
+            tmpdir.join("f{i:d}.bin".format(i=i)).write_binary(bytes(rnd.randrange(256) for _ in range(1000 + i)))
+
+        def load():
+            codeset = CodeSet()
+            for i in range(5):
+                codeset.add_code_from_file(FileObject(str(tmpdir.join("f{i:d}.bin".format(i=i))), _mmap=True), 0)
+            return codeset
+
+        with FeatureCache(str(tmpdir.join("cache.db"))) as cache:
+            FeatureSet.extract_features_from_fileset(FEATURES, load(), _cache=cache)
+            codeset = load()
+            assert all(fileobj._view is None for fileobj in codeset)
+            FeatureSet.extract_features_from_fileset(FEATURES, codeset, _cache=cache)
+            assert all(fileobj._view is None for fileobj in codeset)
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+import math
+import struct
+import pickle
+import random
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from resyst.codeobject import CodeObject
+from resyst.codeobject import FileObject
+from resyst.codeobject import ArchiveMember
+from resyst.streaming import FeatureAccumulator
+
+
+def random_data(_size, _seed=0):
+    rnd = random.Random(_seed)
+    return bytes(rnd.randrange(256) for _ in range(_size))
+
+
+class TestByteStatistics(object):
+    @parametrize('data', [
+        random_data(4096),
+        b"AABB12CCCC",
+        bytes(range(256)) * 3,
+    ])
+    def test_matches_reference(self, data):
+        code = CodeObject(data)
+        n = len(data)
+        mean = sum(data) / n
+        std = math.sqrt(sum((x - mean) ** 2 for x in data) / (n - 1))
+        mad = sum(abs(x - mean) for x in data) / n
+        kurt = sum((x - mean) ** 4 for x in data) / ((n - 1) * std ** 4)
+        skew = sum((x - mean) ** 3 for x in data) / ((n - 1) * std ** 3)
+        entropy = -sum((data.count(b) / n) * math.log(data.count(b) / n, 256)
+                       for b in set(data))
+
+        assert code.mean_byte_value() == mean
+        assert code.byte_std_dev() == pytest.approx(std)
+        assert code.byte_mean_dev() == pytest.approx(mad)
+        assert code.byte_std_kurtosis() == pytest.approx(kurt)
+        assert code.byte_std_skewness() == pytest.approx(skew)
+        assert code.shannon_entropy() == pytest.approx(entropy)
+
+    def test_constant_data(self):
+        code = CodeObject(b"\xff" * 512)
+        assert code.byte_std_dev() == 0.0
+        assert code.byte_std_kurtosis() == 0.0
+        assert code.byte_std_skewness() == 0.0
+        assert code.shannon_entropy() == 0.0
+
+    def test_bfd_and_ascii_ranges(self):
+        data = random_data(2048, _seed=1)
+        code = CodeObject(data)
+        bfd = code.bfd()
+        assert bfd == {b: data.count(b) for b in set(data)}
+        assert code.low_ascii_freq() == {b: c for b, c in bfd.items() if 32 <= b < 127}
+        assert code.high_ascii_freq() == {b: c for b, c in bfd.items() if 128 <= b < 255}
+
+
+class TestIntermediateCache(object):
+    def test_statistics_computed_once(self):
+        code = CodeObject(random_data(1024))
+        code.mean_byte_value()
+        stats = code.byte_statistics()
+        code.shannon_entropy()
+        code.low_ascii_freq()
+        assert code.byte_statistics() is stats
+        assert code.cached_intermediates == ["byte_statistics"]
+
+    def test_word_counts_share_wfd(self):
+        code = CodeObject(b"\x01\x00\x01\x00\x00\x10\xff\xfe\x00\x00", 'little')
+        code.word_count(0x0001)
+        code.word_count(0x1000)
+        code.wfd()
+        assert code.cached_intermediates == ["word_histogram:little"]
+
+    def test_invalidate(self):
+        code = CodeObject(random_data(1024), 'big')
+        code.byte_statistics()
+        code.wfd()
+        code.invalidate_cache("word_histogram:big")
+        assert code.cached_intermediates == ["byte_statistics"]
+        code.invalidate_cache()
+        assert code.cached_intermediates == []
+
+    def test_data_change_invalidates(self):
+        code = CodeObject(b"\x00" * 16)
+        assert code.mean_byte_value() == 0
+        code._data = b"\x02" * 16
+        assert code.mean_byte_value() == 2
+
+
+class TestWordHistogram(object):
+    def reference_wfd(self, _data, _fmt):
+        dist = {}
+        for i in range(0, len(_data) - 1, 2):
+            w = struct.unpack(_fmt, _data[i:i + 2])[0]
+            dist[w] = dist.get(w, 0) + 1
+        return dist
+
+    @parametrize('byteorder,fmt', [('little', '<H'), ('big', '>H')])
+    @parametrize('size', [4096, 4097])
+    def test_matches_reference(self, byteorder, fmt, size):
+        data = random_data(size, _seed=2)
+        code = CodeObject(data, byteorder)
+        assert code.wfd() == self.reference_wfd(data, fmt)
+
+    def test_word_counts(self):
+        code = CodeObject(b"\x01\x00\x01\x00\x00\x10\xfe\xff\xfe\xff\xfe")
+        assert code.word_counts([0x0001, 0x1000, 0xFFFE, 0xFEFF], 'little') == [2.0, 1.0, 2.0, 0.0]
+        assert code.word_count(0xFEFF, 'big') == 2.0
+        assert code.word_count(0x0100, 'big') == 2.0
+
+
+class TestSegments(object):
+    def test_segments_are_views(self):
+        data = random_data(1000, _seed=3)
+        parent = CodeObject(data)
+        parent.add_label("BIN")
+        segments = list(parent.split_by_size(256))
+
+        assert [len(s) for s in segments] == [256, 256, 256, 232]
+        assert [s.offset for s in segments] == [0, 256, 512, 768]
+        for i, segment in enumerate(segments):
+            assert segment._buffer.obj is data
+            assert segment.get_data == data[i * 256:(i + 1) * 256]
+            assert segment.hash == CodeObject(data[i * 256:(i + 1) * 256]).hash
+            assert segment.labels == ["BIN"]
+
+    def test_split_small_object(self):
+        data = random_data(100, _seed=6)
+        segments = list(CodeObject(data).split_by_size(256))
+        assert len(segments) == 1
+        assert segments[0] == CodeObject(data)
+
+    def test_detach(self):
+        data = random_data(1000, _seed=7)
+        parent = CodeObject(data)
+        parent.add_label("BIN")
+        segment = parent.segment(100, 50)
+        detached = segment.detach()
+        assert detached == segment
+        assert detached.hash == segment.hash
+        assert detached.labels == ["BIN"]
+        assert len(detached._buffer) == 50
+        assert detached._buffer.obj is not data
+
+    def test_segment_features(self):
+        data = random_data(1024, _seed=4)
+        segment = list(CodeObject(data).split_by_size(300))[1]
+        copy = CodeObject(data[300:600])
+        assert segment == copy
+        assert segment.bfd() == copy.bfd()
+        assert segment.wfd() == copy.wfd()
+        assert segment.byte_std_kurtosis() == copy.byte_std_kurtosis()
+
+    def test_pickle_segment(self):
+        data = random_data(1024, _seed=5)
+        segment = list(CodeObject(data).split_by_size(100))[3]
+        segment.byte_statistics()
+        restored = pickle.loads(pickle.dumps(segment))
+        assert restored == segment
+        assert len(restored._buffer) == 100
+        assert restored.cached_intermediates == []
+
+
+class TestFileObject(object):
+    def test_mmap_is_lazy(self, tmpdir):
+        data = random_data(4096, _seed=6)
+        path = tmpdir.join("sample.bin")
+        path.write_binary(data)
+
+        fileobj = FileObject(str(path), _mmap=True)
+        assert fileobj._view is None
+        assert len(fileobj) == len(data)
+        assert fileobj.hash == FileObject(str(path)).hash
+        assert fileobj.bfd() == CodeObject(data).bfd()
+
+        fileobj.release()
+        assert fileobj._view is None
+        assert fileobj.cached_intermediates == []
+        assert fileobj.mean_byte_value() == CodeObject(data).mean_byte_value()
+
+    def test_mmap_empty_file(self, tmpdir):
+        path = tmpdir.join("empty.bin")
+        path.write_binary(b"")
+        fileobj = FileObject(str(path), _mmap=True)
+        assert len(fileobj) == 0
+        assert fileobj.get_data == b""
+
+    def test_mmap_segments(self, tmpdir):
+        data = random_data(10000, _seed=8)
+        path = tmpdir.join("sample.bin")
+        path.write_binary(data)
+        fileobj = FileObject(str(path), _mmap=True)
+        fileobj.add_label("BIN")
+        segments = list(fileobj.split_by_size(3000))
+        fileobj.release()
+
+        assert [s.offset for s in segments] == [0, 3000, 6000, 9000]
+        assert all(s._view is None for s in segments)
+        for i, segment in enumerate(segments):
+            assert segment.get_data == data[i * 3000:(i + 1) * 3000]
+            assert segment.labels == ["BIN"]
+        inner = segments[2].segment(100, 50)
+        assert inner.offset == 6100
+        detached = inner.detach()
+        assert inner._view is None
+        assert detached == CodeObject(data[6100:6150])
+        assert inner.hash == detached.hash
+
+    def test_archive_member(self):
+        data = random_data(1000, _seed=9)
+        member = ArchiveMember("pkg.tar", "docs/a.pdf", data)
+        assert member.extension == "PDF"
+        assert not member.mmap_mode and member.loaded
+        assert type(member.segment(10, 20)) is CodeObject
+
+        member.release()
+        assert member.get_data == data
+        restored = pickle.loads(pickle.dumps(member))
+        assert restored == member
+        assert restored.filename == member.filename
+
+    def test_mmap_pickles_path_only(self, tmpdir):
+        path = tmpdir.join("sample.txt")
+        path.write_binary(random_data(2048, _seed=7))
+        fileobj = FileObject(str(path), _mmap=True)
+        fileobj.hash
+        state = fileobj.__getstate__()
+        assert state["_view"] is None
+        restored = pickle.loads(pickle.dumps(fileobj))
+        assert restored == fileobj
+        assert restored.extension == "TXT"
+
+
+class TestFeatureAccumulator(object):
+    def sample(self):
+        rnd = random.Random(8)
+        data = bytearray()
+        while len(data) < 20000:
+            data += bytes([rnd.choice(b"\x00\xffAB")]) * rnd.randint(1, 300)
+        return bytes(data)
+
+    @parametrize('blocksize', [7, 256, 4095, 100000])
+    def test_identical_to_memory(self, blocksize):
+        data = self.sample()
+        accumulator = FeatureAccumulator('little')
+        for i in range(0, len(data), blocksize):
+            accumulator.update(data[i:i + blocksize])
+        code = CodeObject(data, 'little')
+        stats = accumulator.byte_statistics()
+
+        assert len(accumulator) == len(data)
+        assert (stats.histogram == code.byte_statistics().histogram).all()
+        assert stats.mean == code.mean_byte_value()
+        assert stats.std_dev == code.byte_std_dev()
+        assert stats.kurtosis == code.byte_std_kurtosis()
+        assert stats.entropy == code.shannon_entropy()
+        assert (accumulator.word_histogram() == code.word_histogram()).all()
+        assert accumulator.longest_byte_streak() == code.longest_byte_streak()
+        assert accumulator.sha224() == code.sha224()
+
+    def test_merge(self):
+        data = self.sample()[:20000]
+        parts = [FeatureAccumulator() for _ in range(4)]
+        for i, part in enumerate(parts):
+            part.update(data[i * 5000:(i + 1) * 5000])
+        for part in parts[1:]:
+            parts[0].merge(part)
+        code = CodeObject(data)
+        assert (parts[0].word_histogram() == code.word_histogram()).all()
+        assert parts[0].longest_byte_streak() == code.longest_byte_streak()
+
+    def test_streak_across_blocks(self):
+        accumulator = FeatureAccumulator()
+        for block in [b"AAB", b"BB", b"B", b"BCCCC", b"CC"]:
+            accumulator.update(block)
+        assert accumulator.longest_byte_streak() == (ord("C"), 6)
+        assert CodeObject(b"AABBBBBCCCCCC").longest_byte_streak() == (ord("C"), 6)
+
+        accumulator = FeatureAccumulator()
+        for block in [b"AAB", b"BB", b"B", b"BBCCC", b"CCC"]:
+            accumulator.update(block)
+        assert accumulator.longest_byte_streak() == (ord("B"), 6)
+
+    def test_stream_file_object(self, tmpdir):
+        data = self.sample()
+        path = tmpdir.join("dump.bin")
+        path.write_binary(data)
+        fileobj = FileObject(str(path), _stream=True)
+        code = CodeObject(data)
+        assert fileobj.hash == code.hash
+        assert fileobj.byte_std_skewness() == code.byte_std_skewness()
+        assert fileobj.wfd() == code.wfd()
+        assert fileobj._view is None
+
+
+class TestRunLengths(object):
+    def test_runs(self):
+        code = CodeObject(b"AABB12CCCC")
+        runs = code.byte_runs()
+        assert list(runs.values) == list(b"AB12C")
+        assert list(runs.lengths) == [2, 2, 1, 1, 4]
+        assert code.longest_byte_streak() == (ord("C"), 4)
+        assert code.run_count() == 5
+        assert list(code.run_length_histogram()) == [0, 2, 2, 0, 1]
+        assert code.byte_avg_continuity() == 2.0
+
+    def test_padding(self):
+        code = CodeObject(b"\x7f" + b"\xff" * 100000 + b"\x00" * 100000)
+        assert code.longest_byte_streak() == (0xFF, 100000)
+        assert code.run_count() == 3
+
+    def test_empty(self):
+        code = CodeObject(b"")
+        assert code.longest_byte_streak() == (0, 0)
+        assert code.byte_avg_continuity() == 0.0
+
+    def test_streamed_run_count(self):
+        data = b"AAB" + b"BB" + b"BCCCC" + b"CD"
+        accumulator = FeatureAccumulator()
+        for block in [b"AAB", b"BB", b"BCCCC", b"CD"]:
+            accumulator.update(block)
+        assert accumulator.run_count() == CodeObject(data).run_count() == 4
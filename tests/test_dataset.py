@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import pickle
+import random
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from resyst.codeobject import CodeObject
+from resyst.codeobject import FileObject
+from resyst.codeobject import PREFIX_SIZE
+from resyst.dataset import CodeSet
+from resyst.dataset import FileSet
+from resyst.dataset import ContentIndex
+from resyst.dataset import SegmentReservoir
+from resyst.manifest import CorpusManifest
+from resyst.dataset import scan_directory
+
+
+def make_tree(_root):
+    files = {
+        "b.txt": b"bravo",
+        "a.bin": b"\x00\x01",
+        "sub/z.txt": b"zulu",
+        "sub/deeper/c.txt": b"charlie",
+        "sub/dup.txt": b"bravo",
+        "other/y.bin": b"\xff" * 100,
+    }
+    for name, data in files.items():
+        _root.join(name).write_binary(data, ensure=True)
+    return files
+
+
+def open_mappings(_root):
+    """
+    Counts the files under the given directory currently memory-mapped by
+    the process.
+    """
+    if not os.path.exists("/proc/self/maps"):
+        pytest.skip("Mappings cannot be listed on this platform.")
+    with open("/proc/self/maps") as f:
+        return len({line.split()[-1] for line in f if str(_root) in line})
+
+
+def make_same_size_files(_root, _pairs, _size=256):
+    for i in range(_pairs):
+        size = _size + i
+        _root.join("a{i:d}.bin".format(i=i)).write_binary(bytes([i % 256]) * size)
+        _root.join("b{i:d}.bin".format(i=i)).write_binary(bytes([(i + 1) % 256]) * size)
+        _root.join("c{i:d}.bin".format(i=i)).write_binary(bytes([i % 256]) * size)
+
+
+class TestScanDirectory(object):
+    def test_order(self, tmpdir):
+        make_tree(tmpdir)
+        root = str(tmpdir)
+        expected = []
+        for directory, dirs, files in os.walk(root):
+            dirs.sort()
+            expected += [os.path.join(directory, f) for f in sorted(files)]
+        assert list(scan_directory(root)) == expected
+        assert [os.path.relpath(f, root) for f in expected] == [
+            "a.bin", "b.txt", os.path.join("other", "y.bin"), os.path.join("sub", "dup.txt"),
+            os.path.join("sub", "z.txt"), os.path.join("sub", "deeper", "c.txt")]
+
+    @parametrize('pattern', [r".*\.txt$", re.compile(r".*\.txt$")])
+    def test_filter(self, tmpdir, pattern):
+        make_tree(tmpdir)
+        names = [os.path.basename(f) for f in scan_directory(str(tmpdir), pattern)]
+        assert names == ["b.txt", "dup.txt", "z.txt", "c.txt"]
+
+    def test_directory_links_not_followed(self, tmpdir):
+        make_tree(tmpdir)
+        os.symlink(str(tmpdir.join("sub")), str(tmpdir.join("link")))
+        assert len(list(scan_directory(str(tmpdir)))) == 6
+
+
+class TestFileSet(object):
+    @parametrize('workers', [1, 8])
+    def test_load_from_directory(self, tmpdir, workers):
+        files = make_tree(tmpdir)
+        fileset = FileSet()
+        fileset.load_from_directory(str(tmpdir), _workers=workers)
+
+        assert len(fileset) == len(files) - 1
+        filenames = [os.path.relpath(f.filename, str(tmpdir)) for f in fileset.data.values()]
+        assert filenames == ["a.bin", "b.txt", os.path.join("other", "y.bin"),
+                             os.path.join("sub", "z.txt"), os.path.join("sub", "deeper", "c.txt")]
+        for file_hash, fileobj in fileset.data.items():
+            assert fileobj.hash == file_hash
+
+    def test_load_memory_mapped(self, tmpdir):
+        make_tree(tmpdir)
+        fileset = FileSet()
+        fileset.load_from_directory(str(tmpdir), _filter=r".*\.bin$", _mmap=True)
+        assert sorted(len(f) for f in fileset.data.values()) == [2, 100]
+
+
+    @parametrize('mode', ["mmap", "stream"])
+    def test_no_mappings_left(self, tmpdir, mode):
+        make_same_size_files(tmpdir, 50)
+        fileset = FileSet()
+        fileset.load_from_directory(str(tmpdir), _mmap=(mode == "mmap"), _stream=(mode == "stream"))
+        assert len(fileset) == 100
+        assert all(f._view is None for f in fileset)
+        assert open_mappings(tmpdir) == 0
+
+
+class TestContentIndex(object):
+    def test_unique_sizes_not_hashed(self):
+        index = ContentIndex()
+        codes = [CodeObject(b"x" * size) for size in [10, 5000, 20]]
+        assert all(index.add(code) for code in codes)
+        assert all(code._digest is None for code in codes)
+
+    def test_different_prefixes_not_hashed(self):
+        index = ContentIndex()
+        a = CodeObject(b"a" * (PREFIX_SIZE * 2))
+        b = CodeObject(b"b" * (PREFIX_SIZE * 2))
+        assert index.add(a) and index.add(b)
+        assert a._digest is None and b._digest is None
+
+    def test_same_prefix(self):
+        index = ContentIndex()
+        prefix = b"p" * PREFIX_SIZE
+        a = CodeObject(prefix + b"a" * 100)
+        b = CodeObject(prefix + b"b" * 100)
+        assert index.add(a) and index.add(b)
+        assert len(a.digest) == 28 and a.digest != b.digest
+        assert not index.add(CodeObject(prefix + b"b" * 100))
+        assert not index.add(CodeObject(prefix + b"a" * 100))
+
+    def test_known_digests_not_read(self, tmpdir, monkeypatch):
+        make_same_size_files(tmpdir, 3)
+        files = [FileObject(str(path), _mmap=True) for path in sorted(tmpdir.listdir())]
+        known = [FileObject(f.filename, _mmap=True, _digest=FileObject(f.filename).digest) for f in files]
+
+        def fail(_self, _size=PREFIX_SIZE):
+            raise AssertionError("Prefix digest computed.")
+        monkeypatch.setattr(CodeObject, "prefix_digest", fail)
+        index = ContentIndex()
+        assert [index.add(f) for f in known] == [True] * 6 + [False] * 3
+        assert all(f._view is None for f in known)
+
+    def test_small_duplicates(self):
+        index = ContentIndex()
+        assert index.add(CodeObject(b"abc"))
+        assert index.add(CodeObject(b"abd"))
+        assert not index.add(CodeObject(b"abc"))
+        assert not index.add(CodeObject(b"abd"))
+
+
+class TestCodeSet(object):
+    def test_duplicate_segments(self):
+        code = CodeObject(b"0123" * 64 + b"abcd" * 64 + b"0123" * 64 + b"xy")
+        codeset = CodeSet()
+        codeset.add_code_from_file(code, 256)
+        assert [bytes(c.get_data) for c in codeset] == [b"0123" * 64, b"abcd" * 64, b"xy"]
+        assert list(codeset.objects.keys()) == [c.hash for c in codeset]
+        assert len(codeset) == 3
+
+    def test_segments_not_mapped(self, tmpdir):
+        rnd = random.Random(0)
+        contents = {}
+        for i in range(30):
+            path = tmpdir.join("f{i:d}.bin".format(i=i))
+            contents[str(path)] = bytes(rnd.randrange(256) for _ in range(5000))
+            path.write_binary(contents[str(path)])
+        fileset = FileSet()
+        fileset.load_from_directory(str(tmpdir), _mmap=True)
+        codeset = CodeSet()
+        for fileobj in fileset:
+            codeset.add_code_from_file(fileobj, 1000)
+            fileobj.release()
+
+        assert len(codeset) == 150
+        assert open_mappings(tmpdir) == 0
+        for code in codeset:
+            data = contents[code.filename]
+            assert code.get_data == data[code.offset:code.offset + 1000]
+            code.release()
+        assert open_mappings(tmpdir) == 0
+
+
+def make_labelled_files(_root, _counts, _size=100):
+    files = []
+    for label, count in sorted(_counts.items()):
+        for i in range(count):
+            path = _root.join("{l:s}{i:d}.{l:s}".format(l=label.lower(), i=i))
+            path.write_binary(bytes([i % 256, len(files) % 256]) * (_size // 2))
+            fileobj = FileObject(str(path), _mmap=True)
+            fileobj.add_label(label)
+            files.append(fileobj)
+    return files
+
+
+class TestSegmentReservoir(object):
+    def test_quota_per_label(self, tmpdir):
+        files = make_labelled_files(tmpdir, {"PDF": 30, "TXT": 2})
+        reservoir = SegmentReservoir(8, _seed=1)
+        for fileobj in files:
+            reservoir.add_file(fileobj, 10)
+
+        assert reservoir.seen == {"PDF": 300, "TXT": 20}
+        codeset = reservoir.to_codeset()
+        # The segments of each file are identical, so only one per file is kept.
+        assert codeset.label_counts() == {"PDF": 8, "TXT": 2}
+        assert len(reservoir) == 10
+        for code in codeset:
+            assert len(code) == 10
+            assert len(code._buffer) == 10
+
+    def test_explicit_quotas(self):
+        reservoir = SegmentReservoir(2, _quotas={"A": 5, "B": 0}, _seed=2)
+        for i in range(50):
+            for label in ["A", "B", "C"]:
+                code = CodeObject(label.encode() + bytes([i]))
+                code.add_label(label)
+                reservoir.add_code(code)
+        assert len(reservoir) == 7
+        assert sorted(code.labels[0] for code in reservoir.to_codeset()) == ["A"] * 5 + ["C"] * 2
+
+    def test_duplicates_dismissed(self, tmpdir):
+        files = []
+        for i in range(10):
+            path = tmpdir.join("f{i:d}.bin".format(i=i))
+            path.write_binary(bytes(50) + bytes([i + 1]) * 10)
+            fileobj = FileObject(str(path), _mmap=True)
+            fileobj.add_label("BIN")
+            files.append(fileobj)
+        reservoir = SegmentReservoir(4, _seed=5)
+        for fileobj in files:
+            reservoir.add_file(fileobj, 10)
+
+        assert reservoir.seen == {"BIN": 60}
+        assert len(reservoir) == 4
+        codeset = reservoir.to_codeset()
+        assert codeset.label_counts() == {"BIN": 4}
+        assert len({code.hash for code in codeset}) == 4
+
+    def test_uniform_sample(self):
+        kept = [0] * 10
+        for seed in range(2000):
+            reservoir = SegmentReservoir(3, _seed=seed)
+            for i in range(10):
+                reservoir.add_code(CodeObject(bytes([i])))
+            for code in reservoir.to_codeset():
+                kept[code.get_data[0]] += 1
+        # Each of the 10 segments is kept with a probability of 3/10.
+        for count in kept:
+            assert abs(count - 600) < 100
+
+    def test_unselected_files_not_mapped(self, tmpdir):
+        files = make_labelled_files(tmpdir, {"BIN": 20})
+        reservoir = SegmentReservoir(1, _seed=3)
+        for fileobj in files:
+            reservoir.add_file(fileobj, 0)
+            assert fileobj._view is None
+        assert len(reservoir.to_codeset()) == 1
+
+    def test_small_files(self, tmpdir):
+        files = make_labelled_files(tmpdir, {"TXT": 3}, _size=4)
+        reservoir = SegmentReservoir(10, _seed=4)
+        for fileobj in files:
+            assert reservoir.add_file(fileobj, 4096) == 1
+        assert [len(code) for code in reservoir.to_codeset()] == [4, 4, 4]
+
+
+class TestCorpusManifest(object):
+    def test_unchanged_files_not_read(self, tmpdir, monkeypatch):
+        root = tmpdir.join("root")
+        make_tree(root)
+        manifest_file = str(tmpdir.join("manifest.jsonl"))
+
+        fileset = FileSet()
+        manifest = CorpusManifest(manifest_file)
+        fileset.load_from_directory(str(root), _manifest=manifest)
+        for fileobj in fileset:
+            fileobj.set_extension_as_label()
+        manifest.save()
+        expected = [(f.filename, f.hash, list(f.labels)) for f in fileset]
+
+        changed = root.join("sub", "z.txt")
+        changed.write_binary(b"zulu!")
+        root.join("new.txt").write_binary(b"new")
+
+        opened = []
+        original = FileObject.__init__
+
+        def init(_self, _file, _mmap=False, _stream=False, _digest=None):
+            if _digest is None:
+                opened.append(os.path.relpath(_file, str(root)))
+            original(_self, _file, _mmap, _stream, _digest)
+        monkeypatch.setattr(FileObject, "__init__", init)
+
+        fileset = FileSet()
+        manifest = CorpusManifest(manifest_file)
+        fileset.load_from_directory(str(root), _manifest=manifest)
+        assert sorted(opened) == ["new.txt", os.path.join("sub", "z.txt")]
+
+        loaded = {f.filename: f for f in fileset}
+        for filename, file_hash, labels in expected:
+            if filename != str(changed):
+                assert loaded[filename].hash == file_hash
+                assert loaded[filename].labels == labels
+                assert loaded[filename]._view is None
+        assert loaded[str(changed)].hash == CodeObject(b"zulu!").hash
+        assert bytes(loaded[str(root.join("b.txt"))].get_data) == b"bravo"
+        assert len(manifest) == 7
+
+
+def make_archives(_root):
+    import io
+    import bz2
+    import lzma
+    import tarfile
+    import zipfile
+
+    members = [("docs/a.pdf", b"%PDF-1.4" + b"\x00" * 50), ("notes.txt", b"hello"), ("img/b.png", b"\x89PNG")]
+    with zipfile.ZipFile(str(_root.join("pkg.zip")), "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    with tarfile.open(str(_root.join("pkg.tar.xz")), "w:xz") as archive:
+        for name, data in members + [("extra.doc", b"doc")]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    _root.join("single.html.bz2").write_binary(bz2.compress(b"<html></html>"))
+    _root.join("single.c.xz").write_binary(lzma.compress(b"int main;"))
+    _root.join("plain.txt").write_binary(b"plain")
+    _root.join("broken.zip").write_binary(b"not a zip")
+
+
+class TestArchives(object):
+    def test_load_members(self, tmpdir):
+        make_archives(tmpdir)
+        fileset = FileSet()
+        fileset.load_from_directory(str(tmpdir), _archives=True)
+
+        members = [(os.path.relpath(f.filename, str(tmpdir)), f.labels) for f in fileset]
+        # The members of the zip archive duplicate those of the tar archive.
+        assert members == [
+            (os.path.join("pkg.tar.xz", "docs/a.pdf"), ["PDF"]),
+            (os.path.join("pkg.tar.xz", "notes.txt"), ["TXT"]),
+            (os.path.join("pkg.tar.xz", "img/b.png"), ["PNG"]),
+            (os.path.join("pkg.tar.xz", "extra.doc"), ["DOC"]),
+            ("plain.txt", []),
+            (os.path.join("single.c.xz", "single.c"), ["C"]),
+            (os.path.join("single.html.bz2", "single.html"), ["HTML"]),
+        ]
+        assert len(os.listdir(str(tmpdir))) == 6
+        pdf = [f for f in fileset if f.extension == "PDF"][0]
+        assert bytes(pdf.get_data) == b"%PDF-1.4" + b"\x00" * 50
+
+    def test_filter_members(self, tmpdir):
+        make_archives(tmpdir)
+        fileset = FileSet()
+        fileset.load_from_directory(str(tmpdir), _filter=r".*\.txt$", _archives=True)
+        assert sorted(os.path.basename(f.filename) for f in fileset) == ["notes.txt", "plain.txt"]
+
+    def test_archives_not_expanded_by_default(self, tmpdir):
+        make_archives(tmpdir)
+        fileset = FileSet()
+        fileset.load_from_directory(str(tmpdir))
+        assert len(fileset) == 6
+
+
+def make_labelled_codeset(_counts):
+    codeset = CodeSet()
+    for label, count in sorted(_counts.items()):
+        for i in range(count):
+            code = CodeObject(label.encode() + i.to_bytes(4, "little"))
+            if label != "":
+                code.add_label(label)
+            codeset._add(code)
+    return codeset
+
+
+class TestLabelIndex(object):
+    def test_label_counts(self):
+        codeset = make_labelled_codeset({"PDF": 10, "TXT": 3, "": 2})
+        assert codeset.label_counts() == {"PDF": 10, "TXT": 3, "": 2}
+        assert codeset.label_names == ["", "PDF", "TXT"]
+        assert len(codeset.objects_with_label("TXT")) == 3
+        assert codeset.objects_with_label("UNKNOWN") == []
+
+    def test_index_follows_labels(self):
+        codeset = make_labelled_codeset({"PDF": 2})
+        assert codeset.label_counts() == {"PDF": 2}
+        code = CodeObject(b"new")
+        codeset._add(code)
+        assert codeset.label_counts() == {"PDF": 2, "": 1}
+        code.add_label("BIN")
+        assert codeset.label_counts() == {"PDF": 2, "BIN": 1}
+
+    def test_labelled_later_keeps_order(self):
+        codeset = CodeSet()
+        codes = [CodeObject(bytes([i]) * 10) for i in range(6)]
+        for i, code in enumerate(codes):
+            if i != 2:
+                code.add_label("PDF")
+            codeset._add(code)
+            codeset.label_counts()
+        assert codeset.label_counts() == {"PDF": 5, "": 1}
+        codes[2].add_label("PDF")
+        codes[2].add_label("TXT")
+        assert codeset.label_counts() == {"PDF": 6}
+        assert codeset.objects_with_label("PDF") == codes
+        for segment in codes[0].split_by_size(4):
+            codeset._add(segment)
+        assert codeset.label_counts() == {"PDF": 8}
+
+    def test_split_stratified(self):
+        codeset = make_labelled_codeset({"PDF": 100, "TXT": 20})
+        training, testing = codeset.split_stratified(0.75, _seed=1)
+        assert isinstance(training, CodeSet)
+        assert training.label_counts() == {"PDF": 75, "TXT": 15}
+        assert testing.label_counts() == {"PDF": 25, "TXT": 5}
+        hashes = set(training.objects) | set(testing.objects)
+        assert hashes == set(codeset.objects)
+
+    def test_sample_balanced(self):
+        codeset = make_labelled_codeset({"PDF": 100, "TXT": 20, "C": 5})
+        sample = codeset.sample_balanced(10, _seed=2)
+        assert sample.label_counts() == {"PDF": 10, "TXT": 10, "C": 5}
+        assert set(sample.objects) <= set(codeset.objects)
+
+    def test_pickled_labels(self):
+        code = CodeObject(b"data")
+        code.add_labels(["PDF", "BIN"])
+        restored = pickle.loads(pickle.dumps(code))
+        assert restored.labels == ["PDF", "BIN"]
+        assert restored.label_ids == code.label_ids
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from resyst.codeobject import CodeObject
+from resyst.features import Feature
+from resyst.features import FeatureSet
+from resyst.features import REGISTRY
+from resyst.registry import FeatureRegistry
+from resyst.matrix import FeatureMatrixBuilder
+
+
+FEATURES = [Feature.BFD, Feature.BYTE_VAL_MEAN, Feature.SHANNON_ENTROPY,
+            Feature.LONGEST_STREAK, Feature.B_0001, Feature.B_FFFE]
+
+
+class TestFeatureExtraction(object):
+    @parametrize('workers,batch_size', [(1, 64), (2, 3)])
+    def test_process_pool(self, workers, batch_size, make_codeset):
+        codeset = make_codeset()
+        features = FeatureSet.extract_features_from_fileset(
+            FEATURES, codeset, workers, batch_size)
+
+        assert list(features.data.keys()) == list(codeset.objects.keys())
+        for code_hash, code in codeset.objects.items():
+            extracted = features.data[code_hash]
+            assert extracted[Feature.LABEL] == ["BIN"]
+            for feature in FEATURES:
+                assert extracted[feature] == FeatureSet.extract_feature(feature, code)
+
+    @parametrize('workers', [None, 2])
+    def test_bounded_collection(self, workers, make_codeset):
+        codeset = make_codeset(_count=30, _size=512)
+        results = FeatureSet.iter_features_from_fileset(
+            FEATURES, codeset, workers, _batch_size=2, _max_pending=3)
+        hashes = [code_hash for code_hash, features in results]
+        assert hashes == list(codeset.objects.keys())
+
+    def test_worker_error_is_raised(self, make_codeset):
+        codeset = make_codeset(_count=4, _size=512)
+        with pytest.raises(AssertionError):
+            list(FeatureSet.iter_features_from_fileset([None], codeset))
+
+
+class TestFeatureRegistry(object):
+    def test_all_features_registered(self):
+        for feature in Feature:
+            if feature != Feature.LABEL:
+                assert feature in REGISTRY
+
+    def test_schedule(self):
+        assert REGISTRY.schedule([Feature.B_0001, Feature.B_FFFE]) == ["word_histogram"]
+        assert REGISTRY.schedule([Feature.LONGEST_STREAK, Feature.AVG_BYTE_CONTINUITY, Feature.BFD]) == \
+            ["byte_runs", "longest_streak", "run_count", "byte_statistics"]
+
+    def test_intermediates_computed_once(self):
+        code = CodeObject(b"\x01\x00" * 300 + b"\xff" * 40)
+        features = REGISTRY.extract([Feature.BYTE_VAL_MEAN, Feature.STD_SKEWNESS, Feature.B_0001], code)
+        assert sorted(code.cached_intermediates) == ["byte_statistics", "word_histogram:None"]
+        assert features[Feature.STD_SKEWNESS] == code.byte_std_skewness()
+        assert features[Feature.B_0001] == 300.0
+
+    def test_custom_feature(self):
+        registry = FeatureRegistry()
+
+        @registry.intermediate("byte_statistics")
+        def statistics(_code):
+            return _code.byte_statistics()
+
+        @registry.feature("MAX", _requires=["byte_statistics"])
+        def maximum(_code):
+            return float(_code.byte_statistics().histogram.nonzero()[0].max())
+
+        assert registry.extract(["MAX"], CodeObject(b"\x01\x07\x03")) == {"MAX": 7.0}
+
+
+class TestFeatureMatrix(object):
+    def test_dense(self, make_codeset):
+        codeset = make_codeset(_count=5, _size=1024)
+        data = FeatureSet.extract_features_from_fileset(FEATURES, codeset)
+        schema = data.feature_schema()
+        assert schema.features == sorted(FEATURES, key=lambda f: f.value)
+        assert len(schema) == 256 + 1 + 1 + 2 + 1 + 1
+
+        builder = FeatureMatrixBuilder(schema, len(data))
+        for features in data.data.values():
+            builder.add_row(features)
+        matrix = builder.build()
+        assert matrix.shape == (5, len(schema))
+        assert matrix.dtype == np.float32
+
+        code = list(codeset.objects.values())[2]
+        assert list(matrix[2, schema.columns(Feature.BFD)]) == [code.bfd().get(b, 0) for b in range(256)]
+        assert list(matrix[2, schema.columns(Feature.LONGEST_STREAK)]) == list(code.longest_byte_streak())
+        assert matrix[2, schema.columns(Feature.B_0001)][0] == code.word_count(0x0001)
+
+    def test_sparse_matches_dense(self, make_codeset):
+        codeset = make_codeset(_count=5, _size=1024)
+        data = FeatureSet.extract_features_from_fileset(
+            [Feature.WFD, Feature.HIGH_ASCII_FREQ, Feature.SHANNON_ENTROPY], codeset)
+        sparse, hashes = data.to_feature_matrix2()
+        dense, _ = data.to_feature_matrix2(_sparse=False)
+        assert sparse.format == "csr"
+        assert sparse.shape == (5, 65536 + 128 + 1)
+        assert hashes == list(codeset.objects.keys())
+        assert np.allclose(sparse.toarray(), dense)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from resyst.features import Feature
+from resyst.features import FeatureSet
+from resyst.journal import FeatureJournal
+
+
+def fill_journal(_journal, _data, _count=None):
+    for code_hash, features in list(_data.data.items())[:_count]:
+        if code_hash not in _journal:
+            _journal.append(code_hash, features[Feature.LABEL][0], features)
+
+
+class TestFeatureJournal(object):
+    @parametrize('features', [
+        [Feature.BFD, Feature.SHANNON_ENTROPY, Feature.LONGEST_STREAK],
+        [Feature.WFD, Feature.BYTE_VAL_MEAN],
+    ])
+    def test_to_store(self, tmpdir, features, make_features):
+        data = make_features(features)
+        schema = FeatureSet.feature_schema(features)
+        with FeatureJournal(str(tmpdir.join("journal")), schema) as journal:
+            fill_journal(journal, data)
+        store = journal.to_store(str(tmpdir.join("features")))
+        expected = data.save_features_to_store(str(tmpdir.join("expected")))
+
+        assert store.sparse == expected.sparse
+        assert store.columns == expected.columns
+        assert list(store.hashes) == list(expected.hashes)
+        assert list(store.labels) == list(expected.labels)
+        if store.sparse:
+            assert (store.matrix != expected.matrix).nnz == 0
+        else:
+            assert np.array_equal(store.matrix, expected.matrix)
+
+    def test_resume(self, tmpdir, make_features):
+        data = make_features([Feature.BFD])
+        schema = FeatureSet.feature_schema([Feature.BFD])
+        file = str(tmpdir.join("journal"))
+
+        journal = FeatureJournal(file, schema, _sync_interval=3)
+        fill_journal(journal, data, 7)
+        # Simulates a crash: rows appended after the last synchronization and
+        # a partially written row are lost.
+        journal._stream.write(b'{"hash": "trunc')
+        journal._stream.flush()
+        journal._stream = None
+        journal._digest_stream = None
+
+        journal = FeatureJournal(file, schema)
+        assert len(journal) == 6
+        hashes = list(data.data.keys())
+        assert hashes[5] in journal and hashes[6] not in journal
+        fill_journal(journal, data)
+        journal.close()
+
+        assert [row[0] for row in journal.rows()] == hashes
+        store = journal.to_store(str(tmpdir.join("features")))
+        assert len(store) == len(data)
+        journal.remove()
+        assert not any(os.path.exists(f) for f in [file, journal.digests_file, journal.marker])
+
+    def test_different_features_start_over(self, tmpdir, make_features):
+        data = make_features([Feature.BFD, Feature.BYTE_VAL_MEAN])
+        file = str(tmpdir.join("journal"))
+        with FeatureJournal(file, FeatureSet.feature_schema([Feature.BFD])) as journal:
+            fill_journal(journal, data)
+
+        with FeatureJournal(file, FeatureSet.feature_schema([Feature.BFD, Feature.BYTE_VAL_MEAN])) as journal:
+            assert len(journal) == 0
+
+    def test_different_byte_order_starts_over(self, tmpdir, make_features):
+        data = make_features([Feature.WFD])
+        schema = FeatureSet.feature_schema([Feature.WFD])
+        file = str(tmpdir.join("journal"))
+        with FeatureJournal(file, schema, _byteorder="little") as journal:
+            fill_journal(journal, data)
+
+        with FeatureJournal(file, schema, _byteorder="little") as journal:
+            assert len(journal) == len(data)
+        with FeatureJournal(file, schema, _byteorder="big") as journal:
+            assert len(journal) == 0
+
+    def test_digests_with_trailing_zeros(self, tmpdir, make_features):
+        data = make_features([Feature.BYTE_VAL_MEAN], _count=3)
+        schema = FeatureSet.feature_schema([Feature.BYTE_VAL_MEAN])
+        file = str(tmpdir.join("journal"))
+        hashes = ["00" * 28, "ab" * 27 + "00", "ab" * 28]
+        with FeatureJournal(file, schema) as journal:
+            for code_hash, features in zip(hashes, data.data.values()):
+                journal.append(code_hash, "BIN", features)
+
+        with FeatureJournal(file, schema) as journal:
+            assert all(code_hash in journal for code_hash in hashes)
+            assert "ab" * 27 + "01" not in journal
+            assert "00" * 27 + "01" not in journal
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from resyst.labels import LabelDictionary
+
+
+class TestLabelDictionary(object):
+    def test_ids(self):
+        labels = LabelDictionary()
+        assert labels.id("PDF") == 0
+        assert labels.id("TXT") == 1
+        assert labels.id("PDF") == 0
+        assert labels.ids(["TXT", "C"]) == (1, 2)
+        assert len(labels) == 3
+        assert "C" in labels
+        assert "BIN" not in labels
+
+    def test_names(self):
+        labels = LabelDictionary()
+        ids = labels.ids(["PDF", "TXT"])
+        assert labels.name(ids[1]) == "TXT"
+        assert labels.names(reversed(ids)) == ["TXT", "PDF"]
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import random
+
+import numpy as np
+import scipy.sparse
+import pytest
+parametrize = pytest.mark.parametrize
+
+from resyst.machine import SVMClassifier
+from resyst.machine import KNNClassifier
+from resyst.machine import DTClassifier
+from resyst.machine import RndClassifier
+from resyst.machine import SGDSVMClassifier
+from resyst.machine import NBClassifier
+from resyst.machine import PrototypeClassifier
+from resyst.machine import train_incrementally
+from resyst.machine import ApproxSVMClassifier
+from resyst.machine import APPROX_METHODS
+from resyst.machine import as_label_array
+from resyst.machine import confusion_matrix
+from resyst.machine import predict_in_chunks
+from resyst.features import Feature
+from resyst.features import FeatureData
+
+
+def make_feature_data(_count, _seed=0):
+    rnd = random.Random(_seed)
+    data = []
+    for i in range(_count):
+        label = ["PDF", "TXT", "BIN"][i % 3]
+        center = {"PDF": 0.1, "TXT": 0.5, "BIN": 0.9}[label]
+        data.append({
+            Feature.BYTE_VAL_MEAN: center + rnd.uniform(-0.05, 0.05),
+            Feature.SHANNON_ENTROPY: center + rnd.uniform(-0.05, 0.05),
+            Feature.LABEL: [label],
+        })
+    return FeatureData(data)
+
+
+class CountingEstimator(object):
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, _values):
+        self.calls.append(_values.shape[0])
+        column = _values[:, 0]
+        if scipy.sparse.issparse(column):
+            column = column.toarray()
+        return np.asarray(column).ravel() > 0
+
+
+class TestPrediction(object):
+    @parametrize("rows", [0, 5, 10, 23])
+    def test_predict_in_chunks(self, rows):
+        values = np.arange(rows * 2, dtype=np.float64).reshape((rows, 2)) - rows
+        estimator = CountingEstimator()
+        predicted = predict_in_chunks(estimator, values, _chunk_size=10)
+        assert predicted.tolist() == (values[:, 0] > 0).tolist()
+        assert all(size <= 10 for size in estimator.calls)
+
+    def test_predict_sparse_in_chunks(self):
+        values = scipy.sparse.csr_matrix(np.eye(25))
+        estimator = CountingEstimator()
+        predicted = predict_in_chunks(estimator, values, _chunk_size=7)
+        assert predicted.sum() == 1
+        assert estimator.calls == [7, 7, 7, 4]
+
+    def test_confusion_matrix(self):
+        expected = np.array(["A", "A", "B", "C", "C", "C"])
+        predicted = np.array(["A", "B", "B", "C", "A", "D"])
+        matrix, labels = confusion_matrix(expected, predicted)
+        assert labels.tolist() == ["A", "B", "C", "D"]
+        assert matrix.tolist() == [[1, 1, 0, 0],
+                                   [0, 1, 0, 0],
+                                   [1, 0, 1, 1],
+                                   [0, 0, 0, 0]]
+
+    @parametrize('labels', [["A", "B"], ["A", "C"], ["B", "C"]])
+    def test_confusion_matrix_unknown_labels(self, labels):
+        expected = np.array(["A", "B", "C"])
+        predicted = np.array(["A", "C", "C"])
+        with pytest.raises(AssertionError):
+            confusion_matrix(expected, predicted, labels)
+        matrix, _ = confusion_matrix(expected, predicted, ["A", "B", "C"])
+        assert matrix.sum() == 3
+
+    def test_label_array(self):
+        assert as_label_array([["PDF", "BIN"], [], "TXT"]).tolist() == ["PDF", "", "TXT"]
+
+
+class TestClassifiers(object):
+    @parametrize("classifier", [SVMClassifier(_C=256, _gamma=1), KNNClassifier(1), DTClassifier()])
+    def test_accuracy(self, classifier):
+        features = make_feature_data(300)
+        accuracy, results = classifier.test_accuracy(features, 0.8, chunk_size=16)
+        assert accuracy > 0.95
+        assert len(results) == 60
+        matrix, labels = classifier.confusion
+        assert labels.tolist() == ["BIN", "PDF", "TXT"]
+        assert matrix.sum() == 60
+        assert np.trace(matrix) == sum(1 for predicted, expected in results if predicted == expected)
+
+    def test_random_accuracy(self):
+        random.seed(1)
+        classifier = RndClassifier()
+        accuracy, results = classifier.test_accuracy(make_feature_data(300), 0.5)
+        assert len(results) == 150
+        assert 0.1 < accuracy < 0.6
+
+
+def make_batches(_count, _batch_size, _seed=0, _sparse=False):
+    rnd = np.random.RandomState(_seed)
+    labels = np.array(["PDF", "TXT", "BIN"])[rnd.randint(0, 3, _count)]
+    centers = {"PDF": [1.0, 0.0, 0.0], "TXT": [0.0, 1.0, 0.0], "BIN": [0.0, 0.0, 1.0]}
+    values = np.array([centers[l] for l in labels]) + rnd.uniform(0, 0.2, (_count, 3))
+    if _sparse:
+        values = scipy.sparse.csr_matrix(values)
+    return [(values[i:i + _batch_size], labels[i:i + _batch_size]) for i in range(0, _count, _batch_size)]
+
+
+class TestIncrementalClassifiers(object):
+    @parametrize("factory", [SGDSVMClassifier, NBClassifier, lambda: PrototypeClassifier(4)])
+    @parametrize("sparse", [False, True])
+    def test_progressive_accuracy(self, factory, sparse):
+        classifier = factory()
+        batches = make_batches(2000, 100, _sparse=sparse)
+        history = train_incrementally(classifier, batches, ["BIN", "PDF", "TXT"])
+        assert [seen for seen, _ in history] == list(range(100, 2001, 100))
+        assert history[0][1] is None
+        assert history[-1][1] > 0.9
+        predicted = classifier.predict(batches[0][0])
+        assert np.mean(predicted == batches[0][1]) > 0.9
+
+    def test_prototypes_of_rare_labels(self):
+        classifier = PrototypeClassifier(20)
+        batches = make_batches(30, 10)
+        for values, labels in batches:
+            classifier.partial_fit(values, labels, ["BIN", "PDF", "TXT"])
+        assert classifier.fitted
+        assert classifier.clusters == {}
+        values, labels = batches[0]
+        assert (classifier.predict(values) == labels).all()
+
+    def test_accuracy(self):
+        classifier = NBClassifier()
+        accuracy, results = classifier.test_accuracy(make_feature_data(600), 0.8, batch_size=50)
+        assert accuracy > 0.9
+        assert len(results) == 120
+
+
+class TestApproxSVMClassifier(object):
+    @parametrize("method", APPROX_METHODS)
+    def test_accuracy(self, method):
+        classifier = ApproxSVMClassifier(_C=256, _gamma=10, _method=method, _components=100)
+        accuracy, results = classifier.test_accuracy(make_feature_data(600), 0.8)
+        assert accuracy > 0.95
+        assert len(results) == 120
+        assert classifier.confusion[0].sum() == 120
+
+    @parametrize("method", APPROX_METHODS)
+    def test_sparse(self, method):
+        batches = make_batches(300, 300, _sparse=True)
+        values, labels = batches[0]
+        classifier = ApproxSVMClassifier(_method=method, _components=50).fit(values, labels)
+        assert classifier.model.named_steps['feature_map'].gamma == 1.0 / 3
+        assert np.mean(classifier.predict(values) == labels) > 0.9
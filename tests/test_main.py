@@ -5,6 +5,7 @@ parametrize = pytest.mark.parametrize
 
 from resyst import metadata
 from main import main
+from main import arg_parser
 
 
 class TestMain(object):
@@ -31,3 +32,26 @@ class TestMain(object):
         assert err == '{0} {1}\n'.format(metadata.project, metadata.version)
         # Should exit with zero return code.
         assert exc_info.value.code == 0
+
+
+class TestArgumentParser(object):
+    def test_option_strings_are_unique(self):
+        options = [option for action in arg_parser._actions for option in action.option_strings]
+        assert len(options) == len(set(options))
+
+    def test_train_options(self, tmpdir):
+        args = arg_parser.parse_args(["-a", "train", "-sd", str(tmpdir), "-ss", "512",
+                                      "-sq", "100", "-se", "7"])
+        assert args.source_directory == str(tmpdir)
+        assert args.segment_quota == 100
+        assert args.seed == 7
+
+    def test_test_options(self):
+        args = arg_parser.parse_args(["-a", "test", "-tf", "features", "-j", "4", "-sm", "halving",
+                                      "-sb", "1000", "-ka", "nystroem", "-ic", "-tb", "256"])
+        assert args.jobs == 4
+        assert args.search_mode == "halving"
+        assert args.search_budget == 1000
+        assert args.kernel_approximation == "nystroem"
+        assert args.incremental
+        assert args.training_batch_size == 256
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from sklearn.svm import SVC
+
+from resyst.search import SuccessiveHalvingSearch
+from resyst.search import stratified_order
+
+
+def make_samples(_count, _seed=0):
+    rnd = np.random.RandomState(_seed)
+    labels = np.array(["PDF", "TXT", "BIN"])[np.arange(_count) % 3]
+    centers = {"PDF": 0.1, "TXT": 0.5, "BIN": 0.9}
+    values = np.array([[centers[l], centers[l]] for l in labels]) + rnd.uniform(-0.2, 0.2, (_count, 2))
+    return values, labels
+
+
+class TestStratifiedOrder(object):
+    def test_prefixes_are_stratified(self):
+        labels = np.array(["A"] * 600 + ["B"] * 300 + ["C"] * 100)
+        order = stratified_order(labels, 1)
+        assert sorted(order.tolist()) == list(range(1000))
+        for size in [10, 100, 500]:
+            counts = [np.sum(labels[order[:size]] == l) for l in ["A", "B", "C"]]
+            assert abs(counts[0] - size * 0.6) <= 1
+            assert abs(counts[1] - size * 0.3) <= 1
+            assert abs(counts[2] - size * 0.1) <= 1
+
+
+class TestSuccessiveHalvingSearch(object):
+    def test_rounds(self):
+        values, labels = make_samples(900)
+        grid = [{'C': [1, 10, 100], 'gamma': [0.001, 1, 10], 'kernel': ['rbf']},
+                {'C': [1, 10], 'kernel': ['linear']}]
+        search = SuccessiveHalvingSearch(SVC(), grid, _cv=3, _random_state=0)
+        assert search.round_count == 3
+        search.fit(values, labels)
+
+        assert [len(candidates) for candidates, _, _ in search.rounds_] == [11, 4, 2]
+        assert [samples for _, samples, _ in search.rounds_] == [100, 300, 900]
+        assert search.best_params_ in search.rounds_[-1][0]
+        assert search.best_params_ != {'C': 1, 'gamma': 0.001, 'kernel': 'rbf'}
+        assert search.best_score_ > 0.8
+
+    def test_budget(self):
+        values, labels = make_samples(900)
+        grid = {'C': [1, 10, 100, 1000], 'kernel': ['linear']}
+        search = SuccessiveHalvingSearch(SVC(), grid, _budget=120, _factor=2, _cv=3,
+                                         _scoring='precision_macro', _random_state=0)
+        search.fit(values, labels)
+        assert [samples for _, samples, _ in search.rounds_] == [60, 120]
+        assert search.best_params_['kernel'] == 'linear'
+
+    def test_single_candidate(self):
+        values, labels = make_samples(90)
+        search = SuccessiveHalvingSearch(SVC(), {'C': [10]}, _cv=3).fit(values, labels)
+        assert len(search.rounds_) == 1
+        assert search.best_params_ == {'C': 10}
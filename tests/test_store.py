@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import scipy.sparse
+
+import pytest
+parametrize = pytest.mark.parametrize
+
+from resyst.features import Feature
+from resyst.features import FeatureData
+from resyst.store import FeatureStore
+from resyst.store import memory_map_matrix
+
+
+class TestFeatureStore(object):
+    @parametrize('features,sparse', [
+        ([Feature.BFD, Feature.SHANNON_ENTROPY, Feature.LONGEST_STREAK], False),
+        ([Feature.WFD, Feature.BYTE_VAL_MEAN], True),
+    ])
+    def test_round_trip(self, tmpdir, features, sparse, make_features):
+        data = make_features(features)
+        directory = str(tmpdir.join("features"))
+        data.save_features_to_store(directory)
+
+        store = FeatureData.load_features_from_store(directory)
+        assert len(store) == len(data)
+        assert store.sparse == sparse
+        assert store.columns == [(s.feature.name, s.width) for s in data.feature_schema().specs]
+        assert list(store.hashes) == list(data.data.keys())
+        assert store.label_names == ["EXE", "TXT"]
+        assert list(store.labels) == [d[Feature.LABEL][0] for d in data.data.values()]
+
+        expected, _ = data.to_feature_matrix2()
+        matrix, labels = store.to_feature_matrix()
+        if sparse:
+            expected, matrix = expected.toarray(), matrix.toarray()
+        assert np.allclose(matrix, expected)
+
+    @parametrize('features,seed', [
+        ([Feature.BFD, Feature.SHANNON_ENTROPY], None),
+        ([Feature.WFD], 1),
+    ])
+    def test_iter_batches(self, tmpdir, features, seed, make_features):
+        data = make_features(features, _count=11)
+        directory = str(tmpdir.join("features"))
+        store = data.save_features_to_store(directory)
+
+        matrix, labels = store.to_feature_matrix()
+        batches = list(store.iter_batches(4, _seed=seed))
+        assert [len(batch_labels) for _, batch_labels in batches] == [4, 4, 3]
+        rows = np.arange(11) if seed is None else np.random.RandomState(seed).permutation(11)
+        for i, (batch, batch_labels) in enumerate(batches):
+            expected = np.sort(rows[i * 4:(i + 1) * 4])
+            if store.sparse:
+                batch, expected_matrix = batch.toarray(), matrix[expected].toarray()
+            else:
+                expected_matrix = matrix[expected]
+            assert np.allclose(batch, expected_matrix)
+            assert list(batch_labels) == list(labels[expected])
+
+    def test_memory_mapped(self, tmpdir, make_features):
+        data = make_features([Feature.BFD])
+        directory = str(tmpdir.join("features"))
+        data.save_features_to_store(directory)
+
+        store = FeatureStore(directory)
+        assert isinstance(store.matrix, np.memmap)
+        assert store.matrix.dtype == np.float32
+        assert store.matrix.shape == (len(data), 256)
+
+    def test_overwrite(self, tmpdir, make_features):
+        directory = str(tmpdir.join("features"))
+        make_features([Feature.BFD]).save_features_to_store(directory)
+        make_features([Feature.BYTE_VAL_MEAN], _count=4).save_features_to_store(directory)
+
+        store = FeatureStore(directory)
+        assert len(store) == 4
+        assert store.columns == [("BYTE_VAL_MEAN", 1)]
+        assert not os.path.exists(directory + ".tmp")
+
+    def test_refuses_non_store(self, tmpdir, make_features):
+        with pytest.raises(AssertionError):
+            make_features([Feature.BFD]).save_features_to_store(str(tmpdir))
+
+
+def is_memory_mapped(_array):
+    while _array is not None:
+        if isinstance(_array, np.memmap):
+            return True
+        _array = getattr(_array, "base", None)
+    return False
+
+
+class TestMemoryMapMatrix(object):
+    def test_dense(self, tmpdir):
+        matrix = np.arange(12, dtype=np.float32).reshape((3, 4))
+        mapped = memory_map_matrix(matrix, str(tmpdir))
+        assert is_memory_mapped(mapped)
+        assert mapped.dtype == np.float64
+        assert (mapped == matrix).all()
+
+    def test_sparse(self, tmpdir):
+        matrix = scipy.sparse.random(20, 50, density=0.1, format="csr", dtype=np.float32, random_state=1)
+        mapped = memory_map_matrix(matrix, str(tmpdir))
+        assert scipy.sparse.isspmatrix_csr(mapped)
+        assert is_memory_mapped(mapped.data)
+        assert is_memory_mapped(mapped.indices)
+        assert (mapped != matrix).nnz == 0